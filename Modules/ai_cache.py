@@ -0,0 +1,59 @@
+# Cache of AI assistant answers
+#
+# an answer is reused for the same (normalized) question from the same user while the data
+# it was answered from is unchanged: the key hashes the scope ("role:user id", so answers are
+# never shared between users), a fingerprint of the context given to the model and the
+# question. Only complete model answers are stored, errors and interrupted streams are not.
+
+import hashlib, json, os, threading, unicodedata
+
+from Modules.cache import TTLCache
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTLCache(
+                    maxsize=int(os.getenv('AI_RESPONSE_CACHE_SIZE', 1024)),
+                    ttl=float(os.getenv('AI_RESPONSE_CACHE_TTL', 3600))
+                )
+    return _cache
+
+def normalize_question(question):
+    """Case and spacing insensitive form, trailing ?.! dropped: "What is my  average glucose?" ->
+    "what is my average glucose". Other punctuation is kept, "glucose > 200" and "glucose < 200"
+    or "-5" and "5" are different questions"""
+    question = ' '.join(unicodedata.normalize('NFKC', question).casefold().split())
+    return question.rstrip('?.! ')
+
+def context_version(context):
+    """Fingerprint of a context dict, changes with any value in it"""
+    data = json.dumps(context, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:16]
+
+def question_key(scope, context, question):
+    parts = [scope, context_version(context) if context else '', normalize_question(question)]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+def cached_stream(key, produce):
+    """Yield the cached answer for key, or stream produce() and cache the full answer once it
+    completed"""
+    cache = response_cache()
+    answer = cache.get(key)
+    if answer is not None:
+        yield answer
+        return
+    pieces = []
+    for piece in produce():
+        pieces.append(piece)
+        yield piece
+    answer = ''.join(pieces)
+    if answer:
+        cache.set(key, answer)
+
+def stats():
+    return response_cache().stats()
@@ -0,0 +1,138 @@
+# Model client for the AI assistants
+#
+# the app talks to a ModelClient, picked with AI_BACKEND (gemini by default). "stub" is a
+# local client that streams a canned answer, for working on the chat offline.
+# Answers are streamed: stream(prompt) yields text chunks as the model produces them and
+# ResponseCleaner strips HTML tags / markdown emphasis from them on the fly.
+
+import os, re, threading, time
+
+class ModelClient:
+    """Backend interface, subclass and add to BACKENDS for new backends"""
+
+    def stream(self, prompt):
+        """Yield the answer to prompt in chunks of text"""
+        raise NotImplementedError
+
+    def generate(self, prompt):
+        return ''.join(self.stream(prompt))
+
+
+class GeminiClient(ModelClient):
+
+    def __init__(self, api_key, model_name):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def stream(self, prompt):
+        for chunk in self.model.generate_content(prompt, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue    # chunk without text (finish / safety info only)
+            yield text
+
+
+class StubClient(ModelClient):
+    """Offline stand in: a fixed answer quoting the question, streamed word by word"""
+
+    ANSWER = ("This is the **offline assistant** (AI_BACKEND=stub), no model was called. "
+              "Your question was: <q>{question}</q>. The prompt had {lines} lines of context. "
+              "Please consult your healthcare provider for medical advice.")
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+
+    def stream(self, prompt):
+        question = prompt.rsplit(':', 1)[-1].strip()
+        answer = self.ANSWER.format(question=question, lines=prompt.count('\n'))
+        for word in re.findall(r'\S+\s*', answer):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word
+
+
+def _gemini():
+    api_key = os.getenv('GOOGLE_API_KEY')
+    if not api_key:
+        raise RuntimeError("Google API key not found in environment variables")
+    return GeminiClient(api_key, os.getenv('AI_MODEL_NAME', 'gemini-2.5-flash-lite'))
+
+BACKENDS = {
+    'gemini': _gemini,
+    'stub': lambda: StubClient(float(os.getenv('AI_STUB_DELAY', 0.02))),
+}
+
+_client = None
+_client_error = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Configured client (AI_BACKEND, default gemini), one per process. None if it can't be set
+    up, init_error() says why"""
+    global _client, _client_error
+    if _client is None and _client_error is None:
+        with _client_lock:
+            if _client is None and _client_error is None:
+                backend = os.getenv('AI_BACKEND', 'gemini')
+                try:
+                    if backend not in BACKENDS:
+                        raise ValueError(f"Unknown AI backend: {backend}")
+                    _client = BACKENDS[backend]()
+                except Exception as e:
+                    _client_error = str(e)
+    return _client
+
+def init_error():
+    return _client_error
+
+
+TAG = re.compile(r'<[^>]+>')
+MAX_TAG = 500   # a '<' without '>' this far on is text, not a tag
+
+class ResponseCleaner:
+    """Incremental version of the answer cleanup (drop <tags>, '*', surrounding whitespace).
+
+    feed() returns the cleaned text that is safe to show so far; text that may still turn out
+    to be part of a tag or trailing whitespace is held back until the next chunk or finish().
+    """
+
+    def __init__(self):
+        self.pending = ''
+        self.started = False
+
+    def feed(self, chunk):
+        self.pending += chunk
+        self.pending = TAG.sub('', self.pending)
+        held = ''
+        tag_start = self.pending.find('<')
+        if tag_start != -1 and len(self.pending) - tag_start <= MAX_TAG:
+            self.pending, held = self.pending[:tag_start], self.pending[tag_start:]
+        text = self.pending.replace('*', '')
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        # trailing whitespace only goes out once something follows it
+        stripped = text.rstrip()
+        self.pending = text[len(stripped):] + held
+        return stripped
+
+    def finish(self):
+        text, self.pending = self.pending.replace('*', '').rstrip(), ''
+        return text.lstrip() if not self.started else text
+
+def clean_stream(chunks):
+    """Cleaned text pieces of a chunk stream, empty pieces skipped"""
+    cleaner = ResponseCleaner()
+    for chunk in chunks:
+        text = cleaner.feed(chunk)
+        if text:
+            yield text
+    text = cleaner.finish()
+    if text:
+        yield text
+
+def clean_response(text):
+    """The whole-answer cleanup clean_stream does incrementally"""
+    return TAG.sub('', text).replace('*', '').strip()
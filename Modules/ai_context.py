@@ -0,0 +1,170 @@
+# Patient context for the AI assistant, built from the patient aggregate (patient_data)
+#
+# the context is memoized per patient together with the data version (and load time) of the
+# aggregate it was built from, so chat messages without writes in between reuse it as is.
+# After a write only the parts built from the reloaded sections are rebuilt, see PART_SECTIONS.
+
+import os, threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from Modules.cache import TTLCache
+
+RECENT_RECORDS_DAYS = 365
+RECENT_RECORDS_LIMIT = 20
+SUMMARY_LIMIT = 10
+
+def empty_context():
+    return {
+        'patient_basic_info': {},
+        'recent_records': [],
+        'vital_trends': [],
+        'allergies': [],
+        'files_summary': [],
+        'images_summary': [],
+        'health_patterns': {}
+    }
+
+def basic_info_part(patient):
+    basic_info = patient.basic_info
+    return {'patient_basic_info': {
+        'name': basic_info['name'],
+        'age': basic_info['age'],
+        'gender': basic_info['gender'],
+        'blood_group': basic_info['blood_group'],
+        'height_cm': basic_info['height_cm'],
+        'weight_kg': basic_info['weight_kg'],
+        'bmi': basic_info['bmi'],
+        'health_streak': basic_info['health_streak'],
+        'phone': basic_info['phone'],
+        'emergency_contact': basic_info['emergency_contact'],
+        'emergency_phone': basic_info['emergency_phone'],
+        'has_insurance': bool(basic_info['insurance_provider'])
+    }}
+
+def records_part(patient):
+    """recent_records, vital_trends and health_patterns, all derived from the records"""
+    # last 12 months, newest 20
+    year_ago = date.today() - timedelta(days=RECENT_RECORDS_DAYS)
+    records = [r for r in patient.medical_records if r[1] >= year_ago][:RECENT_RECORDS_LIMIT]
+    recent_records = [{
+        'date': record[1].strftime('%Y-%m-%d'),
+        'diagnosis': record[2],
+        'treatment': record[3],
+        'prescription': record[4],
+        'notes': record[5],
+        'doctor': f"Dr. {record[12]} {record[13]}" if record[12] else "Unknown",
+        'specialization': record[14],
+        'vitals': {
+            'glucose': record[6],
+            'bp_systolic': record[7],
+            'bp_diastolic': record[8],
+            'heart_rate': record[9],
+            'temperature': record[10]
+        }
+    } for record in records]
+
+    # last 6 months
+    vitals = patient.vital_trends
+    vital_trends = [{
+        'date': vital[0].strftime('%Y-%m-%d'),
+        'glucose': vital[1],
+        'bp_systolic': vital[2],
+        'bp_diastolic': vital[3],
+        'heart_rate': vital[4],
+        'temperature': vital[5]
+    } for vital in vitals]
+
+    health_patterns = {}
+    if vitals:
+        glucose_values = [v[1] for v in vitals if v[1] is not None]
+        bp_sys_values = [v[2] for v in vitals if v[2] is not None]
+        heart_rate_values = [v[4] for v in vitals if v[4] is not None]
+
+        health_patterns = {
+            'glucose_avg': round(sum(glucose_values)/len(glucose_values), 1) if glucose_values else None,
+            'glucose_trend': 'stable',  # Could add trend analysis
+            'bp_avg': round(sum(bp_sys_values)/len(bp_sys_values), 0) if bp_sys_values else None,
+            'heart_rate_avg': round(sum(heart_rate_values)/len(heart_rate_values), 0) if heart_rate_values else None,
+            'total_visits': len(records),
+            'recent_diagnoses': list(set([r[2] for r in records[:5] if r[2]])),
+            'frequent_medications': []  # Could analyze prescription patterns
+        }
+    return {'recent_records': recent_records, 'vital_trends': vital_trends, 'health_patterns': health_patterns}
+
+def allergies_part(patient):
+    return {'allergies': [{'name': allergy[0], 'severity': allergy[1], 'notes': allergy[2]}
+                          for allergy in patient.allergies]}
+
+def files_part(patient):
+    return {'files_summary': [{
+        'name': file[0],
+        'category': file[2],
+        'description': file[3],
+        'date': file[4].strftime('%Y-%m-%d')
+    } for file in patient.medical_files[:SUMMARY_LIMIT]]}
+
+def images_part(patient):
+    return {'images_summary': [{
+        'name': image[0],
+        'type': image[1],
+        'description': image[2],
+        'date': image[3].strftime('%Y-%m-%d')
+    } for image in patient.medical_images[:SUMMARY_LIMIT]]}
+
+# aggregate section -> builder of the context keys that depend on it
+PART_SECTIONS = {
+    'basic_info': basic_info_part,
+    'medical_records': records_part,
+    'allergies': allergies_part,
+    'medical_files': files_part,
+    'medical_images': images_part,
+}
+
+@dataclass
+class _Memo:
+    stamp: tuple        # (version, loaded_at) of the aggregate the context was built from
+    sources: dict       # section -> the aggregate's section object the part was built from
+    parts: dict         # section -> context keys built from it
+    context: dict
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def context_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                # the TTL also covers the date based parts (age, 12 / 6 month windows)
+                _cache = TTLCache(
+                    maxsize=int(os.getenv('AI_CONTEXT_CACHE_SIZE', 256)),
+                    ttl=float(os.getenv('AI_CONTEXT_TTL', 900))
+                )
+    return _cache
+
+def build_context(patient, previous=None):
+    """_Memo for the aggregate, reusing the parts of previous whose section is unchanged"""
+    sources, parts, context = {}, {}, empty_context()
+    for section, build in PART_SECTIONS.items():
+        source = getattr(patient, section)
+        if previous is not None and previous.sources.get(section) is source:
+            part = previous.parts[section]
+        else:
+            part = build(patient)
+        sources[section] = source
+        parts[section] = part
+        context.update(part)
+    return _Memo((patient.version, patient.loaded_at), sources, parts, context)
+
+def patient_context(patient):
+    """AI context of a PatientAggregate (treat as read only, it is shared between messages)"""
+    if patient is None:
+        return empty_context()
+    cache = context_cache()
+    memo = cache.get(patient.patient_id)
+    if memo is not None and memo.stamp == (patient.version, patient.loaded_at):
+        return memo.context
+    memo = build_context(patient, memo)
+    cache.set(patient.patient_id, memo)
+    return memo.context
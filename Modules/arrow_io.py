@@ -0,0 +1,171 @@
+# Parquet / Arrow import and export of medical records
+#
+# typed, compressed, columnar interchange for hospital data teams. Typed columns go straight
+# to the records without parsing; columns written as text (e.g. a CSV converted as is) fall
+# back to the template parser's conversions. Files are read and written batch by batch.
+#
+# pyarrow comes with streamlit, no extra dependency.
+
+import io, os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from Modules import templates
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+EXTENSIONS = PARQUET_EXTENSIONS + ARROW_EXTENSIONS
+
+FIRST_ROW = 1   # rows in the error report are 1 based record numbers, no header row
+
+# export layout, same types as the medical_records table
+RECORD_SCHEMA = pa.schema([
+    ('record_id', pa.int64()),
+    ('patient_id', pa.string()),
+    ('doctor_id', pa.string()),
+    ('visit_date', pa.date32()),
+    ('diagnosis', pa.string()),
+    ('treatment', pa.string()),
+    ('prescription', pa.string()),
+    ('notes', pa.string()),
+    ('glucose_level', pa.decimal128(5, 2)),
+    ('blood_pressure_systolic', pa.int32()),
+    ('blood_pressure_diastolic', pa.int32()),
+    ('heart_rate', pa.int32()),
+    ('temperature', pa.decimal128(4, 1)),
+    ('created_at', pa.timestamp('s')),
+])
+
+EXPORT_QUERY = f'''
+    SELECT {', '.join(RECORD_SCHEMA.names)} FROM medical_records
+    WHERE {{column}} = %s ORDER BY visit_date, record_id
+'''
+
+def export_batch_rows():
+    return int(os.getenv('ARROW_BATCH_ROWS', 50000))
+
+def is_columnar(file_name):
+    return (file_name or '').lower().endswith(EXTENSIONS)
+
+# export
+def write_records_parquet(cursor, column, value, batch_rows=None):
+    """Parquet (zstd) bytes of the medical_records where column = value, fetched and written
+    batch_rows at a time"""
+    if column not in ('patient_id', 'doctor_id'):
+        raise ValueError(f"Can't export records by {column}")
+    batch_rows = batch_rows or export_batch_rows()
+    cursor.execute(EXPORT_QUERY.format(column=column), (value,))
+    output = io.BytesIO()
+    with pq.ParquetWriter(output, RECORD_SCHEMA, compression='zstd') as writer:
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, RECORD_SCHEMA)],
+                schema=RECORD_SCHEMA))
+    return output.getvalue()
+
+# import
+def open_batches(source, file_name, batch_rows=None):
+    """(total rows, iterator of RecordBatches) of a Parquet / Arrow IPC file (path or binary file).
+    The total is None for Arrow files, they only know it once read"""
+    batch_rows = batch_rows or templates.chunk_rows()
+    if file_name.lower().endswith(PARQUET_EXTENSIONS):
+        parquet_file = pq.ParquetFile(source)
+        return parquet_file.metadata.num_rows, parquet_file.iter_batches(batch_size=batch_rows)
+    try:
+        reader = pa.ipc.open_file(source)
+        return None, (reader.get_batch(index) for index in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        # stream format (no footer)
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        reader = pa.ipc.open_stream(source)
+        return None, iter(reader)
+
+def count_rows(source, file_name):
+    return open_batches(source, file_name)[0]
+
+def _column(batch, names, column):
+    index = names.get(column)
+    return None if index is None else batch.column(index)
+
+def _text(array, index):
+    if array is None:
+        return pd.Series(pd.NA, index=index, dtype='string')
+    return templates.clean_text(pc.cast(array, pa.string()).to_pandas().set_axis(index))
+
+def _number(array, index):
+    """(column as read, converted floats)"""
+    if array is None or not (pa.types.is_integer(array.type) or pa.types.is_floating(array.type)
+                             or pa.types.is_decimal(array.type)):
+        column = _text(array, index)
+        return column, pd.to_numeric(column, errors='coerce')
+    column = pc.cast(array, pa.float64()).to_pandas().set_axis(index)
+    return column, column
+
+def _date(array, index):
+    """(column as read, converted datetimes)"""
+    if array is None or not (pa.types.is_date(array.type) or pa.types.is_timestamp(array.type)):
+        column = _text(array, index)
+        return column, templates.parse_dates(column)
+    column = pc.cast(array, pa.timestamp('s')).to_pandas().set_axis(index).astype('datetime64[ns]')
+    return column, column
+
+def batch_records(batch, start):
+    """(records, rows, row_errors) of one RecordBatch whose first row is data row start"""
+    normalized = templates.normalize_columns(pd.Index(batch.schema.names))
+    mapping = templates.map_columns(pd.DataFrame(columns=normalized))
+    names = {mapping[name]: position for position, name in enumerate(normalized) if name in mapping}
+
+    index = pd.RangeIndex(start, start + batch.num_rows)
+    frame = pd.DataFrame(index=index)
+    for column in ['patient_id'] + list(templates.TEXT_COLUMNS):
+        frame[column] = _text(_column(batch, names, column), index)
+    frame['visit_date'], visit_dates = _date(_column(batch, names, 'visit_date'), index)
+    vitals = {}
+    for column in templates.VITAL_COLUMNS:
+        frame[column], vitals[column] = _number(_column(batch, names, column), index)
+    return templates.build_records(frame[templates.RECORD_COLUMNS], visit_dates, vitals, first_row=FIRST_ROW)
+
+def check_columns(schema):
+    missing_required = templates.missing_required_columns(pd.Index(schema.names))
+    if missing_required:
+        raise ValueError(f"Missing required columns: {', '.join(missing_required)}")
+
+def iter_arrow_chunks(source, file_name, size=None, skip_rows=0):
+    """iter_template_chunks for Parquet / Arrow files, yields templates.TemplateChunks"""
+    _, batches = open_batches(source, file_name, size)
+    start = 0
+    for batch in batches:
+        if start == 0:
+            check_columns(batch.schema)
+        end = start + batch.num_rows
+        if end > skip_rows:
+            first = max(start, skip_rows)
+            records, rows, row_errors = batch_records(batch.slice(first - start), first)
+            yield templates.TemplateChunk(start, end, records, rows, row_errors)
+        start = end
+
+def preview(uploaded_file, sample_rows=templates.PREVIEW_SAMPLE_ROWS):
+    """templates.preview_template for Parquet / Arrow uploads: (records or None, message, row_errors)"""
+    try:
+        uploaded_file.seek(0)
+        total, batches = open_batches(uploaded_file, uploaded_file.name, sample_rows)
+        batch = next(batches, None)
+        if batch is None:
+            return None, "The file has no records", []
+        check_columns(batch.schema)
+        batch = batch.slice(0, sample_rows)
+        records, _, row_errors = batch_records(batch, 0)
+        of_total = f" of {total}" if total is not None else ""
+        return records, f"Parsed {len(records)} records from the first {batch.num_rows}{of_total} rows", row_errors
+    except Exception as e:
+        return None, f"Error reading file: {str(e)}", []
+    finally:
+        uploaded_file.seek(0)
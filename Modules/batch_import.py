@@ -0,0 +1,102 @@
+# Bulk insert of medical records (batch upload)
+#
+# records go in as multi-row INSERTs (executemany) of batch_size rows, committed per chunk.
+# a chunk that fails is rolled back to its savepoint and split in halves until the bad rows
+# are isolated, so one bad row costs ~log2(batch_size) extra statements instead of the chunk.
+
+import os, time
+from dataclasses import dataclass, field
+
+import mysql.connector
+
+INSERT_RECORD = '''
+    INSERT INTO medical_records (patient_id, doctor_id, visit_date, diagnosis, treatment,
+                                 prescription, notes, glucose_level, blood_pressure_systolic,
+                                 blood_pressure_diastolic, heart_rate, temperature)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+'''
+
+# the connection itself is gone, retrying smaller pieces can't help
+FATAL_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+def batch_size():
+    return int(os.getenv('BATCH_INSERT_SIZE', 1000))
+
+def record_params(record_data, doctor_id):
+    return (record_data.get('patient_id'), doctor_id, record_data.get('visit_date'),
+            record_data.get('diagnosis'), record_data.get('treatment'),
+            record_data.get('prescription'), record_data.get('notes'),
+            record_data.get('glucose_level'), record_data.get('blood_pressure_systolic'),
+            record_data.get('blood_pressure_diastolic'), record_data.get('heart_rate'),
+            record_data.get('temperature'))
+
+def patient_key(patient_id):
+    """patient_id as MySQL compares it (case insensitive collation)"""
+    return str(patient_id).casefold()
+
+def existing_patient_ids(cursor, patient_ids, chunk_size=1000):
+    """patient_keys of the given patient IDs that exist, one IN query per chunk_size distinct IDs.
+    Check membership with patient_key(patient_id)"""
+    patient_ids = sorted({str(patient_id) for patient_id in patient_ids if patient_id})
+    existing = set()
+    for start in range(0, len(patient_ids), chunk_size):
+        chunk = patient_ids[start:start + chunk_size]
+        cursor.execute(f"SELECT patient_id FROM patients WHERE patient_id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        existing.update(patient_key(row[0]) for row in cursor.fetchall())
+    return existing
+
+@dataclass
+class ImportResult:
+    inserted: int = 0
+    failed: list = field(default_factory=list)     # [(record index, error message)]
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.inserted / self.seconds if self.seconds else 0.0
+
+def _insert_rows(cursor, rows, result, depth=0):
+    """rows: [(record index, params)]. Inserts what it can, failures go to result.failed"""
+    savepoint = f'batch_rows_{depth}'
+    cursor.execute(f'SAVEPOINT {savepoint}')
+    try:
+        cursor.executemany(INSERT_RECORD, [params for _, params in rows])
+        cursor.execute(f'RELEASE SAVEPOINT {savepoint}')
+        result.inserted += len(rows)
+        return
+    except FATAL_ERRORS:
+        raise
+    except mysql.connector.Error as e:
+        cursor.execute(f'ROLLBACK TO SAVEPOINT {savepoint}')
+        if len(rows) == 1:
+            result.failed.append((rows[0][0], str(e)))
+            return
+
+    middle = len(rows) // 2
+    _insert_rows(cursor, rows[:middle], result, depth + 1)
+    _insert_rows(cursor, rows[middle:], result, depth + 1)
+
+def insert_records(conn, records_data, doctor_id, size=None, progress=None, start=0, before_commit=None):
+    """Insert records_data[start:] in chunks of size rows, committing each chunk. Returns an ImportResult.
+    progress(done, total) is called after every chunk. before_commit(cursor, done, result) runs in
+    the chunk's transaction, e.g. to save a checkpoint that commits together with the rows."""
+    size = size or batch_size()
+    result = ImportResult()
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    try:
+        for offset in range(start, len(records_data), size):
+            chunk = [(index, record_params(record_data, doctor_id))
+                     for index, record_data in enumerate(records_data[offset:offset + size], start=offset)]
+            _insert_rows(cursor, chunk, result)
+            done = min(offset + size, len(records_data))
+            if before_commit:
+                before_commit(cursor, done, result)
+            conn.commit()
+            if progress:
+                progress(done, len(records_data))
+    finally:
+        cursor.close()
+        result.seconds = time.perf_counter() - started
+    result.failed.sort()
+    return result
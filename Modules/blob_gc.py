@@ -0,0 +1,70 @@
+# Deletes blobs nothing references any more
+# a blob is kept while a medical file / image or an import job points at it, and for
+# BLOB_GC_GRACE_HOURS after it was last stored: an upload of content that is already stored
+# only touches the blob and inserts its row afterwards. Blobs of uploads whose rows were
+# never inserted (e.g. the database was down) end up here.
+#
+#   python -m Modules.blob_gc
+
+import argparse, itertools, os, time
+import mysql.connector
+from Modules import db, blobstore
+
+REFERENCES = (
+    ('medical_files', 'blob_ref'),
+    ('medical_images', 'blob_ref'),
+    ('import_jobs', 'payload_ref'),
+)
+
+def grace_seconds():
+    return float(os.getenv('BLOB_GC_GRACE_HOURS', 24)) * 3600
+
+def referenced_keys(cursor, keys):
+    """The keys some row points at"""
+    in_list = ', '.join(['%s'] * len(keys))
+    found = set()
+    for table, column in REFERENCES:
+        cursor.execute(f'SELECT DISTINCT {column} FROM {table} WHERE {column} IN ({in_list})', list(keys))
+        found.update(row[0] for row in cursor.fetchall())
+    return found
+
+def sweep(store=None, grace=None, batch_size=1000, log=print):
+    """Delete unreferenced blobs not stored within grace seconds, returns how many"""
+    store = store or blobstore.get_blob_store()
+    grace = grace_seconds() if grace is None else grace
+    deleted = 0
+    keys = store.keys()
+    with db.cursor() as cursor:
+        while True:
+            batch = list(itertools.islice(keys, batch_size))
+            if not batch:
+                break
+            cutoff = time.time() - grace
+            candidates = [key for key in batch if (store.modified_at(key) or cutoff) < cutoff]
+            if not candidates:
+                continue
+            in_use = referenced_keys(cursor, candidates)
+            for key in candidates:
+                # checked again right before deleting, a put in between touches the blob
+                if key not in in_use and (store.modified_at(key) or cutoff) < cutoff:
+                    store.delete(key)
+                    deleted += 1
+    if deleted:
+        log(f"Deleted {deleted} unreferenced blob(s)")
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete blobs no file, image or import job references")
+    parser.add_argument('--grace-hours', type=float, help="keep blobs stored within this many hours (BLOB_GC_GRACE_HOURS)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    try:
+        sweep(grace=args.grace_hours * 3600 if args.grace_hours is not None else None)
+    except mysql.connector.Error as e:
+        print(f"Sweep stopped: {e}. Run again to continue.")
+
+if __name__ == "__main__":
+    main()
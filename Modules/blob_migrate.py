@@ -0,0 +1,82 @@
+# Moves file / image content out of MySQL into the blob store
+# works in batches and only touches rows without a blob_ref, so it can be
+# stopped and started again at any point.
+#
+#   python -m Modules.blob_migrate --batch-size 100
+
+import argparse
+import mysql.connector
+from Modules import db, blobstore
+
+TABLES = {
+    'files': ('medical_files', 'file_id', 'file_data', 'file_hash', 'file_size'),
+    'images': ('medical_images', 'image_id', 'image_data', 'image_hash', 'image_size'),
+}
+
+def migrate_table(kind, batch_size=100, store=None, log=print):
+    """Move one table's blobs, returns (moved, skipped)"""
+    table, id_column, data_column, hash_column, size_column = TABLES[kind]
+    store = store or blobstore.get_blob_store()
+    moved = skipped = 0
+    last_id = 0
+
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute(f'''
+                    SELECT {id_column} FROM {table}
+                    WHERE blob_ref IS NULL AND {data_column} IS NOT NULL AND {id_column} > %s
+                    ORDER BY {id_column} LIMIT %s
+                ''', (last_id, batch_size))
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+
+                # one blob in memory at a time
+                for row_id in ids:
+                    cursor.execute(f'SELECT {data_column}, {hash_column} FROM {table} WHERE {id_column} = %s',
+                                   (row_id,))
+                    data, known_hash = cursor.fetchone()
+                    # checked before writing, a skipped row leaves nothing behind in the store
+                    key = blobstore.content_key(data)
+                    if known_hash and known_hash != key:
+                        log(f"{table} {row_id}: content does not match stored hash, skipped")
+                        skipped += 1
+                        continue
+                    store.put(data)
+
+                    cursor.execute(f'''
+                        UPDATE {table} SET blob_ref = %s, {hash_column} = %s, {size_column} = %s, {data_column} = NULL
+                        WHERE {id_column} = %s AND blob_ref IS NULL
+                    ''', (key, key, len(data), row_id))
+                    moved += 1
+
+                conn.commit()
+                last_id = ids[-1]
+                log(f"{table}: moved {moved} so far (last id {last_id})")
+        finally:
+            cursor.close()
+    return moved, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description="Move medical file/image blobs from MySQL to the blob store")
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--table', choices=['files', 'images', 'all'], default='all')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    kinds = list(TABLES) if args.table == 'all' else [args.table]
+    try:
+        for kind in kinds:
+            moved, skipped = migrate_table(kind, args.batch_size)
+            print(f"{TABLES[kind][0]}: {moved} moved, {skipped} skipped")
+    except mysql.connector.Error as e:
+        print(f"Migration stopped: {e}. Run again to continue where it stopped.")
+        return
+    print("Done. Run OPTIMIZE TABLE medical_files, medical_images to give the space back to the filesystem.")
+
+if __name__ == "__main__":
+    main()
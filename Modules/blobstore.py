@@ -0,0 +1,162 @@
+# Content addressed blob storage for medical files and images
+# objects are keyed by the sha256 of their content, so the same upload is stored once.
+# tables only keep the key (blob_ref), see migration 5.
+
+import hashlib, io, os, re, tempfile, threading
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def content_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+class BlobStore:
+    """Storage backend interface, subclass and add to BACKENDS for new backends"""
+
+    def put(self, data):
+        raise NotImplementedError
+
+    def put_stream(self, chunks):
+        """Store an iterable of byte chunks, returns (key, size)"""
+        data = b''.join(chunks)
+        return self.put(data), len(data)
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def open(self, key):
+        return io.BytesIO(self.get(key))
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def modified_at(self, key):
+        """Time the blob was last stored (a put of the same content counts), None if missing"""
+        raise NotImplementedError
+
+    def keys(self):
+        """Iterate over the keys of all stored blobs"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under a root directory: <root>/ab/cd/abcd...."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        if not KEY_PATTERN.match(key or ''):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def touch(self, key):
+        """Mark an existing blob as just stored, False if it doesn't exist"""
+        try:
+            os.utime(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def modified_at(self, key):
+        try:
+            return os.path.getmtime(self.path(key))
+        except FileNotFoundError:
+            return None
+
+    def put(self, data):
+        key = content_key(data)
+        if self.touch(key):
+            return key  # already stored (dedup)
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename, readers never see half written blobs
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return key
+
+    # hashes and writes chunk by chunk, the whole blob is never in memory
+    def put_stream(self, chunks):
+        temp_dir = os.path.join(self.root, '.tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, prefix='upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+                    size += len(chunk)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+
+            key = digest.hexdigest()
+            path = self.path(key)
+            if self.touch(key):
+                os.remove(temp_path)    # already stored (dedup)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            return key, size
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as blob_file:
+                return blob_file.read()
+        except FileNotFoundError:
+            return None
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def keys(self):
+        for directory, subdirectories, file_names in os.walk(self.root):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+            yield from (name for name in file_names if KEY_PATTERN.match(name))
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {
+    'local': lambda: LocalBlobStore(os.getenv('BLOB_STORE_PATH', 'blob_store')),
+}
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store():
+    """Configured store (BLOB_STORE_BACKEND, default local), one per process"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = os.getenv('BLOB_STORE_BACKEND', 'local')
+                if backend not in BACKENDS:
+                    raise ValueError(f"Unknown blob store backend: {backend}")
+                _store = BACKENDS[backend]()
+    return _store
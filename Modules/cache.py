@@ -0,0 +1,88 @@
+# In-process TTL + LRU cache
+
+import threading, time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread safe cache, entries expire after ttl seconds and the least recently used is evicted past maxsize"""
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0            # bumped by every invalidation, see get_or_load
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """Cached value or loader() result; None results are not cached.
+
+        A value loaded while an invalidation happened is returned but not stored,
+        so a read racing a write can never put stale data back in the cache.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            generation = self._generation
+        value = loader()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._store(key, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
@@ -2,17 +2,228 @@
 
 import streamlit as st
 import mysql.connector, os
+import threading, time
+from collections import deque
+from contextlib import contextmanager
+
+# pooled connection, close() gives it back to the pool instead of closing the socket
+class PooledConnection:
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.checked_out = False
+
+    def close(self):
+        if self.checked_out:
+            self._pool.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ConnectionPool:
+    """Process wide, size bounded pool of mysql connections"""
+
+    def __init__(self, size=10, timeout=30.0, recycle=1800.0, pre_ping=30.0, **connect_args):
+        self.size = size
+        self.timeout = timeout          # seconds to wait for a free connection
+        self.recycle = recycle          # reconnect connections older than this (seconds)
+        self.pre_ping = pre_ping        # ping connections idle longer than this before handing out
+        self.connect_args = connect_args
+
+        self._idle = deque()
+        self._opened = 0
+        self._cond = threading.Condition()
+
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = PooledConnection(self, mysql.connector.connect(**self.connect_args))
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _discard(self, pooled):
+        try:
+            pooled._conn.close()
+        except Exception:
+            pass
+
+    # recycling old connections and pinging idle ones
+    def _validate(self, pooled):
+        now = time.monotonic()
+        if self.recycle and now - pooled.created_at > self.recycle:
+            self._discard(pooled)
+            with self._cond:
+                self._recycled += 1
+            return self._connect()
+
+        if self.pre_ping is not None and now - pooled.last_used > self.pre_ping:
+            try:
+                pooled._conn.ping(reconnect=False)
+            except mysql.connector.Error:
+                self._discard(pooled)
+                with self._cond:
+                    self._ping_failures += 1
+                return self._connect()
+        return pooled
+
+    def checkout(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        pooled = None
+
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if self._opened < self.size:
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise mysql.connector.errors.PoolError(
+                            f"No free database connection after {self.timeout:g}s (pool size {self.size})")
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+        try:
+            pooled = self._connect() if pooled is None else self._validate(pooled)
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        pooled.checked_out = True
+        return pooled
+
+    def release(self, pooled):
+        pooled.checked_out = False
+        pooled.last_used = time.monotonic()
+
+        # don't leak an open transaction (or its read snapshot) to the next user
+        healthy = True
+        try:
+            if pooled._conn.in_transaction:
+                pooled._conn.rollback()
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            if healthy:
+                self._idle.append(pooled)
+            else:
+                self._opened -= 1
+            self._cond.notify()
+
+        if not healthy:
+            self._discard(pooled)
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def metrics(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._opened - len(self._idle),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+                'avg_checkout_ms': round(self._wait_total / self._checkouts * 1000, 2) if self._checkouts else 0.0,
+                'max_checkout_ms': round(self._wait_max * 1000, 2)
+            }
+
+    def dispose(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._opened -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# pool is created on first use so .env is already loaded by then
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=int(os.getenv('DB_POOL_SIZE', 10)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+                    recycle=float(os.getenv('DB_POOL_RECYCLE', 1800)),
+                    pre_ping=float(os.getenv('DB_POOL_PRE_PING', 30)),
+                    host=os.getenv('DB_HOST', 'localhost'),
+                    database=os.getenv('DB_NAME', 'medical_records'),
+                    user=os.getenv('DB_USER', 'root'),
+                    password=os.getenv('DB_PASSWORD', '')
+                )
+    return _pool
+
+@contextmanager
+def connection():
+    """Checkout a pooled connection and return it when the block ends"""
+    with get_pool().connection() as conn:
+        yield conn
+
+@contextmanager
+def cursor(*args, **kwargs):
+    """Checkout a pooled connection and yield a cursor on it"""
+    with connection() as conn:
+        cur = conn.cursor(*args, **kwargs)
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+def pool_metrics():
+    return get_pool().metrics()
 
 # connecting mysql database..
 def db_connection():
     try:
-        conn = mysql.connector.connect(
-            host=os.getenv('DB_HOST', 'localhost'),
-            database=os.getenv('DB_NAME', 'medical_records'),
-            user=os.getenv('DB_USER', 'root'),
-            password=os.getenv('DB_PASSWORD', '')
-        )
-        return conn
+        return get_pool().checkout()
     except mysql.connector.Error as err:
         st.error(f"Database connection error: {err}")
-        return None
\ No newline at end of file
+        return None
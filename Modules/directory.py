@@ -0,0 +1,148 @@
+# Doctor directory with facet counts
+#
+# the doctors table is small, so the whole directory is kept in memory as an immutable
+# index: facet value -> doctor ids for specialization, hospital and experience bucket.
+# combined facet filters are set intersections, the counts of every facet come back with
+# the results. register_doctor calls invalidate() so the next search reloads it, other
+# processes' changes show up after DIRECTORY_REFRESH seconds.
+
+import os, threading, time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from Modules import db
+from Modules.search import PAGE_SIZE, SearchPage
+
+DOCTOR_COLUMNS = '''doctor_id, first_name, last_name, email, phone, specialization,
+                    hospital, experience_years, license_number, created_at'''
+
+# (label, from years, to years exclusive)
+EXPERIENCE_BUCKETS = [
+    ("0-5 years", 0, 5),
+    ("5-10 years", 5, 10),
+    ("10-20 years", 10, 20),
+    ("20+ years", 20, None),
+]
+
+FACETS = ('specialization', 'hospital', 'experience')
+
+# sort label -> (key of a doctor row, reverse)
+ORDERS = {
+    "Experience (High to Low)": (lambda d: (-(d[7] or 0), (d[1] or '').casefold(), d[0]), False),
+    "Name (A-Z)": (lambda d: ((d[1] or '').casefold(), (d[2] or '').casefold(), d[0]), False),
+    "Recently Joined": (lambda d: (d[9] or datetime.min, d[0]), True),
+}
+
+def experience_bucket(years):
+    years = years or 0
+    for label, low, high in EXPERIENCE_BUCKETS:
+        if years >= low and (high is None or years < high):
+            return label
+    return EXPERIENCE_BUCKETS[0][0]
+
+def facet_key(value):
+    """Free text values (specialization / hospital are typed at registration) grouped case and space insensitive"""
+    return ' '.join(value.split()).casefold()
+
+def facet_values(row):
+    return {
+        'specialization': ' '.join((row[5] or '').split()) or 'General Practice',
+        'hospital': ' '.join((row[6] or '').split()) or 'Not specified',
+        'experience': experience_bucket(row[7]),
+    }
+
+@dataclass
+class DirectoryPage(SearchPage):
+    # facet -> [(value, count)] most common first, each counted with the other facet filters applied
+    facets: dict = field(default_factory=dict)
+
+class DoctorDirectory:
+    def __init__(self, rows):
+        self.loaded_at = time.monotonic()
+        self.doctors = {row[0]: row for row in rows}
+        self.text = {row[0]: ' '.join(str(row[i] or '') for i in (0, 1, 2, 3, 5, 6)).casefold() for row in rows}
+        self.hospital_text = {row[0]: (row[6] or '').casefold() for row in rows}
+
+        self.values = {}                                # doctor_id -> facet -> key
+        self.index = {name: {} for name in FACETS}      # facet -> key -> set of doctor_ids
+        self.labels = {name: {} for name in FACETS}     # facet -> key -> display value
+        for row in rows:
+            self.values[row[0]] = {}
+            for name, value in facet_values(row).items():
+                key = facet_key(value)
+                self.values[row[0]][name] = key
+                self.index[name].setdefault(key, set()).add(row[0])
+                self.labels[name].setdefault(key, value)
+
+        self.orders = {}        # sort label -> doctor_ids in that order
+        self.positions = {}     # sort label -> doctor_id -> position
+        for label, (sort_key, reverse) in ORDERS.items():
+            self.orders[label] = [row[0] for row in sorted(rows, key=sort_key, reverse=reverse)]
+            self.positions[label] = {doctor_id: index for index, doctor_id in enumerate(self.orders[label])}
+
+    def facet_options(self, name):
+        """All values of a facet, sorted. Stable between searches, for the filter widgets"""
+        return sorted(self.labels[name].values(), key=str.casefold)
+
+    def search(self, search_term="", filters=None, location="", sort_by="Experience (High to Low)",
+               after=None, page_size=PAGE_SIZE):
+        """DirectoryPage of matching doctors, filters is {facet: value}, after is the last page's next_after"""
+        term = ' '.join((search_term or '').split()).casefold()
+        location = ' '.join((location or '').split()).casefold()
+        base = {doctor_id for doctor_id, text in self.text.items()
+                if (not term or term in text) and (not location or location in self.hospital_text[doctor_id])}
+
+        selected = {name: self.index[name].get(facet_key(value), set())
+                    for name, value in (filters or {}).items() if value}
+        matches = base.intersection(*selected.values())
+
+        # counts of a facet ignore its own filter, so the other values stay selectable
+        facets = {}
+        for name in FACETS:
+            candidates = base.intersection(*(ids for other, ids in selected.items() if other != name))
+            counts = Counter(self.values[doctor_id][name] for doctor_id in candidates)
+            facets[name] = [(self.labels[name][key], count) for key, count in counts.most_common()]
+
+        order = self.orders[sort_by]
+        start = self.positions[sort_by][after[0]] + 1 if after and after[0] in self.doctors else 0
+        page = []
+        for doctor_id in order[start:]:
+            if doctor_id in matches:
+                page.append(self.doctors[doctor_id])
+                if len(page) > page_size:
+                    break
+
+        next_after = (page[page_size - 1][0],) if len(page) > page_size else None
+        return DirectoryPage(page[:page_size], next_after, len(matches), False, facets)
+
+
+_directory = None
+_directory_lock = threading.Lock()
+_generation = 0     # bumped by invalidate(), a reload that overlapped one is not kept
+
+def refresh():
+    """Reload the directory from the database"""
+    global _directory
+    with _directory_lock:
+        generation = _generation
+    with db.cursor() as cursor:
+        cursor.execute(f'SELECT {DOCTOR_COLUMNS} FROM doctors')
+        directory = DoctorDirectory(cursor.fetchall())
+    with _directory_lock:
+        if generation == _generation:
+            _directory = directory
+    return directory
+
+def invalidate():
+    """Drop the directory after a doctor was added or changed, the next search reloads it"""
+    global _directory, _generation
+    with _directory_lock:
+        _generation += 1
+        _directory = None
+
+def get_directory():
+    directory = _directory
+    if directory is None or time.monotonic() - directory.loaded_at > float(os.getenv('DIRECTORY_REFRESH', 300)):
+        directory = refresh()
+    return directory
@@ -0,0 +1,99 @@
+# Streaming ingest of uploaded files into the blob store
+# uploads are read in fixed size chunks, hashed and written as they arrive,
+# so memory use does not grow with the file size.
+
+import os, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from Modules import thumbnails
+
+class UploadTooLarge(Exception):
+    pass
+
+def chunk_size():
+    return int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+
+def max_upload_bytes():
+    return int(float(os.getenv('MAX_UPLOAD_MB', 200)) * 1024 * 1024)
+
+def _mb(num_bytes):
+    return f"{num_bytes / 1048576:.1f}".rstrip('0').rstrip('.') + " MB"
+
+def read_chunks(upload, size=None, max_bytes=None, progress=None):
+    """Yield chunks of an uploaded file, raises UploadTooLarge past max_bytes"""
+    size = size or chunk_size()
+    max_bytes = max_upload_bytes() if max_bytes is None else max_bytes
+    total = getattr(upload, 'size', None)
+    name = getattr(upload, 'name', 'upload')
+
+    if total is not None and max_bytes and total > max_bytes:
+        raise UploadTooLarge(f"{name} is {_mb(total)}, limit is {_mb(max_bytes)}")
+
+    if hasattr(upload, 'seek'):
+        upload.seek(0)
+    read = 0
+    while True:
+        chunk = upload.read(size)
+        if not chunk:
+            break
+        read += len(chunk)
+        if max_bytes and read > max_bytes:
+            raise UploadTooLarge(f"{name} is larger than the {_mb(max_bytes)} limit")
+        if progress:
+            progress(read, total)
+        yield chunk
+
+def ingest_upload(store, upload, max_bytes=None, progress=None):
+    """Stream an upload into the blob store, returns (key, size)"""
+    return store.put_stream(read_chunks(upload, max_bytes=max_bytes, progress=progress))
+
+def ingest_image(store, upload, max_bytes=None, progress=None):
+    """Stream an image into the blob store and make its preview, returns (key, size, thumbnail, thumbnail_type)"""
+    key, size = ingest_upload(store, upload, max_bytes=max_bytes, progress=progress)
+    # made from the stored copy, so the upload is not held in memory for it
+    with store.open(key) as stored_image:
+        thumbnail_data, thumbnail_type = thumbnails.make_thumbnail(stored_image)
+    return key, size, thumbnail_data, thumbnail_type
+
+def upload_workers():
+    return int(os.getenv('UPLOAD_WORKERS', 4))
+
+def ingest_many(uploads, ingest_one, progress=None, max_workers=None):
+    """Run ingest_one(upload, report) for each upload on a bounded thread pool
+
+    Returns [(upload, result, error)] in upload order. progress(index, done, total)
+    is called from the calling thread, so it may update Streamlit widgets.
+    """
+    if not uploads:
+        return []
+
+    state = [(0, getattr(upload, 'size', None)) for upload in uploads]
+    reported = list(state)
+    lock = threading.Lock()
+
+    def run(index, upload):
+        def report(done, total):
+            with lock:
+                state[index] = (done, total)
+        return ingest_one(upload, report)
+
+    workers = min(max_workers or upload_workers(), len(uploads))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest') as pool:
+        futures = [pool.submit(run, index, upload) for index, upload in enumerate(uploads)]
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            if progress:
+                with lock:
+                    snapshot = list(state)
+                for index, current in enumerate(snapshot):
+                    if current != reported[index]:
+                        reported[index] = current
+                        progress(index, *current)
+
+    results = []
+    for upload, future in zip(uploads, futures):
+        try:
+            results.append((upload, future.result(), None))
+        except Exception as e:
+            results.append((upload, None, str(e)))
+    return results
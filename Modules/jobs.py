@@ -0,0 +1,363 @@
+# Background jobs for long running imports
+#
+# the app enqueues a job (input saved to the blob store, a row in import_jobs) and returns,
+# a worker process picks it up:
+#
+#   python -m Modules.jobs            # run forever
+#   python -m Modules.jobs --once     # work off the queue and exit
+#   python -m Modules.jobs --import-file legacy.csv --doctor-id DOC...   # queue a file, then work
+#
+# every chunk of rows commits together with the job's checkpoint (rows_done, counts,
+# errors), so a worker that dies loses at most the chunk in flight and the next worker
+# continues from the checkpoint. A running job whose heartbeat is older than
+# JOB_STALE_SECONDS is considered abandoned and claimed again.
+#
+# large CSV templates and Parquet / Arrow files are stored as they are and streamed by the
+# worker chunk by chunk (templates.iter_template_chunks, arrow_io.iter_arrow_chunks),
+# rows_done then counts data rows of the file.
+#
+# the input of a finished job is deleted from the blob store by the worker when it is idle,
+# JOB_PAYLOAD_RETENTION_HOURS after the job finished (purge_payloads).
+
+import argparse, gzip, json, os, socket, time, traceback, uuid
+import mysql.connector
+
+from Modules import db, blobstore, blob_gc, batch_import, ingest, templates, arrow_io
+
+MAX_ERRORS = 200    # per row errors kept on the job, the counts are always complete
+
+JOB_COLUMNS = '''job_id, kind, doctor_id, status, source_name, payload_ref, total_rows, rows_done,
+                 inserted, failed, errors, message, worker, heartbeat_at, created_at, started_at, finished_at'''
+
+def stale_seconds():
+    return int(os.getenv('JOB_STALE_SECONDS', 300))
+
+def poll_seconds():
+    return float(os.getenv('JOB_POLL_SECONDS', 2))
+
+def payload_retention_seconds():
+    return float(os.getenv('JOB_PAYLOAD_RETENTION_HOURS', 24)) * 3600
+
+PURGE_INTERVAL = 3600   # seconds between payload purges of an idle worker
+
+def generate_job_id():
+    return f"JOB{uuid.uuid4().hex[:8].upper()}"
+
+def _job_dict(cursor, row):
+    job = dict(zip([column[0] for column in cursor.description], row))
+    job['errors'] = json.loads(job['errors']) if job['errors'] else []
+    return job
+
+# payloads
+def save_payload(rows):
+    data = gzip.compress(json.dumps(rows, default=str).encode('utf-8'))
+    return blobstore.get_blob_store().put(data)
+
+def load_payload(payload_ref):
+    data = blobstore.get_blob_store().get(payload_ref)
+    if data is None:
+        raise RuntimeError(f"Job input {payload_ref} is missing from the blob store")
+    return json.loads(gzip.decompress(data))
+
+# app side
+def enqueue(kind, doctor_id, rows, source_name=None):
+    """Queue rows for the worker, returns the job_id"""
+    return _insert_job(kind, doctor_id, save_payload(rows), len(rows), source_name)
+
+def _insert_job(kind, doctor_id, payload_ref, total_rows, source_name):
+    job_id = generate_job_id()
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO import_jobs (job_id, kind, doctor_id, source_name, payload_ref, total_rows)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            ''', (job_id, kind, doctor_id, source_name, payload_ref, total_rows))
+            conn.commit()
+        finally:
+            cursor.close()
+    return job_id
+
+def enqueue_record_import(records_data, doctor_id, source_name=None):
+    return enqueue('medical_records', doctor_id, records_data, source_name)
+
+def enqueue_template_import(upload, doctor_id, source_name=None, progress=None):
+    """Stream a CSV template or a Parquet / Arrow file into the blob store and queue it, returns
+    the job_id. For CSV total_rows is estimated from the line count while the file is copied"""
+    source_name = source_name or getattr(upload, 'name', None)
+    store = blobstore.get_blob_store()
+    chunks = ingest.read_chunks(upload, max_bytes=templates.stream_max_bytes(), progress=progress)
+    if arrow_io.is_columnar(source_name):
+        payload_ref, _ = store.put_stream(chunks)
+        with store.open(payload_ref) as stored:
+            total_rows = arrow_io.count_rows(stored, source_name)
+        return _insert_job('medical_records_arrow', doctor_id, payload_ref, total_rows or 0, source_name)
+
+    lines, last = 0, b'\n'
+    def counted(chunks):
+        nonlocal lines, last
+        for chunk in chunks:
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+            yield chunk
+    payload_ref, _ = store.put_stream(counted(chunks))
+    if last != b'\n':
+        lines += 1    # no newline after the last row
+    return _insert_job('medical_records_csv', doctor_id, payload_ref, max(lines - 1, 0), source_name)
+
+def recent_jobs(doctor_id, limit=10):
+    with db.cursor() as cursor:
+        cursor.execute(f'''
+            SELECT {JOB_COLUMNS} FROM import_jobs WHERE doctor_id = %s
+            ORDER BY created_at DESC LIMIT %s
+        ''', (doctor_id, limit))
+        return [_job_dict(cursor, row) for row in cursor.fetchall()]
+
+# worker side
+def claim_job(worker_id):
+    """Oldest queued (or abandoned running) job, marked as ours. None if there is nothing to do"""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'''
+                SELECT {JOB_COLUMNS} FROM import_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND heartbeat_at < NOW() - INTERVAL %s SECOND)
+                ORDER BY created_at LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ''', (stale_seconds(),))
+            row = cursor.fetchone()
+            if not row:
+                conn.commit()
+                return None
+            job = _job_dict(cursor, row)
+            cursor.execute('''
+                UPDATE import_jobs SET status = 'running', worker = %s, heartbeat_at = NOW(),
+                                       started_at = COALESCE(started_at, NOW())
+                WHERE job_id = %s
+            ''', (worker_id, job['job_id']))
+            conn.commit()
+            job['worker'] = worker_id
+            return job
+        finally:
+            cursor.close()
+
+def finish_job(job_id, worker_id, status, message):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                UPDATE import_jobs SET status = %s, message = %s, finished_at = NOW(), heartbeat_at = NOW()
+                WHERE job_id = %s AND worker = %s
+            ''', (status, message, job_id, worker_id))
+            conn.commit()
+        finally:
+            cursor.close()
+
+# blobs are content addressed: the same content may be the input of another job still to run,
+# or a medical file / image
+PAYLOAD_REFERENCES = '''
+    SELECT (SELECT COUNT(*) FROM import_jobs WHERE payload_ref = %s AND status IN ('queued', 'running'))
+         + (SELECT COUNT(*) FROM medical_files WHERE blob_ref = %s)
+         + (SELECT COUNT(*) FROM medical_images WHERE blob_ref = %s)
+'''
+
+def purge_payloads(retention=None, log=print):
+    """Delete the inputs of jobs finished more than retention seconds ago, returns how many.
+
+    Not done when the job finishes: a put of the same content finds the blob already stored and
+    only touches it, then inserts the row referencing it. A blob stored (or touched) within the
+    retention period is kept, so such a row always has time to commit before the check.
+    """
+    retention = payload_retention_seconds() if retention is None else retention
+    store = blobstore.get_blob_store()
+    deleted = 0
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute('''
+                SELECT DISTINCT payload_ref FROM import_jobs
+                WHERE status IN ('done', 'failed') AND payload_ref IS NOT NULL
+                  AND finished_at < NOW() - INTERVAL %s SECOND
+            ''', (int(retention),))
+            for payload_ref in [row[0] for row in cursor.fetchall()]:
+                cursor.execute(PAYLOAD_REFERENCES, (payload_ref,) * 3)
+                in_use = cursor.fetchone()[0]
+                modified = store.modified_at(payload_ref)
+                if not in_use and modified is not None:
+                    if time.time() - modified < retention:
+                        continue    # stored again recently, checked on a later purge
+                    store.delete(payload_ref)
+                    deleted += 1
+                # gone, or now someone else's blob: the finished jobs no longer own it
+                cursor.execute('''
+                    UPDATE import_jobs SET payload_ref = NULL
+                    WHERE payload_ref = %s AND status IN ('done', 'failed')
+                ''', (payload_ref,))
+                conn.commit()
+        finally:
+            cursor.close()
+    if deleted:
+        log(f"Deleted the input of {deleted} finished job(s)")
+    return deleted
+
+class JobLost(Exception):
+    """Another worker took the job over (this one was too slow to heartbeat)"""
+
+def save_checkpoint(cursor, job, rows_done, inserted, failed, errors):
+    """Progress update, run in the transaction of the rows it covers"""
+    cursor.execute('''
+        UPDATE import_jobs SET rows_done = %s, total_rows = GREATEST(total_rows, %s), inserted = %s,
+                               failed = %s, errors = %s, heartbeat_at = NOW()
+        WHERE job_id = %s AND worker = %s
+    ''', (rows_done, rows_done, inserted, failed, json.dumps(errors[:MAX_ERRORS]), job['job_id'], job['worker']))
+    if cursor.rowcount == 0:
+        raise JobLost(job['job_id'])
+
+def run_record_import(job):
+    records = load_payload(job['payload_ref'])
+    inserted, failed, errors = job['inserted'], job['failed'], job['errors']
+
+    def checkpoint(cursor, done, result):
+        new_errors = [[index + 1, error] for index, error in result.failed]
+        save_checkpoint(cursor, job, done, inserted + result.inserted, failed + len(result.failed),
+                        errors + new_errors)
+
+    with db.connection() as conn:
+        result = batch_import.insert_records(conn, records, job['doctor_id'], start=job['rows_done'],
+                                             before_commit=checkpoint)
+    return (f"Processed {inserted + result.inserted} records, failed {failed + len(result.failed)} "
+            f"({result.rows_per_sec:,.0f} rows/sec)")
+
+def template_chunks(job, source):
+    if job['kind'] == 'medical_records_arrow':
+        return arrow_io.iter_arrow_chunks(source, job['source_name'], skip_rows=job['rows_done'])
+    return templates.iter_template_chunks(source, skip_rows=job['rows_done'])
+
+def run_template_import(job):
+    """Stream a stored template file: parse, check patients and insert one chunk at a time"""
+    totals = {'rows_done': job['rows_done'], 'inserted': job['inserted'], 'failed': job['failed'],
+              'errors': job['errors']}
+    started = time.perf_counter()
+    with blobstore.get_blob_store().open(job['payload_ref']) as source, db.connection() as conn:
+        for chunk in template_chunks(job, source):
+            skipped = {entry['row'] for entry in chunk.row_errors if entry['skipped']}
+            chunk_errors = [[entry['row'], f"{entry['column']}: {entry['error']}"
+                             + (f" ({entry['value']})" if entry['value'] is not None else "")]
+                            for entry in chunk.row_errors]
+            cursor = conn.cursor()
+            try:
+                # unknown patients are reported here instead of failing (and bisecting) their INSERTs
+                known = batch_import.existing_patient_ids(cursor, (record['patient_id'] for record in chunk.records))
+                records, rows = [], []
+                for record, row in zip(chunk.records, chunk.rows):
+                    if batch_import.patient_key(record['patient_id']) in known:
+                        records.append(record)
+                        rows.append(row)
+                    else:
+                        skipped.add(row)
+                        chunk_errors.append([row, f"patient_id: Patient ID '{record['patient_id']}' not found"])
+
+                # called once per chunk, in its transaction
+                def checkpoint(cursor, done, result):
+                    chunk_errors.extend([rows[index], error] for index, error in result.failed)
+                    totals.update(rows_done=chunk.end, inserted=totals['inserted'] + result.inserted,
+                                  failed=totals['failed'] + len(skipped) + len(result.failed),
+                                  errors=(totals['errors'] + sorted(chunk_errors))[:MAX_ERRORS])
+                    save_checkpoint(cursor, job, totals['rows_done'], totals['inserted'], totals['failed'],
+                                    totals['errors'])
+
+                if records:
+                    batch_import.insert_records(conn, records, job['doctor_id'], size=len(records),
+                                                before_commit=checkpoint)
+                else:
+                    checkpoint(cursor, chunk.end, batch_import.ImportResult())
+                    conn.commit()
+            finally:
+                cursor.close()
+    seconds = time.perf_counter() - started
+    rate = (totals['inserted'] - job['inserted']) / seconds if seconds else 0.0
+    return (f"Processed {totals['inserted']} records from {totals['rows_done']} rows, "
+            f"failed {totals['failed']} ({rate:,.0f} rows/sec)")
+
+# job kind -> handler(job) returning the final message
+HANDLERS = {
+    'medical_records': run_record_import,
+    'medical_records_csv': run_template_import,
+    'medical_records_arrow': run_template_import,
+}
+
+def run_job(job, log=print):
+    log(f"{job['job_id']}: {job['kind']} from row {job['rows_done']} of {job['total_rows']}")
+    try:
+        message = HANDLERS[job['kind']](job)
+    except JobLost:
+        log(f"{job['job_id']}: taken over by another worker, stopping")
+        return
+    except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError) as e:
+        # database went away: leave it running, it is picked up again once the heartbeat is stale
+        log(f"{job['job_id']}: interrupted ({e}), will resume from the last checkpoint")
+        return
+    except Exception as e:
+        traceback.print_exc()
+        finish_job(job['job_id'], job['worker'], 'failed', str(e))
+        log(f"{job['job_id']}: failed: {e}")
+        return
+    finish_job(job['job_id'], job['worker'], 'done', message)
+    log(f"{job['job_id']}: {message}")
+
+def run_worker(once=False, log=print):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"[:100]
+    log(f"Import worker {worker_id} started")
+    last_purge = None
+    while True:
+        try:
+            job = claim_job(worker_id)
+        except mysql.connector.Error as e:
+            log(f"Can't reach the database: {e}")
+            job = None
+        if job:
+            run_job(job, log)
+            continue
+        if last_purge is None or time.monotonic() - last_purge > PURGE_INTERVAL:
+            last_purge = time.monotonic()
+            try:
+                purge_payloads(log=log)
+            except (mysql.connector.Error, OSError) as e:
+                log(f"Could not purge finished job inputs: {e}")
+            try:
+                blob_gc.sweep(log=log)
+            except (mysql.connector.Error, OSError) as e:
+                log(f"Could not delete unreferenced blobs: {e}")
+        if once:
+            return
+        time.sleep(poll_seconds())
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued import jobs")
+    parser.add_argument('--once', action='store_true', help="exit when the queue is empty")
+    parser.add_argument('--import-file', '--import-csv', metavar='PATH',
+                        help="queue a CSV template or Parquet / Arrow file before starting")
+    parser.add_argument('--doctor-id', help="doctor the --import-file records are added by")
+    args = parser.parse_args()
+    if args.import_file and not args.doctor_id:
+        parser.error("--import-file needs --doctor-id")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from Modules import migrations
+    ok, error = migrations.ensure_schema()
+    if not ok:
+        print(f"Database schema is not ready: {error}")
+        return
+    if args.import_file:
+        with open(args.import_file, 'rb') as import_file:
+            job_id = enqueue_template_import(import_file, args.doctor_id, os.path.basename(args.import_file))
+        print(f"Queued {args.import_file} as {job_id}")
+    try:
+        run_worker(once=args.once)
+    except KeyboardInterrupt:
+        print("Worker stopped, running jobs continue from their checkpoint on the next start.")
+
+if __name__ == "__main__":
+    main()
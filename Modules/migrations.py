@@ -0,0 +1,314 @@
+# Schema migrations for E-Medical Record System
+# every migration is (version, description, statements). Append new ones at the end
+# and never edit a migration that is already applied somewhere.
+
+import mysql.connector, threading
+from Modules import db
+
+# fills size / sha256 of files uploaded before migration 3, in small batches
+def _backfill_file_metadata(cursor):
+    while True:
+        cursor.execute('''
+            UPDATE medical_files SET file_size = LENGTH(file_data), file_hash = SHA2(file_data, 256)
+            WHERE file_hash IS NULL LIMIT 200
+        ''')
+        updated = cursor.rowcount
+        cursor.execute('COMMIT')
+        if not updated:
+            break
+
+def _backfill_image_metadata(cursor):
+    while True:
+        cursor.execute('''
+            UPDATE medical_images SET image_size = LENGTH(image_data), image_hash = SHA2(image_data, 256)
+            WHERE image_hash IS NULL LIMIT 200
+        ''')
+        updated = cursor.rowcount
+        cursor.execute('COMMIT')
+        if not updated:
+            break
+
+MIGRATIONS = [
+    (1, "initial tables", [
+        # patients table
+        '''
+        CREATE TABLE IF NOT EXISTS patients (
+            patient_id VARCHAR(20) PRIMARY KEY,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            phone VARCHAR(20),
+            date_of_birth DATE,
+            gender ENUM('Male', 'Female', 'Other', 'Prefer not to say'),
+            blood_group ENUM('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-', 'Unknown'),
+            address TEXT,
+            emergency_contact VARCHAR(100),
+            emergency_phone VARCHAR(20),
+            insurance_provider VARCHAR(100),
+            insurance_number VARCHAR(100),
+            height_cm INT,
+            weight_kg DECIMAL(5,2),
+            qr_token VARCHAR(255) UNIQUE,
+            last_login DATE,
+            health_streak INT DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # doctors table
+        '''
+        CREATE TABLE IF NOT EXISTS doctors (
+            doctor_id VARCHAR(20) PRIMARY KEY,
+            first_name VARCHAR(100) NOT NULL,
+            last_name VARCHAR(100) NOT NULL,
+            email VARCHAR(255) UNIQUE NOT NULL,
+            password_hash VARCHAR(255) NOT NULL,
+            phone VARCHAR(20),
+            license_number VARCHAR(50),
+            specialization VARCHAR(100),
+            hospital VARCHAR(200),
+            experience_years INT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # medical records
+        '''
+        CREATE TABLE IF NOT EXISTS medical_records (
+            record_id INT AUTO_INCREMENT PRIMARY KEY,
+            patient_id VARCHAR(20),
+            doctor_id VARCHAR(20),
+            visit_date DATE NOT NULL,
+            diagnosis TEXT,
+            treatment TEXT,
+            prescription TEXT,
+            notes TEXT,
+            glucose_level DECIMAL(5,2),
+            blood_pressure_systolic INT,
+            blood_pressure_diastolic INT,
+            heart_rate INT,
+            temperature DECIMAL(4,1),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
+        )
+        ''',
+        # Medical files table
+        '''
+        CREATE TABLE IF NOT EXISTS medical_files (
+            file_id INT AUTO_INCREMENT PRIMARY KEY,
+            patient_id VARCHAR(20),
+            doctor_id VARCHAR(20),
+            file_name VARCHAR(200) NOT NULL,
+            file_data LONGBLOB NOT NULL,
+            file_type VARCHAR(50),
+            category ENUM('Lab Report', 'Medical Report', 'Prescription', 'Insurance', 'Other'),
+            description TEXT,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
+        )
+        ''',
+        # Medical images table
+        '''
+        CREATE TABLE IF NOT EXISTS medical_images (
+            image_id INT AUTO_INCREMENT PRIMARY KEY,
+            patient_id VARCHAR(20),
+            doctor_id VARCHAR(20),
+            image_name VARCHAR(200) NOT NULL,
+            image_data LONGBLOB NOT NULL,
+            image_type VARCHAR(50),
+            description TEXT,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
+        )
+        ''',
+        # Allergies table
+        '''
+        CREATE TABLE IF NOT EXISTS allergies (
+            allergy_id INT AUTO_INCREMENT PRIMARY KEY,
+            patient_id VARCHAR(20),
+            allergy_name VARCHAR(100) NOT NULL,
+            severity ENUM('Mild', 'Moderate', 'Severe'),
+            notes TEXT,
+            FOREIGN KEY (patient_id) REFERENCES patients(patient_id)
+        )
+        '''
+    ]),
+    (2, "indexes for patient/doctor visit and upload date lookups", [
+        # patient_records / vital_trends / AI context: patient_id = ? AND visit_date range, ORDER BY visit_date.
+        # vitals are appended so the vital trends query is answered from the index alone
+        '''
+        CREATE INDEX idx_records_patient_visit ON medical_records
+            (patient_id, visit_date, glucose_level, blood_pressure_systolic,
+             blood_pressure_diastolic, heart_rate, temperature)
+            ALGORITHM=INPLACE LOCK=NONE
+        ''',
+        # doctor AI context: doctor_id = ? ORDER BY visit_date DESC
+        '''
+        CREATE INDEX idx_records_doctor_visit ON medical_records (doctor_id, visit_date)
+            ALGORITHM=INPLACE LOCK=NONE
+        ''',
+        # files / images listings: patient_id = ? ORDER BY upload_date DESC
+        '''
+        CREATE INDEX idx_files_patient_upload ON medical_files (patient_id, upload_date)
+            ALGORITHM=INPLACE LOCK=NONE
+        ''',
+        '''
+        CREATE INDEX idx_images_patient_upload ON medical_images (patient_id, upload_date)
+            ALGORITHM=INPLACE LOCK=NONE
+        '''
+    ]),
+    (3, "file size and content hash on medical_files", [
+        'ALTER TABLE medical_files ADD COLUMN file_size BIGINT',
+        'ALTER TABLE medical_files ADD COLUMN file_hash CHAR(64)',
+        _backfill_file_metadata
+    ]),
+    (4, "thumbnails, size and content hash on medical_images", [
+        'ALTER TABLE medical_images ADD COLUMN image_size BIGINT',
+        'ALTER TABLE medical_images ADD COLUMN image_hash CHAR(64)',
+        'ALTER TABLE medical_images ADD COLUMN thumbnail_data MEDIUMBLOB',
+        'ALTER TABLE medical_images ADD COLUMN thumbnail_type VARCHAR(20)',
+        _backfill_image_metadata
+    ]),
+    (5, "blob store references for files and images", [
+        'ALTER TABLE medical_files ADD COLUMN blob_ref CHAR(64)',
+        'ALTER TABLE medical_files MODIFY file_data LONGBLOB NULL',
+        'ALTER TABLE medical_images ADD COLUMN blob_ref CHAR(64)',
+        'ALTER TABLE medical_images MODIFY image_data LONGBLOB NULL'
+    ]),
+    (6, "search indexes on patients", [
+        # the default stopword list would drop every ngram equal to 'a', 'i', 'at', 'in', ...
+        # (i.e. most of a name), the setting is read when the index is created
+        'SET SESSION innodb_ft_enable_stopword = OFF',
+        '''
+        CREATE FULLTEXT INDEX ft_patients_search ON patients
+            (patient_id, first_name, last_name, email, phone) WITH PARSER ngram
+        ''',
+        'SET SESSION innodb_ft_enable_stopword = ON',
+        # 1 character searches (prefix LIKE) and the name ordering of the search results
+        'CREATE INDEX idx_patients_name ON patients (first_name, last_name) ALGORITHM=INPLACE LOCK=NONE',
+        'CREATE INDEX idx_patients_last_name ON patients (last_name) ALGORITHM=INPLACE LOCK=NONE',
+        'CREATE INDEX idx_patients_phone ON patients (phone) ALGORITHM=INPLACE LOCK=NONE'
+    ]),
+    (7, "background import jobs", [
+        '''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            job_id VARCHAR(20) PRIMARY KEY,
+            kind VARCHAR(40) NOT NULL,
+            doctor_id VARCHAR(20),
+            status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+            source_name VARCHAR(255),
+            payload_ref CHAR(64),
+            total_rows INT,
+            rows_done INT NOT NULL DEFAULT 0,
+            inserted INT NOT NULL DEFAULT 0,
+            failed INT NOT NULL DEFAULT 0,
+            errors MEDIUMTEXT,
+            message TEXT,
+            worker VARCHAR(100),
+            heartbeat_at TIMESTAMP NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP NULL,
+            finished_at TIMESTAMP NULL,
+            INDEX idx_jobs_status (status, created_at),
+            INDEX idx_jobs_doctor (doctor_id, created_at),
+            FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
+        )
+        '''
+    ]),
+    (8, "blob reference lookups", [
+        # a finished import job's input is only deleted if no file / image has the same blob
+        'CREATE INDEX idx_files_blob_ref ON medical_files (blob_ref) ALGORITHM=INPLACE LOCK=NONE',
+        'CREATE INDEX idx_images_blob_ref ON medical_images (blob_ref) ALGORITHM=INPLACE LOCK=NONE'
+    ]),
+]
+
+# errors meaning the change is already in place, so a half applied migration can be re-run
+ALREADY_APPLIED = {
+    1050,   # table already exists
+    1060,   # duplicate column name
+    1061,   # duplicate key name
+    1091,   # can't drop, doesn't exist
+    1826,   # duplicate foreign key name
+}
+
+LOCK_NAME = 'tech_o_health_schema'
+LOCK_TIMEOUT = 60
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def applied_versions(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('SELECT version FROM schema_version')
+    return {row[0] for row in cursor.fetchall()}
+
+def _apply(cursor, statements):
+    for statement in statements:
+        try:
+            if callable(statement):
+                statement(cursor)
+            else:
+                cursor.execute(statement)
+        except mysql.connector.Error as e:
+            if e.errno not in ALREADY_APPLIED:
+                raise
+
+def run_migrations():
+    """Apply pending migrations in order, returns list of applied versions"""
+    applied_now = []
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            # only one process migrates at a time
+            cursor.execute('SELECT GET_LOCK(%s, %s)', (LOCK_NAME, LOCK_TIMEOUT))
+            if cursor.fetchone()[0] != 1:
+                raise RuntimeError("Timed out waiting for schema migration lock")
+            try:
+                done = applied_versions(cursor)
+                for version, description, statements in sorted(MIGRATIONS, key=lambda m: m[0]):
+                    if version in done:
+                        continue
+                    _apply(cursor, statements)
+                    cursor.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                                   (version, description))
+                    conn.commit()
+                    applied_now.append(version)
+            finally:
+                cursor.execute('SELECT RELEASE_LOCK(%s)', (LOCK_NAME,))
+                cursor.fetchall()
+        finally:
+            cursor.close()
+    return applied_now
+
+def ensure_schema():
+    """Run migrations once per process, later calls cost nothing"""
+    global _schema_ready
+    if _schema_ready:
+        return True, []
+    with _schema_lock:
+        if _schema_ready:
+            return True, []
+        try:
+            applied_now = run_migrations()
+        except (mysql.connector.Error, RuntimeError) as e:
+            return False, str(e)
+        _schema_ready = True
+        return True, applied_now
+
+def current_version():
+    with db.cursor() as cursor:
+        return max(applied_versions(cursor), default=0)
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    applied = run_migrations()
+    print(f"Applied migrations: {applied}" if applied else f"Schema is up to date (version {current_version()})")
@@ -0,0 +1,300 @@
+# Patient aggregate for the history / overview pages
+# all sections are fetched with one multi-statement query (one round trip),
+# vital trends are derived from the records instead of being queried again.
+# Several patients (the doctor assistant's selection) are loaded together with IN queries.
+#
+# writes bump the patient's data version and mark the sections they touched; the cached
+# aggregate is then refreshed by reloading only those sections (get_aggregate).
+
+import os, threading, time
+from dataclasses import dataclass, field, replace
+from datetime import date, timedelta
+
+from Modules.cache import TTLCache
+
+VITALS_WINDOW_DAYS = 180
+
+# one statement per section, each takes the patient_id once
+SECTION_QUERIES = {
+    'basic_info': '''
+        SELECT patient_id, first_name, last_name, email, phone, date_of_birth,
+               gender, blood_group, address, emergency_contact, emergency_phone,
+               insurance_provider, insurance_number, height_cm, weight_kg, health_streak
+        FROM patients WHERE patient_id = %s
+    ''',
+    'medical_records': '''
+        SELECT mr.record_id, mr.visit_date, mr.diagnosis, mr.treatment, mr.prescription,
+               mr.notes, mr.glucose_level, mr.blood_pressure_systolic, mr.blood_pressure_diastolic,
+               mr.heart_rate, mr.temperature, mr.created_at,
+               d.first_name, d.last_name, d.specialization
+        FROM medical_records mr
+        LEFT JOIN doctors d ON mr.doctor_id = d.doctor_id
+        WHERE mr.patient_id = %s
+        ORDER BY mr.visit_date DESC
+    ''',
+    'allergies': '''
+        SELECT allergy_name, severity, notes FROM allergies WHERE patient_id = %s
+    ''',
+    'medical_files': '''
+        SELECT file_name, file_type, category, description, upload_date,
+               d.first_name, d.last_name
+        FROM medical_files mf
+        LEFT JOIN doctors d ON mf.doctor_id = d.doctor_id
+        WHERE mf.patient_id = %s
+        ORDER BY mf.upload_date DESC
+    ''',
+    'medical_images': '''
+        SELECT image_name, image_type, description, upload_date
+        FROM medical_images
+        WHERE patient_id = %s
+        ORDER BY upload_date DESC
+    ''',
+}
+
+# patient column of each section query, the bulk queries select it first and match a list
+KEY_COLUMNS = {
+    'basic_info': 'patient_id',
+    'medical_records': 'mr.patient_id',
+    'allergies': 'patient_id',
+    'medical_files': 'mf.patient_id',
+    'medical_images': 'patient_id',
+}
+
+BULK_CHUNK_SIZE = 500
+
+def bulk_query(section, count):
+    """SECTION_QUERIES[section] for count patients: patient_id IN (...), patient column first"""
+    column = KEY_COLUMNS[section]
+    query = SECTION_QUERIES[section]
+    where = f"{column} = %s"
+    if where not in query:
+        raise ValueError(f"No {where} in the {section} query")
+    query = query.replace(where, f"{column} IN ({', '.join(['%s'] * count)})")
+    return query.replace('SELECT', f"SELECT {column},", 1)
+
+@dataclass
+class PatientAggregate:
+    """Everything known about one patient, row layouts as in SECTION_QUERIES"""
+    patient_id: str
+    basic_info: dict
+    medical_records: list           # newest visit first
+    allergies: list
+    medical_files: list
+    medical_images: list
+    version: tuple = (0, 0)         # data_version() the aggregate was loaded at
+    loaded_at: float = field(default_factory=time.time)
+
+    @property
+    def vital_trends(self):
+        """(visit_date, glucose, systolic, diastolic, heart_rate, temperature) of the last 6 months, oldest first"""
+        cutoff = date.today() - timedelta(days=VITALS_WINDOW_DAYS)
+        return [(r[1], r[6], r[7], r[8], r[9], r[10])
+                for r in reversed(self.medical_records) if r[1] and r[1] >= cutoff]
+
+def build_basic_info(row):
+    # age and BMI
+    age = (date.today() - row[5]).days // 365 if row[5] else None
+    bmi = None
+    if row[13] and row[14]:  # height_cm and weight_kg
+        try:
+            height_m = float(row[13]) / 100.0
+            if height_m > 0:
+                bmi = round(float(row[14]) / (height_m * height_m), 1)
+        except (TypeError, ValueError, ZeroDivisionError):
+            bmi = None
+
+    return {
+        'patient_id': row[0],
+        'name': f"{row[1]} {row[2]}",
+        'email': row[3],
+        'phone': row[4],
+        'age': age,
+        'gender': row[6],
+        'blood_group': row[7],
+        'address': row[8],
+        'emergency_contact': row[9],
+        'emergency_phone': row[10],
+        'insurance_provider': row[11],
+        'insurance_number': row[12],
+        'height_cm': row[13],
+        'weight_kg': row[14],
+        'bmi': bmi,
+        'health_streak': row[15]
+    }
+
+def fetch_sections(cursor, patient_id, sections):
+    """Run the given sections as one multi-statement query, returns {section: rows}"""
+    sections = list(sections)
+    cursor.execute(';'.join(SECTION_QUERIES[name] for name in sections), (patient_id,) * len(sections))
+    results = {}
+    for index, name in enumerate(sections):
+        if index:
+            cursor.nextset()
+        results[name] = cursor.fetchall()
+    return results
+
+def fetch_many_sections(cursor, patient_ids, sections, chunk_size=BULK_CHUNK_SIZE):
+    """fetch_sections for a list of patients, set based: one multi-statement query per
+    chunk_size patients. Returns {patient_id: {section: rows}}, patients without any rows
+    (unknown ids) have empty sections"""
+    sections = list(sections)
+    patient_ids = list(dict.fromkeys(patient_ids))
+    results = {patient_id: {name: [] for name in sections} for patient_id in patient_ids}
+    for start in range(0, len(patient_ids), chunk_size):
+        chunk = patient_ids[start:start + chunk_size]
+        # ids compare case insensitively in MySQL, rows go to the id as it was asked for
+        requested = {patient_id.casefold(): patient_id for patient_id in chunk}
+        cursor.execute(';'.join(bulk_query(name, len(chunk)) for name in sections), tuple(chunk) * len(sections))
+        for index, name in enumerate(sections):
+            if index:
+                cursor.nextset()
+            for row in cursor.fetchall():
+                results[requested[row[0].casefold()]][name].append(row[1:])
+    return results
+
+def load_patient_aggregate(cursor, patient_id):
+    """Load the full aggregate in one round trip, None if the patient does not exist"""
+    return aggregate_from_rows(patient_id, fetch_sections(cursor, patient_id, SECTION_QUERIES))
+
+def aggregate_from_rows(patient_id, rows, version=(0, 0)):
+    if not rows['basic_info']:
+        return None
+    return PatientAggregate(
+        patient_id=patient_id,
+        basic_info=build_basic_info(rows['basic_info'][0]),
+        medical_records=rows['medical_records'],
+        allergies=rows['allergies'],
+        medical_files=rows['medical_files'],
+        medical_images=rows['medical_images'],
+        version=version
+    )
+
+def refreshed_aggregate(aggregate, rows, version):
+    """Copy of aggregate with the reloaded sections in rows replaced, the other sections are
+    the same objects as before (consumers can tell what changed with `is`)"""
+    if 'basic_info' in rows:
+        if not rows['basic_info']:
+            return None
+        rows = {**rows, 'basic_info': build_basic_info(rows['basic_info'][0])}
+    return replace(aggregate, **rows, version=version, loaded_at=time.time())
+
+
+# per patient aggregate cache, every write to a patient's data must call invalidate()
+_cache = None
+_cache_lock = threading.Lock()
+
+def aggregate_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TTLCache(
+                    maxsize=int(os.getenv('PATIENT_CACHE_SIZE', 512)),
+                    ttl=float(os.getenv('PATIENT_CACHE_TTL', 300))
+                )
+    return _cache
+
+_versions = {}      # patient_id -> count of writes seen by this process
+_stale = {}         # patient_id -> sections written since the cached aggregate was loaded
+_epoch = 0          # bumped by invalidate_all, part of every version
+_state_lock = threading.Lock()
+
+def data_version(patient_id):
+    """Changes whenever the patient's data is written (see invalidate)"""
+    with _state_lock:
+        return (_epoch, _versions.get(patient_id, 0))
+
+def invalidate(*patient_ids, sections=None):
+    """Call after writing patient data. sections: the SECTION_QUERIES that changed, only those
+    are reloaded on the next get_aggregate; None drops the cached aggregate"""
+    cache = aggregate_cache()
+    with _state_lock:
+        for patient_id in set(patient_ids):
+            if not patient_id:
+                continue
+            _versions[patient_id] = _versions.get(patient_id, 0) + 1
+            if sections is None:
+                # without a cached aggregate the next call reloads everything, which clears the
+                # marks once it is stored (_store)
+                cache.invalidate(patient_id)
+            else:
+                _stale.setdefault(patient_id, set()).update(sections)
+
+def invalidate_all():
+    """For writes this process didn't see (e.g. the import worker)"""
+    global _epoch
+    with _state_lock:
+        _epoch += 1
+        _stale.clear()
+        aggregate_cache().clear()
+
+def _store(patient_id, aggregate, version, sections):
+    """Cache an aggregate loaded at version if no write happened since, then clear the stale
+    marks of the sections it reloaded. Marks stay until then, so readers never get the cached
+    aggregate from before a write while it is being refreshed"""
+    with _state_lock:
+        if version != (_epoch, _versions.get(patient_id, 0)):
+            return
+        aggregate_cache().set(patient_id, aggregate)
+        stale = _stale.get(patient_id)
+        if stale is not None:
+            stale.difference_update(sections)
+            if not stale:
+                del _stale[patient_id]
+
+def get_aggregates(patient_ids, fetch_many):
+    """{patient_id: aggregate} for a list of patients (unknown ids left out), in the given order.
+
+    Cached aggregates without sections written since are used as is; the other patients are
+    loaded together with fetch_many(patient_ids), {patient_id: {section: rows}} of all sections
+    (fetch_many_sections) or None on error. Stored under the same rule as get_aggregate.
+    """
+    cache = aggregate_cache()
+    patient_ids = list(dict.fromkeys(patient_ids))
+    aggregates, versions = {}, {}
+    for patient_id in patient_ids:
+        with _state_lock:
+            version = (_epoch, _versions.get(patient_id, 0))
+            stale = patient_id in _stale
+        cached = cache.get(patient_id)
+        if cached is not None and not stale:
+            aggregates[patient_id] = cached
+        else:
+            versions[patient_id] = version
+
+    rows = fetch_many(list(versions)) if versions else {}
+    for patient_id, version in versions.items():
+        aggregate = aggregate_from_rows(patient_id, rows[patient_id], version) if rows else None
+        if aggregate is None:
+            continue
+        aggregates[patient_id] = aggregate
+        _store(patient_id, aggregate, version, SECTION_QUERIES)
+    return {patient_id: aggregates[patient_id] for patient_id in patient_ids if patient_id in aggregates}
+
+def get_aggregate(patient_id, fetch):
+    """Cached aggregate, None if the patient doesn't exist or fetch failed.
+
+    fetch(sections) returns {section: rows} (one round trip) or None on error. A cached
+    aggregate with sections written since only has those reloaded. The result is stored
+    only if no write happened meanwhile, the same guarantee as TTLCache.get_or_load.
+    """
+    cache = aggregate_cache()
+    with _state_lock:
+        version = (_epoch, _versions.get(patient_id, 0))
+        stale = set(_stale.get(patient_id, ()))
+    cached = cache.get(patient_id)
+    if cached is not None and not stale:
+        return cached
+
+    sections = [name for name in SECTION_QUERIES if cached is None or name in stale]
+    rows = fetch(sections)
+    if rows is None:
+        aggregate = None
+    elif cached is None:
+        aggregate = aggregate_from_rows(patient_id, rows, version)
+    else:
+        aggregate = refreshed_aggregate(cached, rows, version)
+
+    if aggregate is not None:
+        _store(patient_id, aggregate, version, sections)
+    return aggregate
@@ -0,0 +1,230 @@
+# Prompt assembly for the AI assistants
+#
+# a prompt is a list of sections, each a header and items (one visit, one patient, ...)
+# ordered most important first. build() packs whole sections by priority and, within a
+# section, as many items as fit the token budget (AI_PROMPT_TOKENS), then puts the kept
+# sections back in their original order. Indentation and blank lines are stripped.
+#
+# tokens are estimated (about 4 characters per token), good enough to keep prompts in check.
+
+import os, re
+from dataclasses import dataclass, field
+
+CHARS_PER_TOKEN = 4
+
+def prompt_budget():
+    return int(os.getenv('AI_PROMPT_TOKENS', 4000))
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def compact(text):
+    """Lines stripped, runs of spaces collapsed, blank lines dropped"""
+    lines = (re.sub(r'[ \t]+', ' ', line.strip()) for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+@dataclass
+class Section:
+    name: str
+    header: str
+    items: list
+    priority: int
+    required: bool
+
+@dataclass
+class PromptReport:
+    tokens: int
+    budget: int
+    sections: dict = field(default_factory=dict)    # name -> (items kept, items given)
+
+    @property
+    def truncated(self):
+        """Sections that lost items (or were left out) to stay within the budget"""
+        return [name for name, (kept, total) in self.sections.items() if kept < total]
+
+    def summary(self):
+        text = f"{self.tokens:,} of {self.budget:,} prompt tokens"
+        if self.truncated:
+            text += " · shortened: " + ", ".join(
+                f"{name} {self.sections[name][0]}/{self.sections[name][1]}" for name in self.truncated)
+        return text
+
+class PromptBuilder:
+
+    def __init__(self, budget=None):
+        self.budget = budget or prompt_budget()
+        self.sections = []
+
+    def add(self, name, items, header='', priority=5, required=False):
+        """items: text or list of texts, most important first. Lower priority numbers are packed
+        first, required sections always go in whole"""
+        items = [compact(item) for item in ([items] if isinstance(items, str) else items)]
+        items = [item for item in items if item]
+        if items:
+            self.sections.append(Section(name, compact(header), items, priority, required))
+        return self
+
+    def build(self):
+        """(prompt, PromptReport)"""
+        kept = {}
+        used = 0
+        order = sorted(range(len(self.sections)),
+                       key=lambda index: (not self.sections[index].required, self.sections[index].priority, index))
+        for index in order:
+            section = self.sections[index]
+            # +1 per block for the blank line between blocks
+            cost = estimate_tokens(section.header) + 1 if section.header else 0
+            items = []
+            for item in section.items:
+                item_cost = estimate_tokens(item) + 1
+                if not section.required and used + cost + item_cost > self.budget:
+                    break
+                items.append(item)
+                cost += item_cost
+            if items:
+                kept[index] = items
+                used += cost
+
+        blocks = []
+        report = PromptReport(0, self.budget)
+        for index, section in enumerate(self.sections):
+            items = kept.get(index, [])
+            report.sections[section.name] = (len(items), len(section.items))
+            if items:
+                blocks.append('\n'.join(([section.header] if section.header else []) + items))
+        prompt = '\n\n'.join(blocks)
+        report.tokens = estimate_tokens(prompt)
+        return prompt, report
+
+
+# assistant prompts
+PATIENT_INSTRUCTIONS = """You are an advanced AI medical assistant for an E-Medical Record System with access to comprehensive patient data.
+IMPORTANT GUIDELINES:
+1. You are NOT a replacement for professional medical advice - always remind users to consult healthcare providers
+2. Provide detailed analysis of the patient's medical data when relevant
+3. Identify patterns, trends, and potential concerns in their health data
+4. Be empathetic, supportive, and use clear, understandable language
+5. For serious symptoms or concerning patterns, recommend immediate medical attention
+6. Respond in plain text without HTML formatting
+7. When analyzing data, be specific about what the numbers mean and their normal ranges
+8. Explain medical terms in simple language
+9. Use local language (example Hindi) when user asks"""
+
+DOCTOR_INSTRUCTIONS = """You are an advanced AI medical assistant designed specifically for healthcare professionals.
+IMPORTANT GUIDELINES FOR DOCTORS:
+1. Provide clinical insights, differential diagnoses, and treatment recommendations
+2. Analyze patient data patterns and suggest clinical correlations
+3. Offer evidence-based medical information and guidelines
+4. Help with clinical decision-making and care planning
+5. Suggest follow-up tests, referrals, or monitoring when appropriate
+6. Use medical terminology appropriately while being clear
+7. Always emphasize that final clinical decisions rest with the attending physician
+8. Respond in plain text without HTML formatting
+9. Focus on clinical utility and actionable insights
+10. Consider differential diagnoses and clinical reasoning"""
+
+def visit_text(number, record):
+    vitals = record['vitals']
+    return f"""Visit {number} ({record['date']}):
+        - Doctor: {record['doctor']} ({record['specialization']})
+        - Diagnosis: {record['diagnosis'] or 'Not specified'}
+        - Treatment: {record['treatment'] or 'Not specified'}
+        - Prescription: {record['prescription'] or 'None'}
+        - Vital Signs: Glucose: {vitals['glucose'] or 'N/A'} mg/dL, BP: {vitals['bp_systolic'] or 'N/A'}/{vitals['bp_diastolic'] or 'N/A'} mmHg, Heart Rate: {vitals['heart_rate'] or 'N/A'} bpm, Temperature: {vitals['temperature'] or 'N/A'}°C"""
+
+def patient_prompt(question, patient_context=None, budget=None):
+    """(prompt, PromptReport) for the patient assistant, patient_context from ai_context"""
+    builder = PromptBuilder(budget)
+    builder.add('instructions', PATIENT_INSTRUCTIONS, required=True)
+
+    if patient_context and any(patient_context.values()):
+        basic_info = patient_context.get('patient_basic_info', {})
+        if basic_info:
+            builder.add('profile', f"""- Name: {basic_info.get('name', 'Unknown')}
+                - Age: {basic_info.get('age', 'Unknown')} years
+                - Gender: {basic_info.get('gender', 'Unknown')}
+                - Blood Group: {basic_info.get('blood_group', 'Unknown')}
+                - BMI: {basic_info.get('bmi', 'Not calculated')}
+                - Health Streak: {basic_info.get('health_streak', 0)} days
+                - Has Insurance: {'Yes' if basic_info.get('has_insurance') else 'No'}""",
+                header="COMPREHENSIVE PATIENT DATA:\nPATIENT PROFILE:", priority=1)
+
+        recent_records = patient_context.get('recent_records', [])
+        builder.add('visits', [visit_text(number, record) for number, record in enumerate(recent_records, start=1)],
+                    header=f"RECENT MEDICAL HISTORY ({len(recent_records)} visits):", priority=4)
+
+        allergies = patient_context.get('allergies', [])
+        builder.add('allergies', [f"- {allergy['name']} ({allergy['severity']})" for allergy in allergies],
+                    header=f"KNOWN ALLERGIES ({len(allergies)}):", priority=2)
+
+        patterns = patient_context.get('health_patterns', {})
+        if patterns:
+            builder.add('patterns', f"""- Average Blood Glucose: {patterns.get('glucose_avg', 'N/A')} mg/dL
+                - Average Blood Pressure: {patterns.get('bp_avg', 'N/A')} mmHg (systolic)
+                - Average Heart Rate: {patterns.get('heart_rate_avg', 'N/A')} bpm
+                - Total Medical Visits: {patterns.get('total_visits', 0)}
+                - Recent Diagnoses: {', '.join(patterns.get('recent_diagnoses', [])) or 'None'}""",
+                header="HEALTH PATTERNS ANALYSIS:", priority=3)
+
+        files = patient_context.get('files_summary', [])
+        images = patient_context.get('images_summary', [])
+        documentation = []
+        if files:
+            documentation.append(f"- {len(files)} medical files on record (recent: {files[0]['category']})")
+        if images:
+            documentation.append(f"- {len(images)} medical images on record (recent: {images[0]['type']})")
+        builder.add('documentation', documentation, header="MEDICAL DOCUMENTATION:", priority=5)
+
+    builder.add('question', f"PATIENT QUESTION: {question}", required=True)
+    return builder.build()
+
+def patient_summary_text(summary):
+    basic = summary['basic_info']
+    patterns = summary['health_patterns']
+    return f"""PATIENT: {basic.get('name', 'Unknown')} (ID: {summary['patient_id']})
+        - Age: {basic.get('age', 'Unknown')} | Gender: {basic.get('gender', 'Unknown')}
+        - Blood Group: {basic.get('blood_group', 'Unknown')} | BMI: {basic.get('bmi', 'Not calculated')}
+        - Health Patterns: Avg Glucose: {patterns.get('glucose_avg', 'N/A')} mg/dL, Avg BP: {patterns.get('bp_avg', 'N/A')} mmHg, Total Visits: {patterns.get('total_visits', 0)}
+        - Known Allergies: {len(summary['allergies'])} documented
+        - Recent Diagnoses: {', '.join(patterns.get('recent_diagnoses', [])) or 'None'}"""
+
+def encounter_text(number, activity):
+    return f"""Patient {number}:
+        - ID: {activity['patient_id']} | Name: {activity['patient_name']}
+        - Age: {activity['age']} years | Blood Type: {activity['blood_group']}
+        - Visit Date: {activity['visit_date']}
+        - Diagnosis: {activity['diagnosis'] or 'Not specified'}
+        - Treatment: {activity['treatment'] or 'Not specified'}"""
+
+def doctor_prompt(question, doctor_context=None, budget=None):
+    """(prompt, PromptReport) for the doctor assistant, doctor_context from get_doctor_context_for_ai"""
+    builder = PromptBuilder(budget)
+    builder.add('instructions', DOCTOR_INSTRUCTIONS, required=True)
+
+    if doctor_context and any(doctor_context.values()):
+        doc_info = doctor_context.get('doctor_info', {})
+        if doc_info:
+            builder.add('profile', f"""- Name: {doc_info.get('name', 'Unknown')}
+                - Specialization: {doc_info.get('specialization', 'General Practice')}
+                - Hospital: {doc_info.get('hospital', 'Not specified')}
+                - Experience: {doc_info.get('experience_years', 'Not specified')} years""",
+                header="DOCTOR PROFILE AND CONTEXT:\nPHYSICIAN PROFILE:", priority=1)
+
+        stats = doctor_context.get('statistics', {})
+        if stats:
+            builder.add('statistics', f"""- Total patients managed: {stats.get('total_patients', 0)}
+                - Total medical records: {stats.get('total_records', 0)}
+                - Last activity: {stats.get('last_activity', 'No activity')}""",
+                header="PRACTICE STATISTICS:", priority=3)
+
+        recent = doctor_context.get('recent_activities', [])
+        builder.add('recent encounters', [encounter_text(number, activity) for number, activity in enumerate(recent, start=1)],
+                    header=f"RECENT PATIENT ENCOUNTERS ({len(recent)} recent):", priority=4)
+
+        # the patients the doctor selected are what the question is most likely about
+        summaries = doctor_context.get('patient_summaries', [])
+        builder.add('selected patients', [patient_summary_text(summary) for summary in summaries],
+                    header="SELECTED PATIENT DETAILED SUMMARIES:", priority=2)
+
+    builder.add('question', f"DOCTOR'S QUESTION/REQUEST: {question}", required=True)
+    return builder.build()
@@ -0,0 +1,120 @@
+# Patient search backed by indexes (migration 6)
+#
+# the old search was LIKE '%term%' over five columns, which scans the whole table.
+# now substring matches come from the FULLTEXT ngram index ft_patients_search on
+# (patient_id, first_name, last_name, email, phone). Terms shorter than the ngram size
+# are not in that index, they fall back to prefix LIKE on the primary key / name,
+# email and phone indexes, combined with UNION so each branch uses its own index.
+
+from dataclasses import dataclass
+
+# server default ngram_token_size, words shorter than this are not in the FULLTEXT index
+NGRAM_SIZE = 2
+
+def normalize(term):
+    return ' '.join((term or '').split())
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def fulltext_query(term):
+    """Boolean mode query requiring every word as an (ngram) phrase, so "jo smi" finds John Smith"""
+    words = [word.replace('"', '') for word in term.split()]
+    words = [word for word in words if len(word) >= NGRAM_SIZE]
+    return ' '.join(f'+"{word}"' for word in words)
+
+SEARCH_COLUMNS = ('patient_id', 'first_name', 'last_name', 'email', 'phone')
+
+def patient_match_sql(term):
+    """(sql, params) selecting the patient_id of every patient matching term"""
+    term = normalize(term)
+    query = fulltext_query(term)
+    if query:
+        return (f"SELECT patient_id FROM patients WHERE MATCH({', '.join(SEARCH_COLUMNS)}) AGAINST (%s IN BOOLEAN MODE)",
+                [query])
+
+    prefix = escape_like(term) + '%'
+    branches = [f'SELECT patient_id FROM patients WHERE {column} LIKE %s' for column in SEARCH_COLUMNS]
+    return ' UNION '.join(branches), [prefix] * len(branches)
+
+def patient_search_sql(columns, term="", blood_group=None):
+    """(sql, params) for SELECT columns FROM patients p matching term / blood group.
+    columns are qualified with p., the caller appends ORDER BY / LIMIT"""
+    sql = f'SELECT {columns} FROM patients p'
+    params = []
+    if normalize(term):
+        match_sql, params = patient_match_sql(term)
+        sql += f' JOIN ({match_sql}) hits ON hits.patient_id = p.patient_id'
+    sql += ' WHERE 1=1'
+    if blood_group:
+        sql += ' AND p.blood_group = %s'
+        params.append(blood_group)
+    return sql, params
+
+
+# keyset pagination
+#   order is [(sql expression, 'ASC' | 'DESC')], ending in a unique column so the order is total.
+#   the order expressions are selected after the caller's columns, the last row's values
+#   are the cursor for the next page (no OFFSET, every page costs the same).
+
+PAGE_SIZE = 20
+COUNT_CAP = 1000    # counts above this are shown as "1000+"
+
+@dataclass
+class SearchPage:
+    rows: list
+    next_after: tuple = None    # pass as after= for the next page, None on the last page
+    total: int = None           # only computed for the first page
+    total_capped: bool = False
+
+def order_columns(order):
+    return ', '.join(expression for expression, _ in order)
+
+def keyset_sql(order, after):
+    """(sql, params) AND clause for the rows strictly after the key `after` in `order`"""
+    if not after:
+        return '', []
+    # a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z) ...
+    clauses, params = [], []
+    for index, (expression, direction) in enumerate(order):
+        conditions = [f'{column} = %s' for column, _ in order[:index]]
+        conditions.append(f"{expression} {'>' if direction == 'ASC' else '<'} %s")
+        clauses.append('(' + ' AND '.join(conditions) + ')')
+        params.extend(after[:index + 1])
+    return ' AND (' + ' OR '.join(clauses) + ')', params
+
+def count_sql(sql):
+    """Capped COUNT(*) of sql (SELECT <columns> FROM ...), takes sql's params + [cap + 1].
+    The select list is replaced by 1: a derived table can't have duplicate column names, and the
+    order columns repeat the caller's columns"""
+    head, separator, rest = sql.partition(' FROM ')
+    if not head.lstrip().upper().startswith('SELECT') or not separator:
+        raise ValueError("Expected a SELECT ... FROM ... query")
+    return f'SELECT COUNT(*) FROM (SELECT 1 FROM {rest} LIMIT %s) capped'
+
+def count_estimate(cursor, sql, params, cap=COUNT_CAP):
+    """(count, capped) of the rows of sql, never counting past cap"""
+    cursor.execute(count_sql(sql), list(params) + [cap + 1])
+    total = cursor.fetchone()[0]
+    return min(total, cap), total > cap
+
+def fetch_page(cursor, sql, params, order, after=None, page_size=PAGE_SIZE, with_total=False):
+    """One SearchPage of sql (SELECT <columns>, <order columns> ... WHERE ...)"""
+    total, capped = count_estimate(cursor, sql, params) if with_total else (None, False)
+
+    keyset, keyset_params = keyset_sql(order, after)
+    order_by = ', '.join(f'{expression} {direction}' for expression, direction in order)
+    cursor.execute(f'{sql}{keyset} ORDER BY {order_by} LIMIT %s', list(params) + keyset_params + [page_size + 1])
+    rows = cursor.fetchall()
+
+    key_width = len(order)
+    next_after = tuple(rows[page_size - 1][-key_width:]) if len(rows) > page_size else None
+    return SearchPage([row[:-key_width] for row in rows[:page_size]], next_after, total, capped)
+
+PATIENT_ORDER = [('p.first_name', 'ASC'), ('p.last_name', 'ASC'), ('p.patient_id', 'ASC')]
+
+DOCTOR_PATIENT_COLUMNS = 'p.patient_id, p.first_name, p.last_name, p.email, p.phone, p.blood_group, p.date_of_birth'
+
+def doctor_patient_search_sql(term="", blood_group=None):
+    """(sql, params) of the doctor's Find Patients search, for fetch_page with PATIENT_ORDER"""
+    return patient_search_sql(f'{DOCTOR_PATIENT_COLUMNS}, {order_columns(PATIENT_ORDER)}', term, blood_group)
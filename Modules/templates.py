@@ -0,0 +1,231 @@
+# Batch upload template parsing (CSV / Excel -> medical record dicts)
+#
+# columnar: every column is cleaned / converted once for the whole file with pandas,
+# only rows that have a problem are looked at one by one (to build the error report).
+#
+# large CSV files are not parsed in the app at all: the preview reads a bounded sample and
+# the import worker streams the file in chunks of TEMPLATE_CHUNK_ROWS (iter_template_chunks).
+
+import os
+from dataclasses import dataclass
+
+import pandas as pd
+
+CSV_TYPES = ["text/csv"]
+EXCEL_TYPES = ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]
+
+# standard name -> accepted header names (after strip / lower / spaces to _)
+REQUIRED_COLUMNS = {
+    'patient_id': ['patient_id', 'patientid', 'id'],
+    'visit_date': ['visit_date', 'date'],
+}
+TEXT_COLUMNS = {
+    'diagnosis': ['diagnosis', 'condition', 'primary_diagnosis'],
+    'treatment': ['treatment', 'treatment_plan', 'therapy'],
+    'prescription': ['prescription', 'medications', 'drugs'],
+    'notes': ['notes', 'comments', 'observations'],
+}
+VITAL_COLUMNS = {
+    'glucose_level': ['glucose', 'glucose_level', 'blood_glucose'],
+    'blood_pressure_systolic': ['systolic', 'bp_systolic', 'blood_pressure_systolic'],
+    'blood_pressure_diastolic': ['diastolic', 'bp_diastolic', 'blood_pressure_diastolic'],
+    'heart_rate': ['heart_rate', 'pulse', 'hr'],
+    'temperature': ['temperature', 'temp', 'body_temp'],
+}
+RECORD_COLUMNS = ['patient_id', 'visit_date', 'diagnosis', 'treatment', 'prescription', 'notes',
+                  'glucose_level', 'blood_pressure_systolic', 'blood_pressure_diastolic', 'heart_rate', 'temperature']
+
+# tried in order, a value keeps the first format that parses it. Month first before day
+# first for xx/xx/yyyy like pandas' own guess, the old parser's behaviour.
+DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y']
+
+FIRST_DATA_ROW = 2  # row numbers in the report are spreadsheet rows, row 1 is the header
+
+PREVIEW_SAMPLE_ROWS = 1000  # rows parsed for the preview of a streamed file
+
+def chunk_rows():
+    return int(os.getenv('TEMPLATE_CHUNK_ROWS', 10000))
+
+def stream_threshold_bytes():
+    """CSV uploads above this size are imported in streaming mode"""
+    return int(float(os.getenv('STREAM_IMPORT_MB', 50)) * 1024 * 1024)
+
+def stream_max_bytes():
+    return int(float(os.getenv('STREAM_IMPORT_MAX_MB', 4096)) * 1024 * 1024)
+
+def is_streamable(uploaded_file):
+    return (uploaded_file.name.lower().endswith('.csv')
+            and (uploaded_file.size or 0) > stream_threshold_bytes())
+
+def read_template(uploaded_file):
+    """DataFrame of the upload with every cell as text, None for unsupported types"""
+    if uploaded_file.type in CSV_TYPES:
+        return pd.read_csv(uploaded_file, dtype=str)
+    if uploaded_file.type in EXCEL_TYPES:
+        return pd.read_excel(uploaded_file, dtype=str)
+    return None
+
+def map_columns(df):
+    """{file column: standard name}, first accepted header wins"""
+    mapping = {}
+    for standard_name, possible_names in {**REQUIRED_COLUMNS, **TEXT_COLUMNS, **VITAL_COLUMNS}.items():
+        for possible_name in possible_names:
+            if possible_name in df.columns:
+                mapping[possible_name] = standard_name
+                break
+    return mapping
+
+def clean_text(column):
+    column = column.astype('string').str.strip()
+    return column.mask(column == '')
+
+def as_list(column):
+    """Python values (str / int / float / date), None for missing"""
+    return column.astype(object).where(column.notna(), None).tolist()
+
+def parse_dates(column):
+    parsed = pd.Series(pd.NaT, index=column.index, dtype='datetime64[ns]')
+    for date_format in DATE_FORMATS:
+        pending = parsed.isna() & column.notna()
+        if not pending.any():
+            break
+        parsed[pending] = pd.to_datetime(column[pending], format=date_format, errors='coerce')
+    # anything else pandas can still make sense of, only for the few values left
+    pending = parsed.isna() & column.notna()
+    if pending.any():
+        parsed[pending] = pd.to_datetime(column[pending], format='mixed', errors='coerce')
+    return parsed
+
+def normalize_columns(columns):
+    return columns.astype(str).str.strip().str.lower().str.replace(' ', '_')
+
+def missing_required_columns(columns):
+    columns = set(normalize_columns(columns))
+    return [name for name, accepted in REQUIRED_COLUMNS.items() if not columns & set(accepted)]
+
+def parse_template(df):
+    """(records, row_errors) for a template DataFrame.
+
+    Fully empty rows are skipped silently. Rows without patient_id / a valid visit_date are
+    skipped and reported, vitals that aren't numbers are reported and left empty.
+    row_errors: [{'row', 'column', 'value', 'error', 'skipped'}] in row order
+    """
+    records, _, row_errors = parse_template_rows(df)
+    return records, row_errors
+
+def parse_template_rows(df):
+    """parse_template that also returns the spreadsheet row of every record: (records, rows, row_errors)"""
+    df = df.copy()
+    df.columns = normalize_columns(df.columns)
+    df = df.rename(columns=map_columns(df))
+
+    frame = pd.DataFrame(index=df.index)
+    for column in RECORD_COLUMNS:
+        frame[column] = clean_text(df[column]) if column in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+
+    visit_dates = parse_dates(frame['visit_date'])
+    vitals = {column: pd.to_numeric(frame[column], errors='coerce') for column in VITAL_COLUMNS}
+    return build_records(frame, visit_dates, vitals)
+
+def build_records(frame, visit_dates, vitals, first_row=FIRST_DATA_ROW):
+    """Validate converted columns and zip them into records: (records, rows, row_errors).
+
+    frame has every RECORD_COLUMNS column as read (missing values NA), visit_dates / vitals
+    are the converted columns, NaT / NaN where a value present in frame didn't convert.
+    """
+    present = frame.notna()
+    non_empty = present.any(axis=1)
+
+    problems = []   # (mask, column, error, skipped)
+    problems.append((non_empty & ~present['patient_id'], 'patient_id', "Missing patient ID", True))
+    problems.append((non_empty & ~present['visit_date'], 'visit_date', "Missing visit date", True))
+    problems.append((present['visit_date'] & visit_dates.isna(), 'visit_date', "Unrecognised date", True))
+    for column, values in vitals.items():
+        problems.append((present[column] & values.isna(), column, "Not a number, left empty", False))
+
+    skipped = pd.Series(False, index=frame.index)
+    row_errors = []
+    for mask, column, error, skips in problems:
+        if skips:
+            skipped |= mask
+        for index in mask[mask].index:
+            value = frame.at[index, column]
+            row_errors.append({'row': int(index) + first_row, 'column': column,
+                               'value': None if pd.isna(value) else value, 'error': error, 'skipped': skips})
+    row_errors.sort(key=lambda entry: entry['row'])
+
+    # records are zipped from whole columns, DataFrame.to_dict boxes every cell on its own
+    keep = non_empty & ~skipped
+    columns = {column: frame[column][keep] for column in RECORD_COLUMNS}
+    columns['visit_date'] = visit_dates[keep].dt.date
+    columns.update({column: values[keep] for column, values in vitals.items()})
+    values = [as_list(columns[column]) for column in RECORD_COLUMNS]
+    records = [dict(zip(RECORD_COLUMNS, row)) for row in zip(*values)]
+    rows = (keep[keep].index + first_row).tolist()
+    return records, rows, row_errors
+
+def parse_template_file(uploaded_file):
+    """(records or None, message, row_errors)"""
+    try:
+        df = read_template(uploaded_file)
+        if df is None:
+            return None, "Unsupported file format. Please upload CSV or Excel files.", []
+
+        missing_required = missing_required_columns(df.columns)
+        if missing_required:
+            return None, f"Missing required columns: {', '.join(missing_required)}", []
+
+        records, row_errors = parse_template(df)
+        skipped_rows = len({entry['row'] for entry in row_errors if entry['skipped']})
+        message = f"Successfully parsed {len(records)} records from template"
+        if skipped_rows:
+            message += f", {skipped_rows} rows skipped"
+        return records, message, row_errors
+    except Exception as e:
+        return None, f"Error parsing file: {str(e)}", []
+
+def preview_template(uploaded_file, sample_rows=PREVIEW_SAMPLE_ROWS):
+    """parse_template_file for the first sample_rows rows of a CSV only, memory stays bounded
+    whatever the file size. Returns (records or None, message, row_errors)"""
+    try:
+        uploaded_file.seek(0)
+        df = pd.read_csv(uploaded_file, dtype=str, nrows=sample_rows)
+        missing_required = missing_required_columns(df.columns)
+        if missing_required:
+            return None, f"Missing required columns: {', '.join(missing_required)}", []
+        records, row_errors = parse_template(df)
+        return records, f"Parsed {len(records)} records from the first {len(df)} rows", row_errors
+    except Exception as e:
+        return None, f"Error parsing file: {str(e)}", []
+    finally:
+        uploaded_file.seek(0)
+
+@dataclass
+class TemplateChunk:
+    start: int          # data rows of the file before this chunk
+    end: int            # data rows of the file up to and including this chunk
+    records: list
+    rows: list          # spreadsheet row of each record
+    row_errors: list
+
+def iter_template_chunks(source, size=None, skip_rows=0):
+    """Parse a CSV template (path or binary file) chunk by chunk, yields TemplateChunks.
+
+    Only one chunk of size rows is in memory at a time. The first skip_rows data rows
+    (already imported, e.g. a resumed job) are read past without being parsed.
+    Raises ValueError when required columns are missing.
+    """
+    size = size or chunk_rows()
+    with pd.read_csv(source, dtype=str, chunksize=size) as reader:
+        for df in reader:
+            start, end = int(df.index.start), int(df.index.start) + len(df)
+            if start == 0:
+                missing_required = missing_required_columns(df.columns)
+                if missing_required:
+                    raise ValueError(f"Missing required columns: {', '.join(missing_required)}")
+            if end <= skip_rows:
+                continue
+            if start < skip_rows:
+                df = df.iloc[skip_rows - start:]
+            records, rows, row_errors = parse_template_rows(df)
+            yield TemplateChunk(start, end, records, rows, row_errors)
@@ -0,0 +1,34 @@
+# Thumbnails for medical images (small previews for listings)
+
+import io
+from PIL import Image, ImageOps, features
+
+THUMBNAIL_SIZE = (320, 320)
+WEBP_QUALITY = 80
+
+def make_thumbnail(source, size=THUMBNAIL_SIZE):
+    """Downscale image bytes (or a file object / path) to a WebP preview, JPEG if WebP is missing"""
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        with Image.open(source) as image:
+            image.draft('RGB', size)    # lets JPEG decode at reduced scale
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'F'):
+                # 16 bit / float scans (common for X-ray) -> 8 bit grayscale
+                image = image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+            image.thumbnail(size)
+
+            buffer = io.BytesIO()
+            if features.check('webp'):
+                if image.mode not in ('RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+                image.save(buffer, format='WEBP', quality=WEBP_QUALITY)
+                return buffer.getvalue(), 'image/webp'
+
+            image = image.convert('RGB')
+            image.save(buffer, format='JPEG', quality=WEBP_QUALITY, optimize=True)
+            return buffer.getvalue(), 'image/jpeg'
+    except Exception:
+        # unreadable image, listing just shows no preview
+        return None, None
@@ -0,0 +1,63 @@
+# Benchmark for Parquet / Arrow imports (Modules/arrow_io.py)
+#
+# Writes the same generated records as a CSV template and as a typed Parquet file and times
+# turning each into insertable records chunk by chunk (what the import worker does), plus
+# the file sizes. Needs no database.
+#
+#   python benchmarks/arrow_benchmark.py --rows 1000000
+
+import argparse, io, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Modules import templates, arrow_io
+from template_benchmark import make_csv
+
+def to_parquet(data):
+    """The CSV's rows as a typed Parquet file, like an arrow_io export"""
+    df = pd.read_csv(io.BytesIO(data), dtype=str)
+    table = pa.table({
+        'patient_id': df['patient_id'],
+        'visit_date': pd.to_datetime(df['visit_date'], format='mixed', errors='coerce').dt.date,
+        **{column: df[column] for column in templates.TEXT_COLUMNS},
+        **{column: pd.to_numeric(df[column], errors='coerce') for column in templates.VITAL_COLUMNS},
+    })
+    output = io.BytesIO()
+    pq.write_table(table, output, compression='zstd')
+    return output.getvalue()
+
+def consume(chunks):
+    records = issues = 0
+    for chunk in chunks:
+        records += len(chunk.records)
+        issues += len(chunk.row_errors)
+    return records, issues
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CSV vs Parquet imports")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--chunk-rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    data = make_csv(args.rows, bad_fraction=0.0)
+    parquet = to_parquet(data)
+
+    print(f"\n| format | file MB | seconds | records |")
+    print("|---|---|---|---|")
+    runs = [
+        ("CSV", data, lambda: templates.iter_template_chunks(io.BytesIO(data), size=args.chunk_rows)),
+        ("Parquet (zstd)", parquet,
+         lambda: arrow_io.iter_arrow_chunks(io.BytesIO(parquet), 'bench.parquet', size=args.chunk_rows)),
+    ]
+    for name, payload, chunks in runs:
+        start = time.perf_counter()
+        records, _ = consume(chunks())
+        seconds = time.perf_counter() - start
+        print(f"| {name} | {len(payload) / 1024 / 1024:.1f} | {seconds:.2f} | {records} |")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Benchmark for the batch upload insert path (Modules/batch_import.py)
+#
+# Inserts generated records into a separate benchmark database, once with the previous
+# one INSERT per row loop and once with the chunked multi-row INSERT engine, and prints
+# rows/sec for both. A few rows reference a missing patient to exercise the bad row path.
+#
+#   python benchmarks/batch_import_benchmark.py --records 100000
+#
+# uses DB_HOST / DB_USER / DB_PASSWORD from .env, never DB_NAME.
+
+import argparse, os, random, sys, time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+import mysql.connector
+
+from Modules import batch_import
+
+def make_records(count, patients, bad_rows, seed=42):
+    rng = random.Random(seed)
+    bad = set(rng.sample(range(count), min(bad_rows, count)))
+    start = date(2020, 1, 1)
+    return [{
+        'patient_id': 'PATMISSING' if n in bad else f"PAT{rng.randrange(patients):08d}",
+        'visit_date': start + timedelta(days=rng.randrange(1800)),
+        'diagnosis': 'Hypertension', 'treatment': 'Lifestyle modification',
+        'prescription': 'Lisinopril 10mg daily', 'notes': 'Follow up in 3 months',
+        'glucose_level': 70 + rng.randrange(120), 'blood_pressure_systolic': 110 + rng.randrange(50),
+        'blood_pressure_diastolic': 70 + rng.randrange(30), 'heart_rate': 60 + rng.randrange(40),
+        'temperature': 36 + rng.randrange(20) / 10,
+    } for n in range(count)]
+
+def row_by_row(conn, records, doctor_id):
+    """The loop add_batch_medical_records used before (one execute per record, one commit)"""
+    cursor = conn.cursor()
+    inserted = 0
+    for record in records:
+        try:
+            cursor.execute(batch_import.INSERT_RECORD, batch_import.record_params(record, doctor_id))
+            inserted += 1
+        except mysql.connector.Error:
+            continue
+    conn.commit()
+    cursor.close()
+    return inserted
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batch record inserts")
+    parser.add_argument('--database', default='batch_import_bench')
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--bad-rows', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--skip-row-by-row', action='store_true')
+    args = parser.parse_args()
+
+    load_dotenv()
+    server = dict(host=os.getenv('DB_HOST', 'localhost'), user=os.getenv('DB_USER', 'root'),
+                  password=os.getenv('DB_PASSWORD', ''))
+    conn = mysql.connector.connect(**server)
+    conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+    conn.close()
+
+    os.environ['DB_NAME'] = args.database
+    from Modules import migrations
+    migrations.run_migrations()
+
+    conn = mysql.connector.connect(database=args.database, **server)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT IGNORE INTO doctors (doctor_id, first_name, last_name, email, password_hash)
+        VALUES ('DOCBENCH0001', 'Bench', 'Doctor', 'bench.doctor@bench.local', 'x')
+    ''')
+    cursor.executemany('''
+        INSERT IGNORE INTO patients (patient_id, first_name, last_name, email, password_hash)
+        VALUES (%s, 'Pat', %s, %s, 'x')
+    ''', [(f"PAT{n:08d}", f"P{n}", f"pat{n}@bench.local") for n in range(args.patients)])
+    conn.commit()
+    cursor.close()
+
+    records = make_records(args.records, args.patients, args.bad_rows)
+    print(f"\n| path | inserted | failed | seconds | rows/sec |")
+    print("|---|---|---|---|---|")
+
+    if not args.skip_row_by_row:
+        start = time.perf_counter()
+        inserted = row_by_row(conn, records, 'DOCBENCH0001')
+        seconds = time.perf_counter() - start
+        print(f"| row by row (before) | {inserted} | {len(records) - inserted} | {seconds:.2f} | {inserted / seconds:,.0f} |")
+
+    result = batch_import.insert_records(conn, records, 'DOCBENCH0001', size=args.batch_size)
+    print(f"| multi-row INSERT x{args.batch_size} | {result.inserted} | {len(result.failed)} | "
+          f"{result.seconds:.2f} | {result.rows_per_sec:,.0f} |")
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Benchmark for the medical_records secondary indexes (migration 2)
+#
+# Seeds a separate benchmark database and times the dashboard / AI context queries
+# with the new indexes and with them ignored (= the schema before migration 2,
+# where only the implicit foreign key indexes exist). Prints EXPLAIN and latencies.
+#
+#   python benchmarks/index_benchmark.py --records 10000000
+#
+# uses DB_HOST / DB_USER / DB_PASSWORD from .env, never DB_NAME.
+
+import argparse, os, random, statistics, sys, time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+import mysql.connector
+
+QUERIES = [
+    ("patient_records (1 year)", "idx_records_patient_visit", '''
+        SELECT mr.*, d.first_name, d.last_name, d.specialization
+        FROM medical_records mr {hint}
+        LEFT JOIN doctors d ON mr.doctor_id = d.doctor_id
+        WHERE mr.patient_id = %s AND mr.visit_date BETWEEN %s AND %s
+        ORDER BY mr.visit_date DESC
+    ''', 'patient'),
+    ("vital_trends", "idx_records_patient_visit", '''
+        SELECT visit_date, glucose_level, blood_pressure_systolic,
+               blood_pressure_diastolic, heart_rate, temperature
+        FROM medical_records {hint}
+        WHERE patient_id = %s AND visit_date IS NOT NULL
+        ORDER BY visit_date ASC
+    ''', 'patient_all'),
+    ("doctor recent records", "idx_records_doctor_visit", '''
+        SELECT mr.patient_id, p.first_name, p.last_name, mr.visit_date, mr.diagnosis
+        FROM medical_records mr {hint}
+        JOIN patients p ON mr.patient_id = p.patient_id
+        WHERE mr.doctor_id = %s
+        ORDER BY mr.visit_date DESC LIMIT 10
+    ''', 'doctor'),
+]
+
+def seed(conn, patients, doctors, records):
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM medical_records')
+    have = cursor.fetchone()[0]
+    if have >= records:
+        print(f"Using existing {have} medical_records rows")
+        return
+
+    print(f"Seeding {patients} patients, {doctors} doctors, {records} records ...")
+    cursor.execute('SET SESSION cte_max_recursion_depth = 1000000')
+    cursor.execute('CREATE TABLE IF NOT EXISTS bench_seq (n INT PRIMARY KEY)')
+    cursor.execute('''
+        INSERT IGNORE INTO bench_seq (n)
+        WITH RECURSIVE s (n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM s WHERE n < 9999)
+        SELECT n FROM s
+    ''')
+    cursor.execute('''
+        INSERT IGNORE INTO doctors (doctor_id, first_name, last_name, email, password_hash, specialization)
+        SELECT CONCAT('DOC', LPAD(n, 8, '0')), 'Doc', CONCAT('D', n), CONCAT('doc', n, '@bench.local'), 'x', 'General Practice'
+        FROM bench_seq WHERE n < %s
+    ''', (doctors,))
+    for block in range(0, patients, 10000):
+        cursor.execute('''
+            INSERT IGNORE INTO patients (patient_id, first_name, last_name, email, password_hash)
+            SELECT CONCAT('PAT', LPAD(%s + n, 8, '0')), 'Pat', CONCAT('P', %s + n), CONCAT('pat', %s + n, '@bench.local'), 'x'
+            FROM bench_seq WHERE %s + n < %s
+        ''', (block, block, block, block, patients))
+        conn.commit()
+
+    for block in range(have, records, 10000):
+        cursor.execute('''
+            INSERT INTO medical_records (patient_id, doctor_id, visit_date, diagnosis,
+                                         glucose_level, blood_pressure_systolic, blood_pressure_diastolic,
+                                         heart_rate, temperature)
+            SELECT CONCAT('PAT', LPAD((%s + n) MOD %s, 8, '0')),
+                   CONCAT('DOC', LPAD((%s + n) MOD %s, 8, '0')),
+                   CURDATE() - INTERVAL ((%s + n) * 7919) MOD 3650 DAY,
+                   'Routine checkup', 70 + (n MOD 120), 100 + (n MOD 60), 60 + (n MOD 40),
+                   55 + (n MOD 50), 36.0 + (n MOD 20) / 10
+            FROM bench_seq WHERE %s + n < %s
+        ''', (block, patients, block, doctors, block, block, records))
+        conn.commit()
+        if (block // 10000) % 100 == 0:
+            print(f"  {block + 10000} rows")
+    cursor.execute('ANALYZE TABLE medical_records')
+    cursor.fetchall()
+    cursor.close()
+
+def time_query(cursor, sql, params, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def explain(cursor, sql, params):
+    cursor.execute('EXPLAIN ' + sql, params)
+    columns = [c[0] for c in cursor.description]
+    row = dict(zip(columns, cursor.fetchone()))
+    cursor.fetchall()
+    return f"key={row.get('key')} rows={row.get('rows')} extra={row.get('Extra')}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark medical_records indexes")
+    parser.add_argument('--database', default='medical_records_bench')
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--doctors', type=int, default=500)
+    parser.add_argument('--records', type=int, default=10000000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    load_dotenv()
+    server = dict(host=os.getenv('DB_HOST', 'localhost'), user=os.getenv('DB_USER', 'root'),
+                  password=os.getenv('DB_PASSWORD', ''))
+    conn = mysql.connector.connect(**server)
+    conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+    conn.close()
+
+    # build the schema in the benchmark database with the app's own migrations
+    os.environ['DB_NAME'] = args.database
+    from Modules import migrations
+    migrations.run_migrations()
+
+    conn = mysql.connector.connect(database=args.database, **server)
+    seed(conn, args.patients, args.doctors, args.records)
+    cursor = conn.cursor()
+
+    rng = random.Random(42)
+    today = date.today()
+    print(f"\n| query | plan without index | plan with index | median ms without | median ms with |")
+    print("|---|---|---|---|---|")
+    for name, index, sql, kind in QUERIES:
+        if kind == 'doctor':
+            params = (f"DOC{rng.randrange(args.doctors):08d}",)
+        elif kind == 'patient':
+            params = (f"PAT{rng.randrange(args.patients):08d}", today - timedelta(days=365), today)
+        else:
+            params = (f"PAT{rng.randrange(args.patients):08d}",)
+
+        without_sql = sql.format(hint=f'IGNORE INDEX ({index})')
+        with_sql = sql.format(hint='')
+        plan_without, plan_with = explain(cursor, without_sql, params), explain(cursor, with_sql, params)
+        ms_without = time_query(cursor, without_sql, params, args.runs)
+        ms_with = time_query(cursor, with_sql, params, args.runs)
+        print(f"| {name} | {plan_without} | {plan_with} | {ms_without:.2f} | {ms_with:.2f} |")
+
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Benchmark for the indexed patient search (migration 6, Modules/search.py)
+#
+# Seeds a separate benchmark database with patients and times typical search terms
+# with the old LIKE '%term%' query and with the FULLTEXT ngram / prefix index search.
+# Prints row counts for both (they should agree) and the median latency.
+#
+#   python benchmarks/search_benchmark.py --patients 1000000
+#
+# uses DB_HOST / DB_USER / DB_PASSWORD from .env, never DB_NAME.
+
+import argparse, os, random, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+import mysql.connector
+
+from Modules import search
+
+TARGET_MS = 50
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'Aarav', 'Priya', 'Rohan', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Kavya', 'Rahul', 'Pooja',
+               'Mohammed', 'Fatima', 'Wei', 'Mei', 'Hiroshi', 'Yuki', 'Carlos', 'Lucia', 'Olga', 'Ivan']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+              'Sharma', 'Patel', 'Singh', 'Kumar', 'Gupta', 'Reddy', 'Iyer', 'Nair', 'Das', 'Mehta',
+              'Khan', 'Wang', 'Li', 'Tanaka', 'Sato', 'Fernandez', 'Lopez', 'Ivanova', 'Petrov', 'Kowalski']
+BLOOD_GROUPS = ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-']
+
+# (label, term, blood group)
+TERMS = [
+    ("full name", "priya sharma", None),
+    ("last name fragment", "owals", None),
+    ("first name prefix", "moh", None),
+    ("patient id fragment", "0004242", None),
+    ("phone fragment", "98765", None),
+    ("email", "rahul.gupta7", None),
+    ("1 character", "z", None),
+    ("name + blood group", "garcia", "AB-"),
+]
+
+OLD_SQL = '''
+    SELECT patient_id, first_name, last_name, email, phone, blood_group, date_of_birth
+    FROM patients
+    WHERE (patient_id LIKE %s OR first_name LIKE %s OR last_name LIKE %s OR email LIKE %s OR phone LIKE %s)
+'''
+
+COLUMNS = 'p.patient_id, p.first_name, p.last_name, p.email, p.phone, p.blood_group, p.date_of_birth'
+
+def seed(conn, patients):
+    cursor = conn.cursor()
+    cursor.execute('SELECT COUNT(*) FROM patients')
+    have = cursor.fetchone()[0]
+    if have >= patients:
+        print(f"Using existing {have} patients")
+        return
+
+    print(f"Seeding {patients} patients ...")
+    rng = random.Random(have)
+    for block in range(have, patients, 5000):
+        rows = []
+        for n in range(block, min(block + 5000, patients)):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            rows.append((f"PAT{n:08d}", first, last, f"{first.lower()}.{last.lower()}{n}@bench.local", 'x',
+                         f"9{rng.randrange(10 ** 9):09d}", rng.choice(BLOOD_GROUPS)))
+        cursor.executemany('''
+            INSERT INTO patients (patient_id, first_name, last_name, email, password_hash, phone, blood_group)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', rows)
+        conn.commit()
+        if (block // 5000) % 20 == 0:
+            print(f"  {block + len(rows)} patients")
+    cursor.execute('ANALYZE TABLE patients')
+    cursor.fetchall()
+    cursor.execute('OPTIMIZE TABLE patients')   # merges the FULLTEXT index cache into the index
+    cursor.fetchall()
+    cursor.close()
+
+def time_query(cursor, sql, params, runs):
+    timings = []
+    rows = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        rows = len(cursor.fetchall())
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), rows
+
+def plan(cursor, sql, params):
+    cursor.execute('EXPLAIN ' + sql, params)
+    columns = [c[0] for c in cursor.description]
+    keys = [dict(zip(columns, row)).get('key') for row in cursor.fetchall()]
+    return ', '.join(sorted({key for key in keys if key})) or 'full scan'
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indexed patient search")
+    parser.add_argument('--database', default='patient_search_bench')
+    parser.add_argument('--patients', type=int, default=1000000)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    load_dotenv()
+    server = dict(host=os.getenv('DB_HOST', 'localhost'), user=os.getenv('DB_USER', 'root'),
+                  password=os.getenv('DB_PASSWORD', ''))
+    conn = mysql.connector.connect(**server)
+    conn.cursor().execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+    conn.close()
+
+    # build the schema in the benchmark database with the app's own migrations
+    os.environ['DB_NAME'] = args.database
+    from Modules import migrations
+    migrations.run_migrations()
+
+    conn = mysql.connector.connect(database=args.database, **server)
+    seed(conn, args.patients)
+    cursor = conn.cursor()
+
+    print(f"\n| search | rows old / new | old plan | new plan | median ms old | median ms new | < {TARGET_MS} ms |")
+    print("|---|---|---|---|---|---|---|")
+    for label, term, blood_group in TERMS:
+        old_sql, old_params = OLD_SQL, [f'%{term}%'] * 5
+        if blood_group:
+            old_sql += ' AND blood_group = %s'
+            old_params.append(blood_group)
+        new_sql, new_params = search.patient_search_sql(COLUMNS, term, blood_group)
+
+        ms_old, rows_old = time_query(cursor, old_sql, old_params, args.runs)
+        ms_new, rows_new = time_query(cursor, new_sql, new_params, args.runs)
+        print(f"| {label} `{term}` | {rows_old} / {rows_new} | {plan(cursor, old_sql, old_params)} | "
+              f"{plan(cursor, new_sql, new_params)} | {ms_old:.2f} | {ms_new:.2f} | "
+              f"{'yes' if ms_new < TARGET_MS else 'NO'} |")
+
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    main()
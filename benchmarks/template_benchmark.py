@@ -0,0 +1,146 @@
+# Benchmark for batch template parsing (Modules/templates.py)
+#
+# Generates a template CSV in memory and times the columnar parser against the
+# previous row by row (iterrows) implementation. Needs no database.
+# --memory compares the peak memory of whole file parsing and of the streaming
+# (chunked) parser used for large uploads.
+#
+#   python benchmarks/template_benchmark.py --rows 100000
+#   python benchmarks/template_benchmark.py --rows 1000000 --memory
+
+import argparse, io, os, random, sys, tempfile, time, tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from Modules import templates
+
+HEADER = ("patient_id,visit_date,diagnosis,treatment,prescription,notes,glucose_level,"
+          "blood_pressure_systolic,blood_pressure_diastolic,heart_rate,temperature")
+
+def make_csv(rows, bad_fraction, seed=42):
+    rng = random.Random(seed)
+    start = date(2020, 1, 1)
+    lines = [HEADER]
+    for n in range(rows):
+        visit = start + timedelta(days=rng.randrange(1800))
+        visit_text = visit.isoformat() if rng.random() < 0.8 else visit.strftime('%m/%d/%Y')
+        glucose = str(70 + rng.randrange(120))
+        if rng.random() < bad_fraction:
+            # a bit of everything the report has to catch
+            kind = rng.randrange(4)
+            if kind == 0:
+                visit_text = 'unknown'
+            elif kind == 1:
+                glucose = 'high'
+            elif kind == 2:
+                lines.append(',' * 10)
+                continue
+            else:
+                lines.append(f",{visit.isoformat()},Checkup,,,,,,,,")
+                continue
+        lines.append(f"PAT{rng.randrange(10 ** 8):08d},{visit_text},Hypertension,Lifestyle modification,"
+                     f"Lisinopril 10mg daily,Follow up in 3 months,{glucose},{110 + rng.randrange(50)},"
+                     f"{70 + rng.randrange(30)},{60 + rng.randrange(40)},{36 + rng.randrange(20) / 10}")
+    return '\n'.join(lines).encode('utf-8')
+
+def legacy_parse(df):
+    """The parser before the columnar rewrite (iterrows, per cell conversions), for comparison"""
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+    records_data = []
+    for _, row in df.iterrows():
+        if pd.isna(row.get('patient_id')) or pd.isna(row.get('visit_date')):
+            continue
+        record = {}
+        for col in templates.RECORD_COLUMNS:
+            if col in df.columns:
+                value = row[col]
+                if col == 'visit_date':
+                    try:
+                        record[col] = pd.to_datetime(value).date() if pd.notna(value) else date.today()
+                    except Exception:
+                        record[col] = date.today()
+                elif col in templates.VITAL_COLUMNS:
+                    try:
+                        record[col] = float(value) if pd.notna(value) and value != '' else None
+                    except Exception:
+                        record[col] = None
+                else:
+                    record[col] = str(value).strip() if pd.notna(value) and value != '' else None
+            else:
+                record[col] = None
+        records_data.append(record)
+    return records_data
+
+def peak_memory(parse):
+    """(seconds, peak MB allocated, result) of parse()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = parse()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return seconds, peak, result
+
+def memory_comparison(data, chunk_rows):
+    with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as csv_file:
+        csv_file.write(data)
+    try:
+        def whole_file():
+            records, row_errors = templates.parse_template(pd.read_csv(csv_file.name, dtype=str))
+            return len(records), len(row_errors)
+
+        def streaming():
+            records = errors = 0
+            for chunk in templates.iter_template_chunks(csv_file.name, size=chunk_rows):
+                records += len(chunk.records)
+                errors += len(chunk.row_errors)
+            return records, errors
+
+        print(f"\n| parser | seconds | peak MB | records | issues |")
+        print("|---|---|---|---|---|")
+        for name, parse in [("whole file", whole_file), (f"streaming x{chunk_rows}", streaming)]:
+            seconds, peak, (records, errors) = peak_memory(parse)
+            print(f"| {name} | {seconds:.2f} | {peak:,.0f} | {records} | {errors} |")
+    finally:
+        os.remove(csv_file.name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark template parsing")
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--bad-fraction', type=float, default=0.01)
+    parser.add_argument('--skip-legacy', action='store_true', help="only time the columnar parser")
+    parser.add_argument('--memory', action='store_true', help="peak memory, whole file vs streaming")
+    parser.add_argument('--chunk-rows', type=int, default=10000)
+    args = parser.parse_args()
+
+    data = make_csv(args.rows, args.bad_fraction)
+    print(f"{args.rows} rows, {len(data) / 1024 / 1024:.1f} MB CSV")
+    if args.memory:
+        memory_comparison(data, args.chunk_rows)
+        return
+
+    start = time.perf_counter()
+    df = pd.read_csv(io.BytesIO(data), dtype=str)
+    read_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records, row_errors = templates.parse_template(df)
+    parse_s = time.perf_counter() - start
+    print(f"\n| parser | read_csv s | parse s | records | reported rows |")
+    print("|---|---|---|---|---|")
+    print(f"| columnar | {read_s:.2f} | {parse_s:.2f} | {len(records)} | {len({e['row'] for e in row_errors})} |")
+
+    if not args.skip_legacy:
+        start = time.perf_counter()
+        df = pd.read_csv(io.BytesIO(data))
+        read_s = time.perf_counter() - start
+        start = time.perf_counter()
+        legacy = legacy_parse(df)
+        parse_s = time.perf_counter() - start
+        print(f"| iterrows (before) | {read_s:.2f} | {parse_s:.2f} | {len(legacy)} | - |")
+
+if __name__ == "__main__":
+    main()
@@ -7,19 +7,33 @@ import smtplib, time
 import configparser, os # for config ini file
 import hashlib, secrets
 import uuid, base64
-import qrcode, re
+import qrcode
 from PIL import Image
 from datetime import datetime, date, timedelta
 import socket, io
 import plotly.express as px
 import plotly.graph_objects as go
-import google.generativeai as genai # using gemini ai
 import pandas as pd
 
 # Importing Modules
 from Modules import pycss
 from Modules import db
 from Modules import qrhtml
+from Modules import migrations
+from Modules import thumbnails
+from Modules import blobstore
+from Modules import ingest
+from Modules import patient_data
+from Modules import search
+from Modules import directory
+from Modules import templates
+from Modules import batch_import
+from Modules import jobs
+from Modules import arrow_io
+from Modules import ai_context
+from Modules import ai_client
+from Modules import ai_cache
+from Modules import prompt_builder
 
 st.set_page_config(
     page_title="E-Medical Record System",
@@ -50,21 +64,11 @@ except:
     OTP_SUBJECT = "E-Medical Record System - OTP Verification"
     OTP_MESSAGE_BODY = "Your OTP for E-Medical Record System verification is: {otp}\n\nThis OTP will expire in 5 minutes.\n\nIf you didn't request this OTP, please ignore this email."
 
-# Configuring Gemini ai...
-try:
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if api_key:
-        genai.configure(api_key=api_key)
-        AI_AVAILABLE = True
-
-        # model using
-        AI_MODEL = genai.GenerativeModel('gemini-2.5-flash-lite')
-    else:
-        AI_AVAILABLE = False
-        print("Google API key not found in environment variables")
-except Exception as e:
-    AI_AVAILABLE = False
-    print(f"AI initialization failed: {e}")
+# Configuring the AI model client (Gemini, AI_BACKEND=stub for a local offline stand in)
+AI_CLIENT = ai_client.get_client()
+AI_AVAILABLE = AI_CLIENT is not None
+if not AI_AVAILABLE:
+    print(f"AI initialization failed: {ai_client.init_error()}")
 
 # functions for otp sending
 def send_otp_email(receiver_email, otp, sender_email=None, sender_password=None):
@@ -137,126 +141,9 @@ def init_session_state():
         st.session_state.show_batch_instructions = False
 
 def create_enhanced_tables():
-    conn = db.db_connection()
-    if not conn: 
-        return
-    cursor = conn.cursor()
-    try:
-        # patients table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                patient_id VARCHAR(20) PRIMARY KEY,
-                first_name VARCHAR(100) NOT NULL,
-                last_name VARCHAR(100) NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                phone VARCHAR(20),
-                date_of_birth DATE,
-                gender ENUM('Male', 'Female', 'Other', 'Prefer not to say'),
-                blood_group ENUM('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-', 'Unknown'),
-                address TEXT,
-                emergency_contact VARCHAR(100),
-                emergency_phone VARCHAR(20),
-                insurance_provider VARCHAR(100),
-                insurance_number VARCHAR(100),
-                height_cm INT,
-                weight_kg DECIMAL(5,2),
-                qr_token VARCHAR(255) UNIQUE,
-                last_login DATE,
-                health_streak INT DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        # doctors table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS doctors (
-                doctor_id VARCHAR(20) PRIMARY KEY,
-                first_name VARCHAR(100) NOT NULL,
-                last_name VARCHAR(100) NOT NULL,
-                email VARCHAR(255) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                phone VARCHAR(20),
-                license_number VARCHAR(50),
-                specialization VARCHAR(100),
-                hospital VARCHAR(200),
-                experience_years INT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # medical records
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS medical_records (
-                record_id INT AUTO_INCREMENT PRIMARY KEY,
-                patient_id VARCHAR(20),
-                doctor_id VARCHAR(20),
-                visit_date DATE NOT NULL,
-                diagnosis TEXT,
-                treatment TEXT,
-                prescription TEXT,
-                notes TEXT,
-                glucose_level DECIMAL(5,2),
-                blood_pressure_systolic INT,
-                blood_pressure_diastolic INT,
-                heart_rate INT,
-                temperature DECIMAL(4,1),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
-                FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
-            )
-        ''')
-        
-        # Medical files table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS medical_files (
-                file_id INT AUTO_INCREMENT PRIMARY KEY,
-                patient_id VARCHAR(20),
-                doctor_id VARCHAR(20),
-                file_name VARCHAR(200) NOT NULL,
-                file_data LONGBLOB NOT NULL,
-                file_type VARCHAR(50),
-                category ENUM('Lab Report', 'Medical Report', 'Prescription', 'Insurance', 'Other'),
-                description TEXT,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
-                FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
-            )
-        ''')
-        
-        # Medical images table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS medical_images (
-                image_id INT AUTO_INCREMENT PRIMARY KEY,
-                patient_id VARCHAR(20),
-                doctor_id VARCHAR(20),
-                image_name VARCHAR(200) NOT NULL,
-                image_data LONGBLOB NOT NULL,
-                image_type VARCHAR(50),
-                description TEXT,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_id) REFERENCES patients(patient_id),
-                FOREIGN KEY (doctor_id) REFERENCES doctors(doctor_id)
-            )
-        ''')
-        
-        # Allergies table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS allergies (
-                allergy_id INT AUTO_INCREMENT PRIMARY KEY,
-                patient_id VARCHAR(20),
-                allergy_name VARCHAR(100) NOT NULL,
-                severity ENUM('Mild', 'Moderate', 'Severe'),
-                notes TEXT,
-                FOREIGN KEY (patient_id) REFERENCES patients(patient_id)
-            )
-        ''')
-        
-        conn.commit()
-    except mysql.connector.Error as err:
-        st.error(f"Error creating tables: {err}")
-    finally:
-        cursor.close()
-        conn.close()
+    ok, result = migrations.ensure_schema()
+    if not ok:
+        st.error(f"Error creating tables: {result}")
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -442,6 +329,8 @@ def update_health_streak(patient_id):
             cursor.execute('UPDATE patients SET health_streak = %s, last_login = %s WHERE patient_id = %s',
                          (new_streak, today, patient_id))
             conn.commit()
+            if new_streak != current_streak:
+                patient_data.invalidate(patient_id, sections=['basic_info'])
             return new_streak
         
         return 0
@@ -506,6 +395,7 @@ def register_doctor(doctor_data):
               doctor_data.get('hospital'), doctor_data.get('experience_years')))
         
         conn.commit()
+        directory.invalidate()
         return True, doctor_id
     except mysql.connector.Error as e:
         return False, str(e)
@@ -574,56 +464,19 @@ def login_doctor(email_or_id, password):
 
 # search fxn
 
-def search_doctors_advanced(search_term="", specialty_filter="", experience_filter="", location_filter=""):
-    conn = db.db_connection()
-    if not conn: 
-        return []
-    cursor = conn.cursor()
-    
+def search_doctors_advanced(search_term="", specialty_filter="", experience_filter="", location_filter="",
+                            hospital_filter="", sort_by="Experience (High to Low)", after=None, page_size=search.PAGE_SIZE):
+    """One page of the doctor directory (directory.DirectoryPage) with the facet counts for the filters"""
+    filters = {
+        'specialization': specialty_filter if specialty_filter != "All Specialties" else None,
+        'hospital': hospital_filter if hospital_filter != "All Hospitals" else None,
+        'experience': experience_filter if experience_filter != "Any Experience" else None,
+    }
     try:
-        # Build dynamic query based on filters
-        query = '''
-            SELECT doctor_id, first_name, last_name, email, phone, specialization, 
-                   hospital, experience_years, license_number, created_at
-            FROM doctors 
-            WHERE 1=1
-        '''
-        params = []
-        
-        if search_term:
-            query += ''' AND (doctor_id LIKE %s OR first_name LIKE %s OR last_name LIKE %s 
-                           OR email LIKE %s OR specialization LIKE %s OR hospital LIKE %s)'''
-            search_param = f'%{search_term}%'
-            params.extend([search_param] * 6)
-        
-        if specialty_filter and specialty_filter != "All Specialties":
-            query += ' AND specialization LIKE %s'
-            params.append(f'%{specialty_filter}%')
-        
-        if experience_filter and experience_filter != "Any Experience":
-            if experience_filter == "0-5 years":
-                query += ' AND experience_years BETWEEN 0 AND 5'
-            elif experience_filter == "5-10 years":
-                query += ' AND experience_years BETWEEN 5 AND 10'
-            elif experience_filter == "10-20 years":
-                query += ' AND experience_years BETWEEN 10 AND 20'
-            elif experience_filter == "20+ years":
-                query += ' AND experience_years >= 20'
-        
-        if location_filter:
-            query += ' AND hospital LIKE %s'
-            params.append(f'%{location_filter}%')
-        
-        query += ' ORDER BY experience_years DESC, first_name ASC'
-        
-        cursor.execute(query, params)
-        return cursor.fetchall()
+        return directory.get_directory().search(search_term, filters, location_filter, sort_by, after, page_size)
     except mysql.connector.Error as e:
         st.error(f"Error searching doctors: {e}")
-        return []
-    finally:
-        cursor.close()
-        conn.close()
+        return directory.DirectoryPage([])
 
 def search_patients(search_term):
     conn = db.db_connection()
@@ -632,11 +485,9 @@ def search_patients(search_term):
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-            SELECT patient_id, first_name, last_name, email, phone, blood_group
-            FROM patients 
-            WHERE patient_id LIKE %s OR first_name LIKE %s OR last_name LIKE %s OR email LIKE %s
-        ''', (f'%{search_term}%', f'%{search_term}%', f'%{search_term}%', f'%{search_term}%'))
+        query, params = search.patient_search_sql('p.patient_id, p.first_name, p.last_name, p.email, p.phone, p.blood_group',
+                                                  search_term)
+        cursor.execute(query, params)
         return cursor.fetchall()
     except mysql.connector.Error as e:
         st.error(f"Error searching patients: {e}")
@@ -645,31 +496,48 @@ def search_patients(search_term):
         cursor.close()
         conn.close()
 
-def add_medical_file(patient_id, doctor_id, file, category, description):
+def add_medical_files(patient_id, doctor_id, files, category, description, progress=None):
+    """Upload several files: streamed to the blob store in parallel, inserted in one transaction.
+    Returns [(file_name, success, error)] in upload order"""
+    store = blobstore.get_blob_store()
+    ingested = ingest.ingest_many(files, lambda file, report: ingest.ingest_upload(store, file, progress=report),
+                                  progress=progress)
+
+    results = [(file.name, False, error) for file, _, error in ingested]
+    stored = [(index, file, result) for index, (file, result, error) in enumerate(ingested) if not error]
+    if not stored:
+        return results
+
     conn = db.db_connection()
     if not conn: 
-        return False
+        # the stored blobs stay unreferenced, Modules/blob_gc.py deletes them
+        for index, file, _ in stored:
+            results[index] = (file.name, False, "Database connection failed")
+        return results
     cursor = conn.cursor()
     
     try:
-        file_data = file.read()
-        file_name = file.name
-        file_type = file.type
-        
-        cursor.execute('''
-            INSERT INTO medical_files (patient_id, doctor_id, file_name, file_data, file_type, category, description)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ''', (patient_id, doctor_id, file_name, file_data, file_type, category, description))
+        cursor.executemany('''
+            INSERT INTO medical_files (patient_id, doctor_id, file_name, blob_ref, file_type, category, description,
+                                       file_size, file_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ''', [(patient_id, doctor_id, file.name, blob_ref, file.type, category, description, file_size, blob_ref)
+              for _, file, (blob_ref, file_size) in stored])
         
         conn.commit()
-        return True
+        patient_data.invalidate(patient_id, sections=['medical_files'])
+        for index, file, _ in stored:
+            results[index] = (file.name, True, None)
     except mysql.connector.Error as e:
-        st.error(f"Error adding medical file: {e}")
-        return False
+        conn.rollback()
+        for index, file, _ in stored:
+            results[index] = (file.name, False, str(e))
     finally:
         cursor.close()
         conn.close()
+    return results
 
+# file listing, metadata only (size + sha256), use medical_file_data() for the content
 def patient_files(patient_id):
     conn = db.db_connection()
     if not conn: 
@@ -679,7 +547,7 @@ def patient_files(patient_id):
     try:
         cursor.execute('''
             SELECT f.file_id, f.file_name, f.file_type, f.category, f.description, f.upload_date,
-                   d.first_name, d.last_name, f.file_data
+                   d.first_name, d.last_name, f.file_size, f.file_hash
             FROM medical_files f
             LEFT JOIN doctors d ON f.doctor_id = d.doctor_id
             WHERE f.patient_id = %s ORDER BY f.upload_date DESC
@@ -692,6 +560,37 @@ def patient_files(patient_id):
         cursor.close()
         conn.close()
 
+def medical_file_data(file_id, patient_id):
+    """Fetch the content of one file, only called when it is downloaded"""
+    conn = db.db_connection()
+    if not conn: 
+        return None
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT file_data, blob_ref FROM medical_files WHERE file_id = %s AND patient_id = %s',
+                       (file_id, patient_id))
+        result = cursor.fetchone()
+        if not result:
+            return None
+        # rows not moved to the blob store yet still have the data inline
+        return blobstore.get_blob_store().get(result[1]) if result[1] else result[0]
+    except (mysql.connector.Error, OSError) as e:
+        st.error(f"Error fetching file: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def format_file_size(size):
+    if size is None:
+        return "Unknown"
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
 def add_medical_record(record_data):
     conn = db.db_connection()
     if not conn: 
@@ -711,6 +610,7 @@ def add_medical_record(record_data):
               record_data.get('heart_rate'), record_data.get('temperature')))
         
         conn.commit()
+        patient_data.invalidate(record_data['patient_id'], sections=['medical_records'])
         return True
     except mysql.connector.Error as e:
         st.error(f"Error adding medical record: {e}")
@@ -719,155 +619,193 @@ def add_medical_record(record_data):
         cursor.close()
         conn.close()
 
-def add_batch_medical_records(records_data, doctor_id):
-    """Add multiple medical records from template data"""
+def existing_patient_ids(patient_ids, chunk_size=1000):
+    """batch_import.patient_keys of the given patient IDs that exist, one IN query per chunk_size
+    distinct IDs. None on DB error"""
+    patient_ids = sorted({str(patient_id) for patient_id in patient_ids if patient_id})
+    if not patient_ids:
+        return set()
     conn = db.db_connection()
     if not conn: 
-        return False, "Database connection failed"
+        return None
     cursor = conn.cursor()
     
-    success_count = 0
-    failed_records = []
-    
     try:
-        for i, record_data in enumerate(records_data):
-            try:
-                cursor.execute('''
-                    INSERT INTO medical_records (patient_id, doctor_id, visit_date, diagnosis, treatment,
-                                               prescription, notes, glucose_level, blood_pressure_systolic,
-                                               blood_pressure_diastolic, heart_rate, temperature)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', (record_data.get('patient_id'), doctor_id, record_data.get('visit_date'),
-                      record_data.get('diagnosis'), record_data.get('treatment'), 
-                      record_data.get('prescription'), record_data.get('notes'), 
-                      record_data.get('glucose_level'), record_data.get('blood_pressure_systolic'), 
-                      record_data.get('blood_pressure_diastolic'), record_data.get('heart_rate'), 
-                      record_data.get('temperature')))
-                success_count += 1
-            except mysql.connector.Error as e:
-                failed_records.append(f"Row {i+1}: {str(e)}")
-                continue
-        
-        conn.commit()
-        return True, f"Successfully processed {success_count} records. Failed: {len(failed_records)}"
-        
-    except Exception as e:
-        conn.rollback()
-        return False, f"Batch processing failed: {str(e)}"
+        return batch_import.existing_patient_ids(cursor, patient_ids, chunk_size)
+    except mysql.connector.Error as e:
+        st.error(f"Error validating patient IDs: {e}")
+        return None
     finally:
         cursor.close()
         conn.close()
 
-def validate_patient_exists(patient_id):
-    """Check if patient exists in database"""
+def batch_existing_patient_ids(uploaded_file, records_data):
+    """existing_patient_ids of a batch template, looked up once per upload and kept for the
+    preview and processing reruns"""
+    cached = st.session_state.get('batch_patient_ids')
+    if cached and cached[0] == uploaded_file.file_id:
+        return cached[1]
+    existing = existing_patient_ids(record.get('patient_id') for record in records_data)
+    if existing is None:
+        return set()
+    st.session_state.batch_patient_ids = (uploaded_file.file_id, existing)
+    return existing
+
+def export_records_parquet(column, value):
+    """Parquet file (bytes) of the medical records of a patient (column='patient_id') or added by
+    a doctor (column='doctor_id'), None on error"""
     conn = db.db_connection()
     if not conn: 
-        return False
+        return None
     cursor = conn.cursor()
     
     try:
-        cursor.execute('SELECT COUNT(*) FROM patients WHERE patient_id = %s', (patient_id,))
-        result = cursor.fetchone()
-        return result[0] > 0
-    except mysql.connector.Error:
-        return False
+        return arrow_io.write_records_parquet(cursor, column, value)
+    except mysql.connector.Error as e:
+        st.error(f"Error exporting records: {e}")
+        return None
     finally:
         cursor.close()
         conn.close()
 
+def parquet_export_button(column, value, file_name, key):
+    """Builds the export on request (the query runs once, not on every rerun), then offers the download"""
+    if st.button("🧱 Export as Parquet", key=f"{key}_prepare", use_container_width=True):
+        st.session_state[key] = export_records_parquet(column, value)
+    if st.session_state.get(key):
+        st.download_button(
+            label="📥 Download Parquet",
+            data=st.session_state[key],
+            file_name=file_name,
+            mime="application/vnd.apache.parquet",
+            key=f"{key}_download",
+            use_container_width=True
+        )
+
+def prepared_download_button(prepare_label, download_label, fetch, key, **download_args):
+    """Two step download: fetch() runs only when prepare_label is clicked, its bytes are kept in
+    the session and offered with a download button (download_button needs the data itself).
+    Only the last prepared file is kept, preparing another one replaces it"""
+    if st.button(prepare_label, key=f"{key}_prepare"):
+        data = fetch()
+        st.session_state.prepared_download = (key, data) if data else None
+        if data:
+            st.rerun()  # buttons rendered above still show the file this one replaced
+    prepared = st.session_state.get('prepared_download')
+    if prepared and prepared[0] == key:
+        st.download_button(label=download_label, data=prepared[1], key=f"{key}_download", **download_args)
+
 def parse_template_file(uploaded_file):
-    """Parse uploaded template file (CSV/Excel) and return structured data"""
-    try:
-        if uploaded_file.type == "text/csv":
-            import pandas as pd
-            df = pd.read_csv(uploaded_file)
-        elif uploaded_file.type in ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]:
-            import pandas as pd
-            df = pd.read_excel(uploaded_file)
+    """Parse uploaded template file (CSV/Excel), returns (records or None, message, row_errors)"""
+    return templates.parse_template_file(uploaded_file)
+
+def show_streaming_import(uploaded_template):
+    """Preview and queue a large CSV template or a Parquet / Arrow file, the worker validates and
+    inserts it chunk by chunk"""
+    columnar = arrow_io.is_columnar(uploaded_template.name)
+    st.success(f"✅ File uploaded: {uploaded_template.name} ({uploaded_template.size / 1048576:,.1f} MB)")
+    st.info(f"📦 {'Parquet / Arrow' if columnar else 'Large'} file: it is imported in streaming mode. "
+            f"The preview below only covers the first {templates.PREVIEW_SAMPLE_ROWS} rows, the whole "
+            "file is validated while it is imported and problems are listed on the import job.")
+
+    st.markdown("#### Step 3: Preview")
+    if columnar:
+        records_data, message, row_errors = arrow_io.preview(uploaded_template)
+    else:
+        records_data, message, row_errors = templates.preview_template(uploaded_template)
+    if records_data is None:
+        st.error(f"❌ {message}")
+        return
+    st.success(message)
+    st.dataframe(pd.DataFrame(records_data[:10]), use_container_width=True)
+    if row_errors:
+        with st.expander(f"⚠️ Problems in the sample: {len(row_errors)} issues"):
+            st.dataframe(pd.DataFrame(row_errors), use_container_width=True, hide_index=True)
+
+    st.markdown("#### Step 4: Process Records")
+    st.caption("Rows with unknown patients or without a valid visit date are skipped and reported.")
+    if not st.checkbox("✅ I confirm importing all records of this file", key="confirm_stream_upload"):
+        return
+    if st.button("🚀 Queue Streaming Import", use_container_width=True, type="primary"):
+        copy_progress = st.progress(0.0, text="Storing file...")
+        try:
+            job_id = jobs.enqueue_template_import(
+                uploaded_template,
+                st.session_state.user['id'],
+                progress=lambda done, total: copy_progress.progress(
+                    min(done / total, 1.0) if total else 0.0, text=f"Stored {done / 1048576:,.0f} MB")
+            )
+        except ingest.UploadTooLarge as e:
+            st.error(f"❌ {str(e)}")
+        except Exception as e:
+            st.error(f"❌ Error queueing import: {str(e)}")
         else:
-            return None, "Unsupported file format. Please upload CSV or Excel files."
-        
-        # Clean column names (remove whitespace, standardize)
-        df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
-        
-        # Required columns mapping
-        required_columns = {
-            'patient_id': ['patient_id', 'patientid', 'id'],
-            'visit_date': ['visit_date', 'date', 'visit_date'],
-            'diagnosis': ['diagnosis', 'condition', 'primary_diagnosis'],
-            'treatment': ['treatment', 'treatment_plan', 'therapy'],
-            'prescription': ['prescription', 'medications', 'drugs'],
-            'notes': ['notes', 'comments', 'observations']
-        }
-        
-        # Optional vital signs columns
-        optional_columns = {
-            'glucose_level': ['glucose', 'glucose_level', 'blood_glucose'],
-            'blood_pressure_systolic': ['systolic', 'bp_systolic', 'blood_pressure_systolic'],
-            'blood_pressure_diastolic': ['diastolic', 'bp_diastolic', 'blood_pressure_diastolic'],
-            'heart_rate': ['heart_rate', 'pulse', 'hr'],
-            'temperature': ['temperature', 'temp', 'body_temp']
-        }
-        
-        # Map columns to standard names
-        column_mapping = {}
-        for standard_name, possible_names in {**required_columns, **optional_columns}.items():
-            for possible_name in possible_names:
-                if possible_name in df.columns:
-                    column_mapping[possible_name] = standard_name
-                    break
-        
-        # Check for required columns
-        missing_required = []
-        for required in ['patient_id', 'visit_date']:
-            if not any(col in df.columns for col in required_columns[required]):
-                missing_required.append(required)
-        
-        if missing_required:
-            return None, f"Missing required columns: {', '.join(missing_required)}"
-        
-        # Rename columns according to mapping
-        df_renamed = df.rename(columns=column_mapping)
-        
-        # Convert to list of dictionaries
-        records_data = []
-        for _, row in df_renamed.iterrows():
-            # Skip empty rows
-            if pd.isna(row.get('patient_id')) or pd.isna(row.get('visit_date')):
-                continue
-                
-            record = {}
-            for col in ['patient_id', 'visit_date', 'diagnosis', 'treatment', 'prescription', 'notes',
-                       'glucose_level', 'blood_pressure_systolic', 'blood_pressure_diastolic', 
-                       'heart_rate', 'temperature']:
-                if col in df_renamed.columns:
-                    value = row[col]
-                    if col == 'visit_date':
-                        try:
-                            if pd.notna(value):
-                                # Handle different date formats
-                                record[col] = pd.to_datetime(value).date()
-                            else:
-                                record[col] = date.today()
-                        except:
-                            record[col] = date.today()
-                    elif col in ['glucose_level', 'blood_pressure_systolic', 'blood_pressure_diastolic', 
-                                'heart_rate', 'temperature']:
-                        try:
-                            record[col] = float(value) if pd.notna(value) and value != '' else None
-                        except:
-                            record[col] = None
-                    else:
-                        record[col] = str(value).strip() if pd.notna(value) and value != '' else None
-                else:
-                    record[col] = None
-            
-            records_data.append(record)
-        
-        return records_data, f"Successfully parsed {len(records_data)} records from template"
-        
+            st.session_state.success_message = (
+                f"🎉 Queued streaming import {job_id}, follow its progress under Import Jobs")
+            st.rerun()
+
+JOB_STATUS_ICONS = {'queued': "⏳", 'running': "🔄", 'done': "✅", 'failed': "❌"}
+
+def load_import_jobs(doctor_id):
+    try:
+        return jobs.recent_jobs(doctor_id)
     except Exception as e:
-        return None, f"Error parsing file: {str(e)}"
+        st.error(f"Error loading import jobs: {str(e)}")
+        return None
+
+def import_jobs_active(recent):
+    return any(job['status'] in ('queued', 'running') for job in recent or [])
+
+def show_import_jobs(doctor_id):
+    """Recent batch import jobs of the doctor, refreshed in place while one is queued or running"""
+    recent = load_import_jobs(doctor_id)
+    if import_jobs_active(recent):
+        live_import_jobs(doctor_id)
+    else:
+        render_import_jobs(recent)
+
+@st.fragment(run_every=jobs.poll_seconds())
+def live_import_jobs(doctor_id):
+    recent = load_import_jobs(doctor_id)
+    render_import_jobs(recent)
+    if recent is not None and not import_jobs_active(recent):
+        st.rerun()  # all finished: redraw the page without the polling fragment
+
+def render_import_jobs(recent):
+    st.markdown("#### 🗂️ Import Jobs")
+    if recent is None:
+        return
+    if not recent:
+        st.info("No import jobs yet")
+        return
+
+    # the worker runs in its own process, cached patient data here doesn't know about its inserts
+    seen = st.session_state.setdefault('finished_import_jobs', set())
+    for job in recent:
+        if job['status'] in ('done', 'failed') and job['job_id'] not in seen:
+            seen.add(job['job_id'])
+            if job['inserted']:
+                patient_data.invalidate_all()
+
+    if any(job['status'] == 'queued' for job in recent):
+        st.caption("Queued jobs are picked up by the import worker (`python -m Modules.jobs`).")
+
+    for job in recent:
+        icon = JOB_STATUS_ICONS.get(job['status'], "")
+        with st.container(border=True):
+            st.markdown(f"**{icon} {job['job_id']}** · {job['source_name'] or job['kind']} · "
+                        f"{job['status'].title()} · queued {job['created_at']}")
+            total = job['total_rows'] or 0
+            st.progress(job['rows_done'] / total if total else 1.0,
+                        text=f"{job['rows_done']} of {total} rows · {job['inserted']} inserted · {job['failed']} failed")
+            if job['message']:
+                st.caption(job['message'])
+            if job['errors']:
+                with st.expander(f"⚠️ Row errors ({job['failed']})"):
+                    st.dataframe(pd.DataFrame(job['errors'], columns=['Row', 'Error']), hide_index=True,
+                                 use_container_width=True)
+                    if job['failed'] > len(job['errors']):
+                        st.caption(f"Showing the first {len(job['errors'])} errors")
 
 def generate_template_csv():
     """Generate a sample CSV template for download"""
@@ -933,30 +871,49 @@ def vital_trends(patient_id):
         conn.close()
 
 
-def add_medical_image(patient_id, doctor_id, image_file, image_type, description):
+def add_medical_images(patient_id, doctor_id, images, image_type, description, progress=None):
+    """Upload several images: stored and thumbnailed in parallel, inserted in one transaction.
+    Returns [(image_name, success, error)] in upload order"""
+    store = blobstore.get_blob_store()
+    ingested = ingest.ingest_many(images, lambda image, report: ingest.ingest_image(store, image, progress=report),
+                                  progress=progress)
+
+    results = [(image.name, False, error) for image, _, error in ingested]
+    stored = [(index, image, result) for index, (image, result, error) in enumerate(ingested) if not error]
+    if not stored:
+        return results
+
     conn = db.db_connection()
     if not conn: 
-        return False
+        # the stored blobs stay unreferenced, Modules/blob_gc.py deletes them
+        for index, image, _ in stored:
+            results[index] = (image.name, False, "Database connection failed")
+        return results
     cursor = conn.cursor()
     
     try:
-        image_data = image_file.read()
-        image_name = image_file.name
-        
-        cursor.execute('''
-            INSERT INTO medical_images (patient_id, doctor_id, image_name, image_data, image_type, description)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        ''', (patient_id, doctor_id, image_name, image_data, image_type, description))
+        cursor.executemany('''
+            INSERT INTO medical_images (patient_id, doctor_id, image_name, blob_ref, image_type, description,
+                                        image_size, image_hash, thumbnail_data, thumbnail_type)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ''', [(patient_id, doctor_id, image.name, blob_ref, image_type, description,
+               image_size, blob_ref, thumbnail_data, thumbnail_type)
+              for _, image, (blob_ref, image_size, thumbnail_data, thumbnail_type) in stored])
         
         conn.commit()
-        return True
+        patient_data.invalidate(patient_id, sections=['medical_images'])
+        for index, image, _ in stored:
+            results[index] = (image.name, True, None)
     except mysql.connector.Error as e:
-        st.error(f"Error adding medical image: {e}")
-        return False
+        conn.rollback()
+        for index, image, _ in stored:
+            results[index] = (image.name, False, str(e))
     finally:
         cursor.close()
         conn.close()
+    return results
 
+# image listing with thumbnails only, full image comes from medical_image_data()
 def patient_images(patient_id):
     conn = db.db_connection()
     if not conn: 
@@ -965,7 +922,8 @@ def patient_images(patient_id):
     
     try:
         cursor.execute('''
-            SELECT image_id, image_name, image_data, image_type, description, upload_date
+            SELECT image_id, image_name, thumbnail_data, image_type, description, upload_date,
+                   image_size, thumbnail_type
             FROM medical_images WHERE patient_id = %s ORDER BY upload_date DESC
         ''', (patient_id,))
         return cursor.fetchall()
@@ -976,6 +934,54 @@ def patient_images(patient_id):
         cursor.close()
         conn.close()
 
+def medical_image_data(image_id, patient_id):
+    """Fetch the full resolution image, only when it is opened or downloaded"""
+    conn = db.db_connection()
+    if not conn: 
+        return None
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('SELECT image_data, blob_ref FROM medical_images WHERE image_id = %s AND patient_id = %s',
+                       (image_id, patient_id))
+        result = cursor.fetchone()
+        if not result:
+            return None
+        return blobstore.get_blob_store().get(result[1]) if result[1] else result[0]
+    except (mysql.connector.Error, OSError) as e:
+        st.error(f"Error fetching image: {e}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+# images uploaded before thumbnails existed get one on first view
+def backfill_image_thumbnail(image_id, patient_id):
+    image_data = medical_image_data(image_id, patient_id)
+    if not image_data:
+        return None, None
+    thumbnail_data, thumbnail_type = thumbnails.make_thumbnail(image_data)
+    if not thumbnail_data:
+        return None, None
+
+    conn = db.db_connection()
+    if not conn: 
+        return thumbnail_data, thumbnail_type
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            UPDATE medical_images SET thumbnail_data = %s, thumbnail_type = %s
+            WHERE image_id = %s AND thumbnail_data IS NULL
+        ''', (thumbnail_data, thumbnail_type, image_id))
+        conn.commit()
+    except mysql.connector.Error as e:
+        st.error(f"Error saving image thumbnail: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+    return thumbnail_data, thumbnail_type
+
 def add_allergy(patient_id, allergy_name, severity, notes):
     conn = db.db_connection()
     if not conn: 
@@ -989,6 +995,7 @@ def add_allergy(patient_id, allergy_name, severity, notes):
         ''', (patient_id, allergy_name, severity, notes))
         
         conn.commit()
+        patient_data.invalidate(patient_id, sections=['allergies'])
         return True
     except mysql.connector.Error as e:
         st.error(f"Error adding allergy: {e}")
@@ -1156,116 +1163,19 @@ def show_emergency_page(qr_token):
         st.markdown('<div class="patient-card"><p>No recent medical records available.</p></div>', unsafe_allow_html=True)
 
 def get_comprehensive_patient_data(patient_id):
+    """PatientAggregate with info, records, allergies, files and images, cached per patient
+    (after a write only the changed sections are reloaded)"""
+    return patient_data.get_aggregate(patient_id, lambda sections: fetch_patient_sections(patient_id, sections))
+
+def fetch_patient_sections(patient_id, sections):
+    """{section: rows} of the given patient_data sections in one DB round trip, None on error"""
     conn = db.db_connection()
     if not conn:
         return None
     cursor = conn.cursor()
     
     try:
-        # Get patient basic info
-        cursor.execute('''
-            SELECT patient_id, first_name, last_name, email, phone, date_of_birth, 
-                   gender, blood_group, address, emergency_contact, emergency_phone,
-                   insurance_provider, insurance_number, height_cm, weight_kg, health_streak
-            FROM patients WHERE patient_id = %s
-        ''', (patient_id,))
-        
-        patient_basic = cursor.fetchone()
-        if not patient_basic:
-            return None
-        
-        # Calculate age and BMI
-        age = None
-        bmi = None
-        if patient_basic[5]:  # date_of_birth
-            age = (date.today() - patient_basic[5]).days // 365
-        
-        if patient_basic[13] and patient_basic[14]:  # height_cm and weight_kg
-            try:
-                height_cm = float(patient_basic[13])
-                weight_kg = float(patient_basic[14])
-                if height_cm > 0:
-                    height_m = height_cm / 100.0
-                    bmi = round(weight_kg / (height_m * height_m), 1)
-                else:
-                    bmi = None
-            except (TypeError, ValueError, ZeroDivisionError):
-                bmi = None
-
-        
-        # Get medical records with doctor info
-        cursor.execute('''
-            SELECT mr.record_id, mr.visit_date, mr.diagnosis, mr.treatment, mr.prescription,
-                   mr.notes, mr.glucose_level, mr.blood_pressure_systolic, mr.blood_pressure_diastolic,
-                   mr.heart_rate, mr.temperature, mr.created_at,
-                   d.first_name, d.last_name, d.specialization
-            FROM medical_records mr
-            LEFT JOIN doctors d ON mr.doctor_id = d.doctor_id
-            WHERE mr.patient_id = %s
-            ORDER BY mr.visit_date DESC
-        ''', (patient_id,))
-        medical_records = cursor.fetchall()
-        
-        # Get allergies
-        cursor.execute('SELECT allergy_name, severity, notes FROM allergies WHERE patient_id = %s', (patient_id,))
-        allergies = cursor.fetchall()
-        
-        # Get medical files
-        cursor.execute('''
-            SELECT file_name, file_type, category, description, upload_date,
-                   d.first_name, d.last_name
-            FROM medical_files mf
-            LEFT JOIN doctors d ON mf.doctor_id = d.doctor_id
-            WHERE mf.patient_id = %s
-            ORDER BY mf.upload_date DESC
-        ''', (patient_id,))
-        medical_files = cursor.fetchall()
-        
-        # Get medical images
-        cursor.execute('''
-            SELECT image_name, image_type, description, upload_date
-            FROM medical_images
-            WHERE patient_id = %s
-            ORDER BY upload_date DESC
-        ''', (patient_id,))
-        medical_images = cursor.fetchall()
-        
-        # Get recent vital trends
-        cursor.execute('''
-            SELECT visit_date, glucose_level, blood_pressure_systolic, blood_pressure_diastolic,
-                   heart_rate, temperature
-            FROM medical_records
-            WHERE patient_id = %s AND visit_date >= %s
-            ORDER BY visit_date ASC
-        ''', (patient_id, date.today() - timedelta(days=180)))
-        vital_trends = cursor.fetchall()
-        
-        return {
-            'basic_info': {
-                'patient_id': patient_basic[0],
-                'name': f"{patient_basic[1]} {patient_basic[2]}",
-                'email': patient_basic[3],
-                'phone': patient_basic[4],
-                'age': age,
-                'gender': patient_basic[6],
-                'blood_group': patient_basic[7],
-                'address': patient_basic[8],
-                'emergency_contact': patient_basic[9],
-                'emergency_phone': patient_basic[10],
-                'insurance_provider': patient_basic[11],
-                'insurance_number': patient_basic[12],
-                'height_cm': patient_basic[13],
-                'weight_kg': patient_basic[14],
-                'bmi': bmi,
-                'health_streak': patient_basic[15]
-            },
-            'medical_records': medical_records,
-            'allergies': allergies,
-            'medical_files': medical_files,
-            'medical_images': medical_images,
-            'vital_trends': vital_trends
-        }
-    
+        return patient_data.fetch_sections(cursor, patient_id, sections)
     except mysql.connector.Error as e:
         st.error(f"Error fetching patient data: {e}")
         return None
@@ -1285,13 +1195,13 @@ def show_detailed_patient_history(patient_id):
         st.rerun()
     
     # Get comprehensive patient data
-    patient_data = get_comprehensive_patient_data(patient_id)
+    patient = get_comprehensive_patient_data(patient_id)
     
-    if not patient_data:
+    if not patient:
         st.error("Patient data not found")
         return
     
-    basic_info = patient_data['basic_info']
+    basic_info = patient.basic_info
     
     st.markdown(f"## 📋 Complete Medical History - {basic_info['name']}")
     
@@ -1326,10 +1236,10 @@ def show_detailed_patient_history(patient_id):
         st.markdown(f"""
         <div class="metric-card">
             <h4>🏥 Medical Summary</h4>
-            <p><strong>Total Records:</strong> {len(patient_data['medical_records'])}</p>
-            <p><strong>Known Allergies:</strong> {len(patient_data['allergies'])}</p>
-            <p><strong>Medical Files:</strong> {len(patient_data['medical_files'])}</p>
-            <p><strong>Medical Images:</strong> {len(patient_data['medical_images'])}</p>
+            <p><strong>Total Records:</strong> {len(patient.medical_records)}</p>
+            <p><strong>Known Allergies:</strong> {len(patient.allergies)}</p>
+            <p><strong>Medical Files:</strong> {len(patient.medical_files)}</p>
+            <p><strong>Medical Images:</strong> {len(patient.medical_images)}</p>
             <p><strong>Insurance:</strong> {insurance_status}</p>
         </div>
         """, unsafe_allow_html=True)
@@ -1340,8 +1250,8 @@ def show_detailed_patient_history(patient_id):
     with tab1:
         st.markdown("### Medical Records History")
         
-        if patient_data['medical_records']:
-            for record in patient_data['medical_records']:
+        if patient.medical_records:
+            for record in patient.medical_records:
                 doctor_name = f"Dr. {record[12]} {record[13]}" if record[12] and record[13] else "Unknown Doctor"
                 specialization = f" ({record[14]})" if record[14] else ""
                 
@@ -1380,8 +1290,8 @@ def show_detailed_patient_history(patient_id):
     with tab2:
         st.markdown("### Known Allergies")
         
-        if patient_data['allergies']:
-            for allergy in patient_data['allergies']:
+        if patient.allergies:
+            for allergy in patient.allergies:
                 severity_colors = {"Mild": "#ffa500", "Moderate": "#ff6b6b", "Severe": "#d32f2f"}
                 severity_color = severity_colors.get(allergy[1], "#666666")
                 
@@ -1399,9 +1309,9 @@ def show_detailed_patient_history(patient_id):
     with tab3:
         st.markdown("### Vital Signs Trends (Last 6 Months)")
         
-        if patient_data['vital_trends']:
+        if patient.vital_trends:
             import pandas as pd
-            df_vitals = pd.DataFrame(patient_data['vital_trends'], 
+            df_vitals = pd.DataFrame(patient.vital_trends, 
                                    columns=['Date', 'Glucose', 'Systolic', 'Diastolic', 'Heart Rate', 'Temperature'])
             df_vitals['Date'] = pd.to_datetime(df_vitals['Date'])
             
@@ -1453,8 +1363,8 @@ def show_detailed_patient_history(patient_id):
         
         with col_files:
             st.markdown("#### 📁 Medical Files")
-            if patient_data['medical_files']:
-                for file in patient_data['medical_files']:
+            if patient.medical_files:
+                for file in patient.medical_files:
                     uploaded_by = f"Dr. {file[5]} {file[6]}" if file[5] and file[6] else "System"
                     st.markdown(f"""
                     **📄 {file[0]}**
@@ -1467,8 +1377,8 @@ def show_detailed_patient_history(patient_id):
         
         with col_images:
             st.markdown("#### 🖼️ Medical Images")
-            if patient_data['medical_images']:
-                for image in patient_data['medical_images']:
+            if patient.medical_images:
+                for image in patient.medical_images:
                     st.markdown(f"""
                     **🖼️ {image[0]}**
                     - Type: {image[1]}
@@ -1513,43 +1423,97 @@ def show_detailed_patient_history(patient_id):
             if basic_info['health_streak']:
                 st.markdown(f"**Health Streak:** {basic_info['health_streak']} days 🔥")
 
-def search_patients_advanced_doctor(search_term="", blood_group_filter="All"):
+def search_patients_advanced_doctor(search_term="", blood_group_filter="All", after=None, page_size=search.PAGE_SIZE,
+                                    with_total=False):
+    """One page (search.SearchPage) of matching patients by name, pass page.next_after as after= for the next one"""
     conn = db.db_connection()
     if not conn: 
-        return []
+        return search.SearchPage([])
     cursor = conn.cursor()
     
     try:
-        query = '''
-            SELECT patient_id, first_name, last_name, email, phone, blood_group, date_of_birth
-            FROM patients 
-            WHERE 1=1
-        '''
-        params = []
+        # indexed search (Modules/search.py) instead of LIKE '%term%' table scans
+        query, params = search.doctor_patient_search_sql(
+            search_term, blood_group_filter if blood_group_filter != "All" else None)
         
-        if search_term:
-            query += ''' AND (patient_id LIKE %s OR first_name LIKE %s OR last_name LIKE %s 
-                           OR email LIKE %s OR phone LIKE %s)'''
-            search_param = f'%{search_term}%'
-            params.extend([search_param] * 5)
-        
-        if blood_group_filter != "All":
-            query += ' AND blood_group = %s'
-            params.append(blood_group_filter)
-        
-        query += ' ORDER BY first_name ASC, last_name ASC'
-        
-        cursor.execute(query, params)
-        return cursor.fetchall()
+        return search.fetch_page(cursor, query, params, search.PATIENT_ORDER, after, page_size, with_total)
     except mysql.connector.Error as e:
         st.error(f"Error searching patients: {e}")
-        return []
+        return search.SearchPage([])
     finally:
         cursor.close()
         conn.close()
 
 
 
+EMPTY_PATIENT_SUMMARY = {'record_count': 0, 'last_visit': None, 'allergy_count': 0, 'file_count': 0, 'image_count': 0}
+
+def patient_summaries(patient_ids):
+    """Record count, last visit, allergy/file/image counts for many patients in one query"""
+    patient_ids = list(dict.fromkeys(patient_ids))
+    if not patient_ids:
+        return {}
+    conn = db.db_connection()
+    if not conn: 
+        return {}
+    cursor = conn.cursor()
+    
+    try:
+        in_list = ', '.join(['%s'] * len(patient_ids))
+        cursor.execute(f'''
+            SELECT p.patient_id,
+                   COALESCE(r.record_count, 0), r.last_visit,
+                   COALESCE(a.allergy_count, 0), COALESCE(f.file_count, 0), COALESCE(i.image_count, 0)
+            FROM patients p
+            LEFT JOIN (SELECT patient_id, COUNT(*) AS record_count, MAX(visit_date) AS last_visit
+                       FROM medical_records WHERE patient_id IN ({in_list}) GROUP BY patient_id) r
+                   ON r.patient_id = p.patient_id
+            LEFT JOIN (SELECT patient_id, COUNT(*) AS allergy_count
+                       FROM allergies WHERE patient_id IN ({in_list}) GROUP BY patient_id) a
+                   ON a.patient_id = p.patient_id
+            LEFT JOIN (SELECT patient_id, COUNT(*) AS file_count
+                       FROM medical_files WHERE patient_id IN ({in_list}) GROUP BY patient_id) f
+                   ON f.patient_id = p.patient_id
+            LEFT JOIN (SELECT patient_id, COUNT(*) AS image_count
+                       FROM medical_images WHERE patient_id IN ({in_list}) GROUP BY patient_id) i
+                   ON i.patient_id = p.patient_id
+            WHERE p.patient_id IN ({in_list})
+        ''', patient_ids * 5)
+        return {
+            row[0]: {'record_count': row[1], 'last_visit': row[2], 'allergy_count': row[3],
+                     'file_count': row[4], 'image_count': row[5]}
+            for row in cursor.fetchall()
+        }
+    except mysql.connector.Error as e:
+        st.error(f"Error fetching patient summaries: {e}")
+        return {}
+    finally:
+        cursor.close()
+        conn.close()
+
+# "load more" search results, fetch(after, with_total) returns a search.SearchPage
+def paged_search(state_key, search_key, fetch):
+    """Results loaded so far for search_key, restarts from the first page when the search changes"""
+    results = st.session_state.get(state_key)
+    if results is None or results['key'] != search_key:
+        page = fetch(None, True)
+        results = {'key': search_key, 'rows': page.rows, 'next_after': page.next_after,
+                   'total': page.total, 'total_capped': page.total_capped, 'facets': getattr(page, 'facets', None)}
+        st.session_state[state_key] = results
+    return results
+
+def load_more_button(state_key, fetch, label="⬇️ Load more"):
+    results = st.session_state[state_key]
+    if results['next_after'] and st.button(label, key=f"{state_key}_load_more", use_container_width=True):
+        page = fetch(results['next_after'], False)
+        results['rows'] += page.rows
+        results['next_after'] = page.next_after
+        st.rerun()
+
+def results_count_text(results):
+    total = f"{results['total']}+" if results['total_capped'] else str(results['total'])
+    return total if len(results['rows']) == results['total'] else f"{total} (showing {len(results['rows'])})"
+
 def show_auth_page():
     pycss.load_css()
     
@@ -1803,287 +1767,94 @@ def show_auth_page():
 
 # ai data feeding 
 def get_patient_context_for_ai(patient_id):
-    """Gather comprehensive patient data for AI context"""
-    context = {
-        'patient_basic_info': {},
-        'recent_records': [],
-        'vital_trends': [],
-        'allergies': [],
-        'files_summary': [],
-        'images_summary': [],
-        'health_patterns': {}
-    }
-    
-    conn = db.db_connection()
-    if not conn:
-        return context
-    
-    cursor = conn.cursor()
-    
-    try:
-        # basic patient info
-        cursor.execute('''
-            SELECT first_name, last_name, date_of_birth, gender, blood_group, 
-                   height_cm, weight_kg, health_streak, phone, address,
-                   emergency_contact, emergency_phone, insurance_provider
-            FROM patients WHERE patient_id = %s
-        ''', (patient_id,))
-        
-        basic_info = cursor.fetchone()
-        if basic_info:
-            age = (date.today() - basic_info[2]).days // 365 if basic_info[2] else None
-            bmi = None
-            if basic_info[5] and basic_info[6]:
-                try:
-                    height_cm = float(basic_info[5])
-                    weight_kg = float(basic_info[6])
-                    height_m = height_cm / 100.0
-                    bmi = None
-                    if height_m > 0:
-                        bmi = weight_kg / (height_m * height_m)
-                except (TypeError, ValueError):
-                    bmi = None
-
-            
-            context['patient_basic_info'] = {
-                'name': f"{basic_info[0]} {basic_info[1]}",
-                'age': age,
-                'gender': basic_info[3],
-                'blood_group': basic_info[4],
-                'height_cm': basic_info[5],
-                'weight_kg': basic_info[6],
-                'bmi': round(bmi, 1) if bmi else None,
-                'health_streak': basic_info[7],
-                'phone': basic_info[8],
-                'emergency_contact': basic_info[10],
-                'emergency_phone': basic_info[11],
-                'has_insurance': bool(basic_info[12])
-            }
-        
-        # Comprehensive medical records (last 12 months)
-        cursor.execute('''
-            SELECT mr.visit_date, mr.diagnosis, mr.treatment, mr.prescription, 
-                   mr.glucose_level, mr.blood_pressure_systolic, mr.blood_pressure_diastolic, 
-                   mr.heart_rate, mr.temperature, mr.notes,
-                   d.first_name, d.last_name, d.specialization
-            FROM medical_records mr
-            LEFT JOIN doctors d ON mr.doctor_id = d.doctor_id
-            WHERE mr.patient_id = %s AND mr.visit_date >= %s
-            ORDER BY mr.visit_date DESC LIMIT 20
-        ''', (patient_id, date.today() - timedelta(days=365)))
-        
-        records = cursor.fetchall()
-        for record in records:
-            context['recent_records'].append({
-                'date': record[0].strftime('%Y-%m-%d'),
-                'diagnosis': record[1],
-                'treatment': record[2],
-                'prescription': record[3],
-                'notes': record[9],
-                'doctor': f"Dr. {record[10]} {record[11]}" if record[10] else "Unknown",
-                'specialization': record[12],
-                'vitals': {
-                    'glucose': record[4],
-                    'bp_systolic': record[5],
-                    'bp_diastolic': record[6],
-                    'heart_rate': record[7],
-                    'temperature': record[8]
-                }
-            })
-        
-        # All allergies with details
-        cursor.execute('''
-            SELECT allergy_name, severity, notes FROM allergies WHERE patient_id = %s
-        ''', (patient_id,))
-        
-        allergies = cursor.fetchall()
-        for allergy in allergies:
-            context['allergies'].append({
-                'name': allergy[0],
-                'severity': allergy[1],
-                'notes': allergy[2]
-            })
-        
-        # Medical files summary
-        cursor.execute('''
-            SELECT file_name, category, description, upload_date
-            FROM medical_files WHERE patient_id = %s
-            ORDER BY upload_date DESC LIMIT 10
-        ''', (patient_id,))
-        
-        files = cursor.fetchall()
-        for file in files:
-            context['files_summary'].append({
-                'name': file[0],
-                'category': file[1],
-                'description': file[2],
-                'date': file[3].strftime('%Y-%m-%d')
-            })
-        
-        # Medical images summary
-        cursor.execute('''
-            SELECT image_name, image_type, description, upload_date
-            FROM medical_images WHERE patient_id = %s
-            ORDER BY upload_date DESC LIMIT 10
-        ''', (patient_id,))
-        
-        images = cursor.fetchall()
-        for image in images:
-            context['images_summary'].append({
-                'name': image[0],
-                'type': image[1],
-                'description': image[2],
-                'date': image[3].strftime('%Y-%m-%d')
-            })
-        
-        # Vital trends analysis (last 6 months)...
-        cursor.execute('''
-            SELECT visit_date, glucose_level, blood_pressure_systolic, 
-                   blood_pressure_diastolic, heart_rate, temperature
-            FROM medical_records 
-            WHERE patient_id = %s AND visit_date >= %s
-            ORDER BY visit_date ASC
-        ''', (patient_id, date.today() - timedelta(days=180)))
-        
-        vitals = cursor.fetchall()
-        for vital in vitals:
-            context['vital_trends'].append({
-                'date': vital[0].strftime('%Y-%m-%d'),
-                'glucose': vital[1],
-                'bp_systolic': vital[2],
-                'bp_diastolic': vital[3],
-                'heart_rate': vital[4],
-                'temperature': vital[5]
-            })
-        
-        # Health patterns analysis
-        if vitals:
-            glucose_values = [v[1] for v in vitals if v[1] is not None]
-            bp_sys_values = [v[2] for v in vitals if v[2] is not None]
-            heart_rate_values = [v[4] for v in vitals if v[4] is not None]
-            
-            context['health_patterns'] = {
-                'glucose_avg': round(sum(glucose_values)/len(glucose_values), 1) if glucose_values else None,
-                'glucose_trend': 'stable',  # Could add trend analysis
-                'bp_avg': round(sum(bp_sys_values)/len(bp_sys_values), 0) if bp_sys_values else None,
-                'heart_rate_avg': round(sum(heart_rate_values)/len(heart_rate_values), 0) if heart_rate_values else None,
-                'total_visits': len(records),
-                'recent_diagnoses': list(set([r[1] for r in records[:5] if r[1]])),
-                'frequent_medications': []  # Could analyze prescription patterns
-            }
-        
-    except mysql.connector.Error as e:
-        print(f"Error getting patient context: {e}")
-    finally:
-        cursor.close()
-        conn.close()
-    
-    return context
+    """Gather comprehensive patient data for AI context (memoized per patient and data version)"""
+    return ai_context.patient_context(get_comprehensive_patient_data(patient_id))
 
-def generate_ai_response(user_message, patient_context=None):
+def note_prompt_report(assistant, report):
+    """Keep the size of a prompt for the chat page to show"""
+    st.session_state[f'{assistant}_prompt_report'] = report
+
+def generate_ai_response(user_message, patient_context=None, patient_id=None):
     """Generate AI response using Gemini with comprehensive medical analysis"""
+    return ''.join(stream_ai_response(user_message, patient_context, patient_id))
+
+def stream_ai_response(user_message, patient_context=None, patient_id=None):
+    """generate_ai_response as a stream: yields the cleaned answer in pieces as the model produces it"""
     if not AI_AVAILABLE:
-        return "AI assistant is currently unavailable. Please check your API configuration."
+        yield "AI assistant is currently unavailable. Please check your API configuration."
+        return
     
     try:
-        # Create comprehensive system prompt
-        system_prompt = """You are an advanced AI medical assistant for an E-Medical Record System with access to comprehensive patient data.
-        IMPORTANT GUIDELINES:
-        1. You are NOT a replacement for professional medical advice - always remind users to consult healthcare providers
-        2. Provide detailed analysis of the patient's medical data when relevant
-        3. Identify patterns, trends, and potential concerns in their health data
-        4. Be empathetic, supportive, and use clear, understandable language
-        5. For serious symptoms or concerning patterns, recommend immediate medical attention
-        6. Respond in plain text without HTML formatting
-        7. When analyzing data, be specific about what the numbers mean and their normal ranges
-        8. Explain medical terms in simple language
-        9. Use local language (example Hindi) when user asks
-
-        """
-        # Add comprehensive patient context if available
-        if patient_context and any(patient_context.values()):
-            context_text = "\nCOMPREHENSIVE PATIENT DATA:\n"
-            
-            # Basic info
-            basic_info = patient_context.get('patient_basic_info', {})
-            if basic_info:
-                context_text += f"""
-                    PATIENT PROFILE:
-                    - Name: {basic_info.get('name', 'Unknown')}
-                    - Age: {basic_info.get('age', 'Unknown')} years
-                    - Gender: {basic_info.get('gender', 'Unknown')}
-                    - Blood Group: {basic_info.get('blood_group', 'Unknown')}
-                    - BMI: {basic_info.get('bmi', 'Not calculated')}
-                    - Health Streak: {basic_info.get('health_streak', 0)} days
-                    - Has Insurance: {'Yes' if basic_info.get('has_insurance') else 'No'}
-
-                    """
-            
-            # Recent medical records
-            recent_records = patient_context.get('recent_records', [])
-            if recent_records:
-                context_text += f"RECENT MEDICAL HISTORY ({len(recent_records)} visits):\n"
-                for i, record in enumerate(recent_records[:5]):  # Show last 5 visits
-                    context_text += f"""
-                        Visit {i+1} ({record['date']}):
-                        - Doctor: {record['doctor']} ({record['specialization']})
-                        - Diagnosis: {record['diagnosis'] or 'Not specified'}
-                        - Treatment: {record['treatment'] or 'Not specified'}
-                        - Prescription: {record['prescription'] or 'None'}
-                        - Vital Signs: Glucose: {record['vitals']['glucose'] or 'N/A'} mg/dL, 
-                        BP: {record['vitals']['bp_systolic'] or 'N/A'}/{record['vitals']['bp_diastolic'] or 'N/A'} mmHg, 
-                        Heart Rate: {record['vitals']['heart_rate'] or 'N/A'} bpm, 
-                        Temperature: {record['vitals']['temperature'] or 'N/A'}°C
-                        """
-            
-            # Allergies
-            allergies = patient_context.get('allergies', [])
-            if allergies:
-                context_text += f"\nKNOWN ALLERGIES ({len(allergies)}):\n"
-                for allergy in allergies:
-                    context_text += f"- {allergy['name']} ({allergy['severity']})\n"
-            
-            # Health patterns
-            patterns = patient_context.get('health_patterns', {})
-            if patterns:
-                context_text += f"""
-                    HEALTH PATTERNS ANALYSIS:
-                    - Average Blood Glucose: {patterns.get('glucose_avg', 'N/A')} mg/dL
-                    - Average Blood Pressure: {patterns.get('bp_avg', 'N/A')} mmHg (systolic)
-                    - Average Heart Rate: {patterns.get('heart_rate_avg', 'N/A')} bpm
-                    - Total Medical Visits: {patterns.get('total_visits', 0)}
-                    - Recent Diagnoses: {', '.join(patterns.get('recent_diagnoses', [])) or 'None'}
-
-                    """
-            # Medical files and images
-            files = patient_context.get('files_summary', [])
-            images = patient_context.get('images_summary', [])
-            if files or images:
-                context_text += f"\nMEDICAL DOCUMENTATION:\n"
-                if files:
-                    context_text += f"- {len(files)} medical files on record (recent: {files[0]['category'] if files else 'None'})\n"
-                if images:
-                    context_text += f"- {len(images)} medical images on record (recent: {images[0]['type'] if images else 'None'})\n"
-            
-            system_prompt += context_text
-        
-        # Combine system prompt with user message
-        full_prompt = system_prompt + f"\nPATIENT QUESTION: {user_message}"
+        # Prompt packed into the token budget, most important sections first
+        full_prompt, report = prompt_builder.patient_prompt(user_message, patient_context)
+        note_prompt_report('patient', report)
         
-        # Generate response
-        response = AI_MODEL.generate_content(full_prompt)
-        
-        # Clean response
-        clean_response = re.sub(r'<[^>]+>', '', response.text)
-        clean_response = clean_response.replace('**', '')
-        clean_response = clean_response.replace('*', '')
-        clean_response = clean_response.strip()
-        
-        return clean_response
+        # Generate response, cleaned while it streams in. The same question on unchanged data
+        # is answered from the cache (the key covers everything the prompt is built from)
+        key = ai_cache.question_key(f"patient:{patient_id or ''}", patient_context, user_message)
+        yield from ai_cache.cached_stream(key, lambda: ai_client.clean_stream(AI_CLIENT.stream(full_prompt)))
         
     except Exception as e:
-        return f"I apologize, but I'm having trouble processing your request right now. Please try again or contact your healthcare provider if you have urgent medical concerns. Error: {str(e)}"
+        yield f"I apologize, but I'm having trouble processing your request right now. Please try again or contact your healthcare provider if you have urgent medical concerns. Error: {str(e)}"
     
+def user_bubble_html(content):
+    if st.session_state.dark_mode:
+        # Dark mode: White background + Black text
+        user_bg = "linear-gradient(135deg, #ffffff, #f0f0f0)"
+        user_text = "#000000"
+    else:
+        # Light mode: Blue background + White text  
+        user_bg = "linear-gradient(135deg, #2196F3, #1976D2)"
+        user_text = "#ffffff"
+
+    return f"""
+    <div style="text-align: right; margin: 15px 0;">
+        <div class="user-bubble" style="background: {user_bg}; 
+                    color: {user_text} !important; 
+                    padding: 12px 16px; border-radius: 15px; display: inline-block; max-width: 80%;
+                    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);">
+            <strong style="color: {user_text} !important;">You:</strong> 
+            <span style="color: {user_text} !important;">{content}</span>
+        </div>
+    </div>
+    """
+
+def ai_bubble_html(content, label):
+    clean_content = content.replace('<div>', '').replace('</div>', '').replace('<p>', '').replace('</p>', '')
+    if st.session_state.dark_mode:
+        # Dark mode: Blue background + White text
+        bg_color = "linear-gradient(135deg, #1976D2, #2196F3)"
+        text_color = "#ffffff"
+    else:
+        # Light mode: Green background + Black text
+        bg_color = "linear-gradient(135deg, #4CAF50, #45a049)"
+        text_color = "#000000"
+
+    return f"""
+    <div style="text-align: left; margin: 15px 0;">
+        <div class="ai-bubble" style="background: {bg_color}; 
+                    color: {text_color} !important; 
+                    padding: 12px 16px; border-radius: 15px; display: inline-block; max-width: 80%;
+                    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);">
+            <strong style="color: {text_color} !important;">{label}</strong> 
+            <span style="color: {text_color} !important;">{clean_content}</span>
+        </div>
+    </div>
+    """
+
+def stream_chat_answer(container, user_input, chunks, label):
+    """Show the question and the answer as it streams in, returns the full answer"""
+    with container:
+        st.markdown(user_bubble_html(user_input), unsafe_allow_html=True)
+        answer_placeholder = st.empty()
+    answer_placeholder.markdown(ai_bubble_html("…", label), unsafe_allow_html=True)
+    answer = ""
+    for chunk in chunks:
+        answer += chunk
+        answer_placeholder.markdown(ai_bubble_html(answer + " ▌", label), unsafe_allow_html=True)
+    answer_placeholder.markdown(ai_bubble_html(answer, label), unsafe_allow_html=True)
+    return answer
+
 def show_ai_chat_interface():
     """Display the AI chat interface with proper CSS loading"""
 
@@ -2105,49 +1876,10 @@ def show_ai_chat_interface():
         if st.session_state.chat_messages:
             for i, message_data in enumerate(st.session_state.chat_messages):
                 if message_data["role"] == "user":
-                    if st.session_state.dark_mode:
-                        # Dark mode: White background + Black text
-                        user_bg = "linear-gradient(135deg, #ffffff, #f0f0f0)"
-                        user_text = "#000000"
-                    else:
-                        # Light mode: Blue background + White text  
-                        user_bg = "linear-gradient(135deg, #2196F3, #1976D2)"
-                        user_text = "#ffffff"
-    
-                    st.markdown(f"""
-                    <div style="text-align: right; margin: 15px 0;">
-                        <div class="user-bubble" style="background: {user_bg}; 
-                                    color: {user_text} !important; 
-                                    padding: 12px 16px; border-radius: 15px; display: inline-block; max-width: 80%;
-                                    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);">
-                            <strong style="color: {user_text} !important;">You:</strong> 
-                            <span style="color: {user_text} !important;">{message_data["content"]}</span>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(user_bubble_html(message_data["content"]), unsafe_allow_html=True)
                 else:
                     # AI response - Correct colors for both themes
-                    clean_content = message_data["content"].replace('<div>', '').replace('</div>', '').replace('<p>', '').replace('</p>', '')
-                    if st.session_state.dark_mode:
-                        # Dark mode: Blue background + White text
-                        bg_color = "linear-gradient(135deg, #1976D2, #2196F3)"
-                        text_color = "#ffffff"
-                    else:
-                        # Light mode: Green background + Black text
-                        bg_color = "linear-gradient(135deg, #4CAF50, #45a049)"
-                        text_color = "#000000"
-    
-                    st.markdown(f"""
-                    <div style="text-align: left; margin: 15px 0;">
-                        <div class="ai-bubble" style="background: {bg_color}; 
-                                    color: {text_color} !important; 
-                                    padding: 12px 16px; border-radius: 15px; display: inline-block; max-width: 80%;
-                                    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);">
-                            <strong style="color: {text_color} !important;">👾 AI Assistant:</strong> 
-                            <span style="color: {text_color} !important;">{clean_content}</span>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(ai_bubble_html(message_data["content"], "👾 AI Assistant:"), unsafe_allow_html=True)
         else:
             st.markdown(f"""
             <div class="info-card" style="text-align: center; padding: 30px;">
@@ -2174,13 +1906,14 @@ def show_ai_chat_interface():
 
             st.session_state.chat_messages.append({"role": "user", "content": user_input})
             
-            patient_context = None
+            patient_context = patient_id = None
             if st.session_state.user and st.session_state.user.get('role') == 'patient':
-                patient_context = get_patient_context_for_ai(st.session_state.user['id'])
+                patient_id = st.session_state.user['id']
+                patient_context = get_patient_context_for_ai(patient_id)
             
-            # Generating response
-            with st.spinner("🤔 Thinking..."):
-                ai_response = generate_ai_response(user_input, patient_context)
+            # Generating response, shown while it streams in
+            ai_response = stream_chat_answer(chat_container, user_input,
+                                             stream_ai_response(user_input, patient_context, patient_id), "👾 AI Assistant:")
             
             # adding ai to chat
             st.session_state.chat_messages.append({"role": "assistant", "content": ai_response})
@@ -2192,6 +1925,9 @@ def show_ai_chat_interface():
         if st.button("🗑️ Clear Chat", use_container_width=True):   # to clear chat
             st.session_state.chat_messages = []
             st.rerun()
+    with col2:
+        if st.session_state.chat_messages and st.session_state.get('patient_prompt_report'):
+            st.caption(f"📏 Last question: {st.session_state.patient_prompt_report.summary()}")
 
 def get_doctor_context_for_ai(doctor_id, selected_patients=None):
     """Gather comprehensive data for doctor's AI assistant"""
@@ -2263,10 +1999,13 @@ def get_doctor_context_for_ai(doctor_id, selected_patients=None):
                 'treatment': record[5]
             })
         
-        # If specific patients are selected, get detailed info
+        # If specific patients are selected, get detailed info: all of them loaded together
+        # (IN queries on this connection), cached patients are not queried again
         if selected_patients:
-            for patient_id in selected_patients:
-                patient_context = get_patient_context_for_ai(patient_id)
+            patients = patient_data.get_aggregates(selected_patients, lambda patient_ids: patient_data.fetch_many_sections(
+                cursor, patient_ids, patient_data.SECTION_QUERIES))
+            for patient_id, patient in patients.items():
+                patient_context = ai_context.patient_context(patient)
                 if patient_context['patient_basic_info']:
                     context['patient_summaries'].append({
                         'patient_id': patient_id,
@@ -2286,101 +2025,27 @@ def get_doctor_context_for_ai(doctor_id, selected_patients=None):
 
 def generate_doctor_ai_response(user_message, doctor_id, selected_patients=None):
     """Generate AI response specifically for doctors"""
+    return ''.join(stream_doctor_ai_response(user_message, doctor_id, selected_patients))
+
+def stream_doctor_ai_response(user_message, doctor_id, selected_patients=None):
+    """generate_doctor_ai_response as a stream of cleaned answer pieces"""
     if not AI_AVAILABLE:
-        return "AI assistant is currently unavailable. Please check your API configuration."
+        yield "AI assistant is currently unavailable. Please check your API configuration."
+        return
     
     try:
-        # Create doctor-focused system prompt
-        system_prompt = """You are an advanced AI medical assistant designed specifically for healthcare professionals.
-
-        IMPORTANT GUIDELINES FOR DOCTORS:
-        1. Provide clinical insights, differential diagnoses, and treatment recommendations
-        2. Analyze patient data patterns and suggest clinical correlations
-        3. Offer evidence-based medical information and guidelines
-        4. Help with clinical decision-making and care planning
-        5. Suggest follow-up tests, referrals, or monitoring when appropriate
-        6. Use medical terminology appropriately while being clear
-        7. Always emphasize that final clinical decisions rest with the attending physician
-        8. Respond in plain text without HTML formatting
-        9. Focus on clinical utility and actionable insights
-        10. Consider differential diagnoses and clinical reasoning
-
-        """
-        
-        # Add doctor context
         doctor_context = get_doctor_context_for_ai(doctor_id, selected_patients)
         
-        if doctor_context and any(doctor_context.values()):
-            context_text = "\nDOCTOR PROFILE AND CONTEXT:\n"
-            
-            # Doctor info
-            doc_info = doctor_context.get('doctor_info', {})
-            if doc_info:
-                context_text += f"""
-                PHYSICIAN PROFILE:
-                - Name: {doc_info.get('name', 'Unknown')}
-                - Specialization: {doc_info.get('specialization', 'General Practice')}
-                - Hospital: {doc_info.get('hospital', 'Not specified')}
-                - Experience: {doc_info.get('experience_years', 'Not specified')} years
-                """
-            
-            # Statistics
-            stats = doctor_context.get('statistics', {})
-            if stats:
-                context_text += f"""
-                PRACTICE STATISTICS:
-                - Total patients managed: {stats.get('total_patients', 0)}
-                - Total medical records: {stats.get('total_records', 0)}
-                - Last activity: {stats.get('last_activity', 'No activity')}
-                """
-            
-            # Recent activities
-            recent = doctor_context.get('recent_activities', [])
-            if recent:
-                context_text += f"\nRECENT PATIENT ENCOUNTERS ({len(recent)} recent):\n"
-                for i, activity in enumerate(recent[:5]):
-                    context_text += f"""
-                    Patient {i+1}:
-                    - ID: {activity['patient_id']} | Name: {activity['patient_name']}
-                    - Age: {activity['age']} years | Blood Type: {activity['blood_group']}
-                    - Visit Date: {activity['visit_date']}
-                    - Diagnosis: {activity['diagnosis'] or 'Not specified'}
-                    - Treatment: {activity['treatment'] or 'Not specified'}
-                    """
-            
-            # Selected patient summaries
-            patient_summaries = doctor_context.get('patient_summaries', [])
-            if patient_summaries:
-                context_text += f"\nSELECTED PATIENT DETAILED SUMMARIES:\n"
-                for summary in patient_summaries:
-                    basic = summary['basic_info']
-                    patterns = summary['health_patterns']
-                    context_text += f"""
-                    PATIENT: {basic.get('name', 'Unknown')} (ID: {summary['patient_id']})
-                    - Age: {basic.get('age', 'Unknown')} | Gender: {basic.get('gender', 'Unknown')}
-                    - Blood Group: {basic.get('blood_group', 'Unknown')} | BMI: {basic.get('bmi', 'Not calculated')}
-                    - Health Patterns: Avg Glucose: {patterns.get('glucose_avg', 'N/A')} mg/dL,
-                      Avg BP: {patterns.get('bp_avg', 'N/A')} mmHg, Total Visits: {patterns.get('total_visits', 0)}
-                    - Known Allergies: {len(summary['allergies'])} documented
-                    - Recent Diagnoses: {', '.join(patterns.get('recent_diagnoses', [])) or 'None'}
-                    """
-            
-            system_prompt += context_text
+        # Prompt packed into the token budget, selected patients go in while they fit
+        full_prompt, report = prompt_builder.doctor_prompt(user_message, doctor_context)
+        note_prompt_report('doctor', report)
         
         # Generate response
-        full_prompt = system_prompt + f"\nDOCTOR'S QUESTION/REQUEST: {user_message}"
-        response = AI_MODEL.generate_content(full_prompt)
-        
-        # Clean response
-        clean_response = re.sub(r'<[^>]+>', '', response.text)
-        clean_response = clean_response.replace('**', '')
-        clean_response = clean_response.replace('*', '')
-        clean_response = clean_response.strip()
-        
-        return clean_response
+        key = ai_cache.question_key(f"doctor:{doctor_id}", doctor_context, user_message)
+        yield from ai_cache.cached_stream(key, lambda: ai_client.clean_stream(AI_CLIENT.stream(full_prompt)))
         
     except Exception as e:
-        return f"I apologize, but I'm having trouble processing your request right now. Please try again later. Error: {str(e)}"
+        yield f"I apologize, but I'm having trouble processing your request right now. Please try again later. Error: {str(e)}"
     
 def show_doctor_ai_chat():
     """Display doctor-specific AI chat interface"""
@@ -2402,49 +2067,10 @@ def show_doctor_ai_chat():
         if st.session_state.doctor_chat_messages:
             for message_data in st.session_state.doctor_chat_messages:
                 if message_data["role"] == "user":
-                    if st.session_state.dark_mode:
-                        # Dark mode: White background + Black text
-                        user_bg = "linear-gradient(135deg, #ffffff, #f0f0f0)"
-                        user_text = "#000000"
-                    else:
-                        # Light mode: Blue background + White text  
-                        user_bg = "linear-gradient(135deg, #2196F3, #1976D2)"
-                        user_text = "#ffffff"
-    
-                    st.markdown(f"""
-                    <div style="text-align: right; margin: 15px 0;">
-                        <div class="user-bubble" style="background: {user_bg}; 
-                                    color: {user_text} !important; 
-                                    padding: 12px 16px; border-radius: 15px; display: inline-block; max-width: 80%;
-                                    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);">
-                            <strong style="color: {user_text} !important;">You:</strong> 
-                            <span style="color: {user_text} !important;">{message_data["content"]}</span>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(user_bubble_html(message_data["content"]), unsafe_allow_html=True)
                 else:
                     # Doctor AI response - Correct colors for both themes
-                    clean_content = message_data["content"].replace('<div>', '').replace('</div>', '').replace('<p>', '').replace('</p>', '')
-                    if st.session_state.dark_mode:
-                        # Dark mode: Blue background + White text
-                        bg_color = "linear-gradient(135deg, #1976D2, #2196F3)"
-                        text_color = "#ffffff"
-                    else:
-                        # Light mode: Green background + Black text
-                        bg_color = "linear-gradient(135deg, #4CAF50, #45a049)"
-                        text_color = "#000000"
-    
-                    st.markdown(f"""
-                    <div style="text-align: left; margin: 15px 0;">
-                        <div class="ai-bubble" style="background: {bg_color}; 
-                                    color: {text_color} !important; 
-                                    padding: 12px 16px; border-radius: 15px; display: inline-block; max-width: 80%;
-                                    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.2);">
-                            <strong style="color: {text_color} !important;">👾 Clinical AI:</strong> 
-                            <span style="color: {text_color} !important;">{clean_content}</span>
-                        </div>
-                    </div>
-                    """, unsafe_allow_html=True)
+                    st.markdown(ai_bubble_html(message_data["content"], "👾 Clinical AI:"), unsafe_allow_html=True)
         else:
             st.markdown(f"""
             <div class="info-card" style="text-align: center; padding: 30px;">
@@ -2473,13 +2099,12 @@ def show_doctor_ai_chat():
         if send_button and user_input:
             st.session_state.doctor_chat_messages.append({"role": "user", "content": user_input})
             
-            # Generate response with doctor context
-            with st.spinner("🔬 Analyzing clinical data..."):
-                ai_response = generate_doctor_ai_response(
-                    user_input, 
-                    st.session_state.user['id'], 
-                    st.session_state.selected_patients if st.session_state.selected_patients else None
-                )
+            # Generate response with doctor context, shown while it streams in
+            ai_response = stream_chat_answer(chat_container, user_input, stream_doctor_ai_response(
+                user_input, 
+                st.session_state.user['id'], 
+                st.session_state.selected_patients if st.session_state.selected_patients else None
+            ), "👾 Clinical AI:")
             
             st.session_state.doctor_chat_messages.append({"role": "assistant", "content": ai_response})
             st.rerun()
@@ -2493,6 +2118,9 @@ def show_doctor_ai_chat():
     with col2:
         if st.session_state.selected_patients:
             st.info(f"📋 {len(st.session_state.selected_patients)} patient(s) selected for AI analysis")
+    with col3:
+        if st.session_state.doctor_chat_messages and st.session_state.get('doctor_prompt_report'):
+            st.caption(f"📏 Last question: {st.session_state.doctor_prompt_report.summary()}")
 
 # Patient Dashboard 
 def show_patient_dashboard():
@@ -2581,15 +2209,18 @@ def show_patient_dashboard():
             st.markdown("### Your Medical Overview")
             st.markdown(f"Current Date: **{date.today().strftime('%Y-%m-%d')}**")
             
-            recent_records = patient_records(st.session_state.user['id'], start_date=date.today() - timedelta(days=30))
+            # served from the aggregate cache, reruns (theme toggle, sidebar) don't hit the DB
+            patient = get_comprehensive_patient_data(st.session_state.user['id'])
+            recent_cutoff = date.today() - timedelta(days=30)
+            recent_records = [r for r in patient.medical_records if r[1] >= recent_cutoff] if patient else []
             st.markdown(f'<div class="metric-card"><h4>📅 Recent Visits (30 days):</h4> <p style="font-size: 1.5em; font-weight: bold;">{len(recent_records)}</p></div>', unsafe_allow_html=True)
             
-            allergies = patient_allergies(st.session_state.user['id'])
+            allergies = patient.allergies if patient else []
             allergy_count = len(allergies)
             allergy_color = "red" if allergy_count > 0 else "green"
             st.markdown(f'<div class="metric-card"><h4>⚠️ Known Allergies:</h4> <p style="color: {allergy_color}; font-size: 1.5em; font-weight: bold;">{allergy_count}</p></div>', unsafe_allow_html=True)
             
-            files = patient_files(st.session_state.user['id'])
+            files = patient.medical_files if patient else []
             st.markdown(f'<div class="metric-card"><h4>📁 Medical Files:</h4> <p style="font-size: 1.5em; font-weight: bold;">{len(files)}</p></div>', unsafe_allow_html=True)
     
     elif patient_choice == "👾 AI Assistant":
@@ -2629,6 +2260,10 @@ def show_patient_dashboard():
                 mime="text/html",
                 use_container_width=True
             )
+            with col3:
+                parquet_export_button('patient_id', st.session_state.user['id'],
+                                      f"medical_records_{st.session_state.user['id']}_{date.today().strftime('%Y%m%d')}.parquet",
+                                      "patient_parquet_export")
             
             st.markdown(f"**Total Records Found:** {len(records)}")
 
@@ -2793,24 +2428,47 @@ def show_patient_dashboard():
         images = patient_images(st.session_state.user['id'])
         
         if images:
+            if 'opened_images' not in st.session_state:
+                st.session_state.opened_images = set()
+
             for img in images:
                 with st.expander(f"📷 {img[1]} - {img[5].strftime('%Y-%m-%d')}"):
                     col1, col2 = st.columns([2, 1])
                     with col1:
-                        try:
-                            image = Image.open(io.BytesIO(img[2]))
-                            st.image(image, caption=img[1], use_container_width=True)
-                        except Exception as e:
-                            st.error(f"Could not display image: {e}")
+                        if img[0] in st.session_state.opened_images:
+                            # full resolution only after the user asked for it
+                            try:
+                                image = Image.open(io.BytesIO(medical_image_data(img[0], st.session_state.user['id'])))
+                                st.image(image, caption=img[1], use_container_width=True)
+                            except Exception as e:
+                                st.error(f"Could not display image: {e}")
+                        else:
+                            thumbnail_data = img[2]
+                            if thumbnail_data is None:
+                                thumbnail_data, _ = backfill_image_thumbnail(img[0], st.session_state.user['id'])
+                            if thumbnail_data:
+                                st.image(thumbnail_data, caption=img[1])
+                            else:
+                                st.info("No preview available")
                     with col2:
                         st.markdown(f"**Type:** {img[3]}")
                         st.markdown(f"**Description:** {img[4] if img[4] else 'No description'}")
                         st.markdown(f"**Upload Date:** {img[5].strftime('%Y-%m-%d')}")
+                        st.markdown(f"**Size:** {format_file_size(img[6])}")
+
+                        if img[0] in st.session_state.opened_images:
+                            if st.button("🔽 Show Preview", key=f"close_image_{img[0]}"):
+                                st.session_state.opened_images.discard(img[0])
+                                st.rerun()
+                        elif st.button("🔍 Open Full Image", key=f"open_image_{img[0]}"):
+                            st.session_state.opened_images.add(img[0])
+                            st.rerun()
                         
-                        # Download button for image
-                        st.download_button(
-                            label="📥 Download Image",
-                            data=img[2],
+                        # Download button for image, fetched on request
+                        prepared_download_button(
+                            "⬇️ Prepare Download", "📥 Download Image",
+                            lambda image_id=img[0], patient_id=st.session_state.user['id']: medical_image_data(image_id, patient_id),
+                            key=f"download_image_{img[0]}",
                             file_name=img[1],
                             mime=img[3]
                         )
@@ -2831,14 +2489,16 @@ def show_patient_dashboard():
                         st.markdown(f"**Description:** {file[4] if file[4] else 'No description'}")
                         st.markdown(f"**Uploaded by:** Dr. {file[6]} {file[7]}" if file[6] and file[7] else "**Uploaded by:** System")
                         st.markdown(f"**Upload Date:** {file[5].strftime('%Y-%m-%d')}")
+                        st.markdown(f"**Size:** {format_file_size(file[8])}")
                     with col2:
-                        st.download_button(
-                            label="📥 Download File",
-                            data=file[8],
+                        # content is fetched only when the user asks for it
+                        prepared_download_button(
+                            "⬇️ Prepare Download", "📥 Download File",
+                            lambda file_id=file[0], patient_id=st.session_state.user['id']: medical_file_data(file_id, patient_id),
+                            key=f"download_file_{file[0]}",
                             file_name=file[1],
                             mime=file[2],
-                            use_container_width=True,
-                            key=f"download_{file[1]}_{i}"
+                            use_container_width=True
                         )
         else:
             st.info("No medical files uploaded yet.")
@@ -2860,46 +2520,66 @@ def show_patient_dashboard():
     elif patient_choice == "🔍 Find Doctors":
         st.markdown("### Find Healthcare Providers")
     
+        # filters and results come from one directory search: the widgets' values from the last
+        # run are searched first, then the filters are drawn with the facet counts of that search
+        sort_by = st.session_state.get('doctor_sort', "Experience (High to Low)")
+        doctor_search = (st.session_state.get('patient_search_doctors', ""),
+                         st.session_state.get('specialty_filter', "All Specialties"),
+                         st.session_state.get('experience_filter', "Any Experience"),
+                         st.session_state.get('location_filter', ""),
+                         st.session_state.get('hospital_filter', "All Hospitals"))
+        fetch_doctors = lambda after, with_total: search_doctors_advanced(*doctor_search, sort_by=sort_by, after=after)
+        results = paged_search('doctor_search_results', doctor_search + (sort_by,), fetch_doctors)
+        facets = results['facets'] or {}
+        
+        # options (and labels) must not change with the other filters, a selectbox whose options
+        # change is a new widget and loses its value. The counts are shown below each filter
+        def facet_options(name, all_label, selected):
+            try:
+                options = [all_label] + directory.get_directory().facet_options(name)
+            except mysql.connector.Error:
+                options = [all_label]
+            if selected not in options:
+                options.append(selected)
+            return options
+        
+        def facet_counts(name, limit=6):
+            counts = facets.get(name, [])
+            if counts:
+                more = f" · +{len(counts) - limit} more" if len(counts) > limit else ""
+                st.caption(" · ".join(f"{value} ({count})" for value, count in counts[:limit]) + more)
+        
         # Enhanced search and filter section
         with st.expander("🔍 Search & Filter Options", expanded=True):
             col1, col2 = st.columns(2)
         
             with col1:
-                search_term = st.text_input("🔍 Search by name, email, or hospital:", key="patient_search_doctors")
+                st.text_input("🔍 Search by name, email, or hospital:", key="patient_search_doctors")
+            
+                st.selectbox("🏥 Filter by Specialty:", facet_options('specialization', "All Specialties", doctor_search[1]),
+                             key="specialty_filter")
+                facet_counts('specialization')
             
-                specialty_options = ["All Specialties", "Cardiology", "Neurology", "Orthopedics", 
-                                "Dermatology", "General Practice", "Pediatrics", "Gynecology", 
-                                "Psychiatry", "Radiology", "Emergency Medicine", "Surgery", "Other"]
-                specialty_filter = st.selectbox("🏥 Filter by Specialty:", specialty_options, key="specialty_filter")
+                st.selectbox("🏨 Filter by Hospital:", facet_options('hospital', "All Hospitals", doctor_search[4]),
+                             key="hospital_filter")
+                facet_counts('hospital')
         
             with col2:
-                experience_options = ["Any Experience", "0-5 years", "5-10 years", "10-20 years", "20+ years"]
-                experience_filter = st.selectbox("📅 Years of Experience:", experience_options,     key="experience_filter")
+                experience_options = ["Any Experience"] + [bucket for bucket, _, _ in directory.EXPERIENCE_BUCKETS]
+                st.selectbox("📅 Years of Experience:", experience_options, key="experience_filter")
+                facet_counts('experience')
             
-                location_filter = st.text_input("🌍 Filter by City/Hospital:", key="location_filter")
-        
-            # Search button
-            if st.button("🔍 Search Doctors", use_container_width=True):
-                st.session_state.doctor_search_results = search_doctors_advanced(
-                    search_term, specialty_filter, experience_filter, location_filter
-                )
+                st.text_input("🌍 Filter by City/Hospital:", key="location_filter")
     
         # Display results
-        if hasattr(st.session_state, 'doctor_search_results'):
-            doctors = st.session_state.doctor_search_results
+        with st.container():
+            doctors = results['rows']
         
             if doctors:
-                st.markdown(f"### 👨‍⚕️ Found {len(doctors)} Doctor(s)")
+                st.markdown(f"### 👨‍⚕️ Found {results_count_text(results)} Doctor(s)")
             
                 # Sort options
-                sort_by = st.selectbox("Sort by:", ["Experience (High to Low)", "Name (A-Z)", "Recently Joined"],key="doctor_sort")
-            
-                if sort_by == "Experience (High to Low)":
-                    doctors = sorted(doctors, key=lambda x: x[7] if x[7] else 0, reverse=True)
-                elif sort_by == "Name (A-Z)":
-                    doctors = sorted(doctors, key=lambda x: f"{x[1]} {x[2]}")
-                elif sort_by == "Recently Joined":
-                    doctors = sorted(doctors, key=lambda x: x[9], reverse=True)
+                st.selectbox("Sort by:", list(directory.ORDERS), key="doctor_sort")
             
                 for doctor in doctors:
                     with st.expander(f"👨‍⚕️ Dr. {doctor[1]} {doctor[2]} - {doctor[5] if doctor[5] else 'General     Practice'}", expanded=False):
@@ -2943,6 +2623,8 @@ def show_patient_dashboard():
                             st.markdown("🧑‍⚕️ Verified Patients: 20+")
                         with col_rating3:
                             st.markdown("💬 Feedback: Positive")
+            
+                load_more_button('doctor_search_results', fetch_doctors, "⬇️ Load more doctors")
             else:
                 st.info("🔍 No doctors found matching your search criteria.")
                 st.markdown("### 💡 Try these suggestions:")
@@ -2961,11 +2643,18 @@ def show_patient_dashboard():
             ("General Practice", "👨‍⚕️")
         ]
 
+        def browse_specialty(spec):
+            # runs before the next rerun, when the filter widgets can still be changed
+            st.session_state.patient_search_doctors = ""
+            st.session_state.location_filter = ""
+            st.session_state.hospital_filter = "All Hospitals"
+            st.session_state.experience_filter = "Any Experience"
+            st.session_state.specialty_filter = spec
+
         for i, (spec, icon) in enumerate(specialties):
             with [col1, col2, col3, col4][i]:
-                if st.button(f"{icon} {spec}", key=f"quick_spec_{spec}", use_container_width=True):
-                    st.session_state.doctor_search_results = search_doctors_advanced("", spec, "", "")
-                    st.rerun()
+                st.button(f"{icon} {spec}", key=f"quick_spec_{spec}", use_container_width=True,
+                          on_click=browse_specialty, args=(spec,))
 
     elif patient_choice == "ℹ️ About":
         st.markdown("### About E-Medical Record System")
@@ -3105,14 +2794,20 @@ def show_doctor_dashboard():
                 )
     
         if search_term or blood_group_filter != "All":
-            patients = search_patients_advanced_doctor(search_term, blood_group_filter)
+            fetch_patients = lambda after, with_total: search_patients_advanced_doctor(
+                search_term, blood_group_filter, after, with_total=with_total)
+            results = paged_search('patient_search_results', (search_term, blood_group_filter), fetch_patients)
+            patients = results['rows']
         
             if patients:
-                st.markdown(f"### Found {len(patients)} Patient(s)")
+                st.markdown(f"### Found {results_count_text(results)} Patient(s)")
             
                 selected_patients = []
+                # counts for the whole result page in one query
+                summaries = patient_summaries([patient[0] for patient in patients])
             
                 for patient in patients:
+                    summary = summaries.get(patient[0], EMPTY_PATIENT_SUMMARY)
                     with st.expander(f"👤 {patient[1]} {patient[2]} (ID: {patient[0]})", expanded=False):
                         # Quick patient overview
                         col_overview1, col_overview2, col_overview3 = st.columns([2, 2, 1])
@@ -3127,15 +2822,13 @@ def show_doctor_dashboard():
                             """)
                     
                         with col_overview2:
-                            # Get recent records count and last visit
-                            recent_records = patient_records(patient[0])
-                            last_visit = recent_records[0][3].strftime('%Y-%m-%d') if recent_records else 'No visits'
+                            last_visit = summary['last_visit'].strftime('%Y-%m-%d') if summary['last_visit'] else 'No visits'
                         
                             st.markdown(f"""
                             **Medical Summary:**
-                            - Total Records: {len(recent_records)}
+                            - Total Records: {summary['record_count']}
                             - Last Visit: {last_visit}
-                            - Allergies: {len(patient_allergies(patient[0]))} known
+                            - Allergies: {summary['allergy_count']} known
                             """)
                     
                         with col_overview3:
@@ -3162,8 +2855,9 @@ def show_doctor_dashboard():
                                 st.info("Patient selected for file upload")
                     
                         with col_action3:
-                            files = patient_files(patient[0])
-                            if st.button(f"📄 Files ({len(files)})", key=f"view_files_{patient[0]}", use_container_width=True):
+                            if st.button(f"📄 Files ({summary['file_count']})", key=f"view_files_{patient[0]}", use_container_width=True):
+                                # listing is only fetched when asked for
+                                files = patient_files(patient[0]) if summary['file_count'] else []
                                 if files:
                                     for file in files[:3]:  # Show first 3 files
                                         st.markdown(f"- {file[1]} ({file[3]})")
@@ -3173,13 +2867,15 @@ def show_doctor_dashboard():
                                     st.info("No files uploaded")
                     
                         with col_action4:
-                            images = patient_images(patient[0])
-                            if st.button(f"🖼️ Images ({len(images)})", key=f"view_images_{patient[0]}", use_container_width=True)    :
+                            if st.button(f"🖼️ Images ({summary['image_count']})", key=f"view_images_{patient[0]}", use_container_width=True):
+                                images = patient_images(patient[0]) if summary['image_count'] else []
                                 if images:
                                     st.markdown(f"Recent images: {', '.join([img[1] for img in images[:2]])}")
                                 else:
                                     st.info("No images uploaded")
             
+                load_more_button('patient_search_results', fetch_patients, "⬇️ Load more patients")
+            
                 # Store selected patients
                 if selected_patients:
                     st.session_state.selected_patients = selected_patients
@@ -3294,16 +2990,21 @@ def show_doctor_dashboard():
                 submitted = st.form_submit_button("📤 Upload Files", use_container_width=True)
                 
                 if submitted and uploaded_files:
-                    success_count = 0
-                    for file in uploaded_files:
-                        if add_medical_file(selected_patient_id, st.session_state.user['id'], file, category, description):
-                            success_count += 1
+                    progress_bars = [st.progress(0.0, text=f"📤 {file.name}") for file in uploaded_files]
+                    on_progress = lambda index, done, total: progress_bars[index].progress(
+                        min(done / total, 1.0) if total else 1.0, text=f"📤 {uploaded_files[index].name}")
+                    results = add_medical_files(selected_patient_id, st.session_state.user['id'], uploaded_files,
+                                                category, description, progress=on_progress)
+                    success_count = sum(1 for _, success, _ in results if success)
                     
                     if success_count == len(uploaded_files):
                         st.session_state.success_message = f"✅ Successfully uploaded {success_count} file(s)!"
                         st.rerun()
                     else:
                         st.error(f"❌ Uploaded {success_count} out of {len(uploaded_files)} files.")
+                        for file_name, success, error in results:
+                            if not success:
+                                st.warning(f"{file_name}: {error}")
 
     elif doctor_choice == "🖼️ Upload Images":
         st.markdown("### Upload Medical Images")
@@ -3337,16 +3038,21 @@ def show_doctor_dashboard():
                 submitted = st.form_submit_button("🖼️ Upload Images", use_container_width=True)
                 
                 if submitted and uploaded_images:
-                    success_count = 0
-                    for image in uploaded_images:
-                        if add_medical_image(selected_patient_id, st.session_state.user['id'], image, image_type, description):
-                            success_count += 1
+                    progress_bars = [st.progress(0.0, text=f"🖼️ {image.name}") for image in uploaded_images]
+                    on_progress = lambda index, done, total: progress_bars[index].progress(
+                        min(done / total, 1.0) if total else 1.0, text=f"🖼️ {uploaded_images[index].name}")
+                    results = add_medical_images(selected_patient_id, st.session_state.user['id'], uploaded_images,
+                                                 image_type, description, progress=on_progress)
+                    success_count = sum(1 for _, success, _ in results if success)
                     
                     if success_count == len(uploaded_images):
                         st.session_state.success_message = f"✅ Successfully uploaded {success_count} image(s)!"
                         st.rerun()
                     else:
                         st.error(f"❌ Uploaded {success_count} out of {len(uploaded_images)} images.")
+                        for image_name, success, error in results:
+                            if not success:
+                                st.warning(f"{image_name}: {error}")
         
     
     elif doctor_choice == "📋 Batch Upload":
@@ -3395,6 +3101,8 @@ def show_doctor_dashboard():
                 - `heart_rate`: Heart rate in bpm
                 - `temperature`: Body temperature in °C
             
+                **Parquet / Arrow:** the same column names; typed columns (dates, numbers) are used as they are.
+            
                 **Important Notes:**
                 ⚠️ Patient IDs must exist in the system
                 ⚠️ Empty rows will be skipped
@@ -3408,19 +3116,36 @@ def show_doctor_dashboard():
     
         uploaded_template = st.file_uploader(
             "Choose your filled template file",
-            type=['csv', 'xlsx', 'xls'],
-            help="Upload CSV or Excel file with medical records data",
+            type=['csv', 'xlsx', 'xls', 'parquet', 'arrow', 'feather'],
+            help="Upload CSV or Excel file with medical records data, or a Parquet / Arrow file with the same columns",
             key="batch_upload_template"
         )
     
-        if uploaded_template:
+        if uploaded_template and (templates.is_streamable(uploaded_template)
+                                  or arrow_io.is_columnar(uploaded_template.name)):
+            show_streaming_import(uploaded_template)
+        
+        elif uploaded_template:
             st.success(f"✅ File uploaded: {uploaded_template.name}")
         
             # Preview and validation section
             st.markdown("#### Step 3: Preview and Validate")
         
             with st.spinner("🔍 Parsing and validating template..."):
-                records_data, message = parse_template_file(uploaded_template)
+                records_data, message, row_errors = parse_template_file(uploaded_template)
+        
+            if row_errors:
+                import pandas as pd
+                errors_df = pd.DataFrame(row_errors)
+                skipped_rows = errors_df.loc[errors_df['skipped'], 'row'].nunique()
+                with st.expander(f"⚠️ Template problems: {skipped_rows} rows skipped, {len(row_errors)} issues"):
+                    st.dataframe(errors_df, use_container_width=True, hide_index=True)
+                    st.download_button(
+                        label="📥 Download Error Report",
+                        data=errors_df.to_csv(index=False).encode('utf-8'),
+                        file_name=f"{uploaded_template.name.rsplit('.', 1)[0]}_errors.csv",
+                        mime="text/csv"
+                    )
         
             if records_data:
                 st.success(message)
@@ -3443,13 +3168,15 @@ def show_doctor_dashboard():
             
                 validation_results = []
                 valid_count = 0
+                # all patient IDs of the file in one lookup, reused by "Process Records"
+                existing_ids = batch_existing_patient_ids(uploaded_template, records_data)
             
                 for i, record in enumerate(records_data):
                     issues = []
                 
                     # Check patient exists
                     if record.get('patient_id'):
-                        if not validate_patient_exists(record['patient_id']):
+                        if batch_import.patient_key(record['patient_id']) not in existing_ids:
                             issues.append(f"Patient ID '{record['patient_id']}' not found")
                     else:
                         issues.append("Missing patient ID")
@@ -3521,26 +3248,30 @@ def show_doctor_dashboard():
                                     if process_mode == "Process Valid Records Only":
                                         filtered_records = []
                                         for i, record in enumerate(records_data):
-                                            if validate_patient_exists(record.get('patient_id')) and record.get('visit_date'):
+                                            if record.get('patient_id') and batch_import.patient_key(record['patient_id']) in existing_ids and record.get('visit_date'):
                                                 filtered_records.append(record)
                                         process_records = filtered_records
                                     else:
                                         process_records = records_data
                                 
-                                    # Process the records
-                                    success, result_message = add_batch_medical_records(
-                                        process_records, 
-                                        st.session_state.user['id']
-                                    )
-                                
-                                    if success:
-                                        st.session_state.success_message = f"🎉 {result_message}"
+                                    # Queue the records, the import worker inserts them in the background
+                                    try:
+                                        job_id = jobs.enqueue_record_import(
+                                            process_records,
+                                            st.session_state.user['id'],
+                                            uploaded_template.name
+                                        )
+                                    except Exception as e:
+                                        st.error(f"❌ Error queueing import: {str(e)}")
+                                    else:
+                                        st.session_state.success_message = (
+                                            f"🎉 Queued import job {job_id} with {len(process_records)} records, "
+                                            "follow its progress under Import Jobs")
                                         # Clear the upload state
                                         if 'show_batch_instructions' in st.session_state:
                                             del st.session_state.show_batch_instructions
+                                        st.session_state.pop('batch_patient_ids', None)
                                         st.rerun()
-                                    else:
-                                        st.error(f"❌ {result_message}")
                 else:
                     st.error("❌ No valid records found to process. Please check your template data.")
         
@@ -3551,6 +3282,16 @@ def show_doctor_dashboard():
         else:
             st.info("👆 Please upload a template file to continue")
     
+        st.markdown("---")
+        show_import_jobs(st.session_state.user['id'])
+    
+        st.markdown("#### 📤 Export Records")
+        st.caption("All medical records you added, as a Parquet file with typed vitals columns "
+                   "(can be uploaded again above).")
+        parquet_export_button('doctor_id', st.session_state.user['id'],
+                              f"medical_records_{st.session_state.user['id']}_{date.today().strftime('%Y%m%d')}.parquet",
+                              "doctor_parquet_export")
+    
         # Additional help section
         st.markdown("---")
         with st.expander("❓ Need Help?"):
@@ -3656,6 +3397,18 @@ def show_doctor_dashboard():
             
             st.markdown("**Password Management**")
             st.info("To change your password, please contact the system administrator.")
+        
+        with st.expander("👾 AI Answer Cache"):
+            cache_stats = ai_cache.stats()
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Hit Rate", f"{cache_stats['hit_rate']:.0%}")
+            with col2:
+                st.metric("Answers Reused", cache_stats['hits'])
+            with col3:
+                st.metric("Cached Answers", f"{cache_stats['size']} / {cache_stats['maxsize']}")
+            st.caption(f"Model calls: {cache_stats['misses']} · Evicted: {cache_stats['evictions']} · "
+                       f"Answers expire after {cache_stats['ttl'] / 60:.0f} min")
 
 # Main app...
 def main():
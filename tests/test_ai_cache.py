@@ -0,0 +1,27 @@
+import unittest
+
+from Modules import ai_cache
+
+
+class QuestionKeyTest(unittest.TestCase):
+
+    def test_comparison_operators_do_not_collide(self):
+        context = {'patient_basic_info': {'name': 'Ana Lee'}}
+        self.assertNotEqual(ai_cache.question_key('patient:PAT001', context, "Is glucose > 200 dangerous?"),
+                            ai_cache.question_key('patient:PAT001', context, "Is glucose < 200 dangerous?"))
+
+    def test_signs_and_separators_are_kept(self):
+        for first, second in [("-5", "5"), ("120/80", "120 80"), ("37.5", "375")]:
+            self.assertNotEqual(ai_cache.normalize_question(first), ai_cache.normalize_question(second))
+
+    def test_case_spacing_and_trailing_punctuation_ignored(self):
+        self.assertEqual(ai_cache.normalize_question("What is my  Average glucose?"),
+                         ai_cache.normalize_question("what is my average glucose"))
+
+    def test_users_do_not_share_answers(self):
+        self.assertNotEqual(ai_cache.question_key('patient:PAT001', {}, "hi"),
+                            ai_cache.question_key('patient:PAT002', {}, "hi"))
+
+
+if __name__ == '__main__':
+    unittest.main()
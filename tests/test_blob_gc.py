@@ -0,0 +1,66 @@
+import os, tempfile, time, unittest
+from contextlib import contextmanager
+from unittest import mock
+
+from Modules import blob_gc, blobstore
+
+
+class FakeCursor:
+    """Answers the reference lookups from a set of referenced keys"""
+
+    def __init__(self, referenced):
+        self.referenced = referenced
+        self.rows = []
+
+    def execute(self, sql, params):
+        self.rows = [(key,) for key in params if key in self.referenced]
+
+    def fetchall(self):
+        return self.rows
+
+
+class SweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = blobstore.LocalBlobStore(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def put(self, data, age):
+        key = self.store.put(data)
+        stamp = time.time() - age
+        os.utime(self.store.path(key), (stamp, stamp))
+        return key
+
+    def sweep(self, referenced):
+        @contextmanager
+        def cursor():
+            yield FakeCursor(referenced)
+        with mock.patch.object(blob_gc.db, 'cursor', cursor):
+            return blob_gc.sweep(self.store, grace=3600, batch_size=2, log=lambda message: None)
+
+    def test_deletes_only_old_unreferenced_blobs(self):
+        orphan = self.put(b'orphan', age=7200)
+        kept = self.put(b'kept', age=7200)
+        recent = self.put(b'recent', age=60)
+        self.assertEqual(self.sweep({kept}), 1)
+        self.assertFalse(self.store.exists(orphan))
+        self.assertTrue(self.store.exists(kept))
+        self.assertTrue(self.store.exists(recent))
+
+    def test_storing_the_same_content_again_keeps_the_blob(self):
+        key = self.put(b'scan', age=7200)
+        self.store.put(b'scan')
+        self.assertEqual(self.sweep(set()), 0)
+        self.assertTrue(self.store.exists(key))
+
+    def test_keys_skip_temporary_files(self):
+        key = self.put(b'data', age=0)
+        open(os.path.join(self.directory.name, '.upload-partial'), 'wb').close()
+        self.assertEqual(list(self.store.keys()), [key])
+
+
+if __name__ == '__main__':
+    unittest.main()
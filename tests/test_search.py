@@ -0,0 +1,39 @@
+import re, sqlite3, unittest
+
+from Modules import search
+
+
+def run_count(sql, params):
+    """Execute count SQL on sqlite (same derived table rules for duplicate names)"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE patients (patient_id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, '
+                 'email TEXT, phone TEXT, blood_group TEXT, date_of_birth TEXT)')
+    conn.executemany('INSERT INTO patients VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     [(f'PAT{i:03}', 'Ana', f'Lee{i}', f'a{i}@x.org', None, 'O+' if i % 2 else 'A+', None)
+                      for i in range(5)])
+    return conn.execute(sql.replace('%s', '?'), params).fetchone()[0]
+
+
+class DoctorPatientCountTest(unittest.TestCase):
+
+    def test_select_list_repeats_the_order_columns(self):
+        sql, _ = search.doctor_patient_search_sql()
+        columns = [column.strip() for column in sql.split(' FROM ')[0][len('SELECT '):].split(',')]
+        self.assertGreater(len(columns), len(set(columns)))
+
+    def test_count_query_has_no_duplicate_derived_columns(self):
+        sql, params = search.doctor_patient_search_sql("priya sharma", "O+")
+        count_sql = search.count_sql(sql)
+        derived = re.search(r'FROM \((SELECT .*?) FROM ', count_sql).group(1)
+        self.assertEqual(derived, 'SELECT 1')
+        self.assertEqual(count_sql.count('%s'), len(params) + 1)
+
+    def test_count_query_runs(self):
+        sql, params = search.doctor_patient_search_sql(blood_group='O+')
+        self.assertEqual(run_count(search.count_sql(sql), params + [search.COUNT_CAP + 1]), 2)
+        sql, params = search.doctor_patient_search_sql()
+        self.assertEqual(run_count(search.count_sql(sql), params + [3]), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()